@@ -0,0 +1,143 @@
+"""
+Synthetic driver documents for benchmarks: passport data pages with a valid
+MRZ and vehicle licences with a plate, as photos in several orientations and
+sizes and as scanned or digital PDFs. Everything is generated in memory.
+"""
+import io
+import random
+from dataclasses import dataclass
+from typing import List
+
+import pymupdf
+from PIL import Image, ImageDraw, ImageFont
+
+from bot.handlers.local_extraction import MRZ_LINE_LENGTH, mrz_check_digit
+
+# Photo sizes as (width, height) of an upright document
+SIZES = {'scan': (1200, 850), 'phone': (3000, 2100)}
+ORIENTATIONS = (0, 90, 180, 270)
+
+SURNAMES = ['IVANOV', 'KARIMOV', 'RAHIMOV', 'YUSUPOV', 'TOSHMATOV']
+NAMES = ['IVAN', 'AZIZ', 'BOBUR', 'SARDOR', 'JASUR']
+
+
+@dataclass
+class Sample:
+    name: str
+    kind: str
+    data: bytes
+
+
+def mrz_lines(surname: str, name: str, number: str) -> List[str]:
+    """A TD3 MRZ whose check digits pass local_extraction.parse_td3."""
+    line1 = f"P<UZB{surname}<<{name}".ljust(MRZ_LINE_LENGTH, '<')
+    number = number.ljust(9, '<')
+    birth, expiry, personal = '850412', '300101', '<' * 14
+    line2 = (f"{number}{mrz_check_digit(number)}UZB{birth}{mrz_check_digit(birth)}M"
+             f"{expiry}{mrz_check_digit(expiry)}{personal}<")
+    composite = line2[0:10] + line2[13:20] + line2[21:43]
+    return [line1, line2 + str(mrz_check_digit(composite))]
+
+
+def document_lines(kind: str, serial: int) -> List[str]:
+    """The text of a document; serial makes every document of a run different."""
+    rng = random.Random(serial)
+    surname, name = rng.choice(SURNAMES), rng.choice(NAMES)
+    if kind == 'passport':
+        number = f"AA{rng.randrange(10 ** 7):07d}"
+        return [
+            'REPUBLIC OF UZBEKISTAN', 'PASSPORT',
+            f'SURNAME {surname}', f'GIVEN NAMES {name}',
+            f'PASSPORT NO {number}', 'AUTHORITY MIA 12345', 'DATE OF ISSUE 15.03.2019',
+            '', *mrz_lines(surname, name, number),
+        ]
+    plate = f"{rng.randrange(1, 99):02d} {rng.randrange(1000):03d} {''.join(rng.choices('ABEHKMOPTXY', k=3))}"
+    return [
+        "O'ZBEKISTON RESPUBLIKASI", 'TRANSPORT VOSITASINI RO`YXATDAN O`TKAZISH GUVOHNOMASI',
+        f'1. DAVLAT RAQAM BELGISI {plate}', '2. MARKASI MAN TGX', f'3. EGASI {surname} {name}',
+        f'SERIAL {serial:08d}',
+    ]
+
+
+def document_image(kind: str, size: str, serial: int) -> Image.Image:
+    """An upright document photo: dark text on a slightly tinted card."""
+    width, height = SIZES[size]
+    lines = document_lines(kind, serial)
+    image = Image.new('RGB', (width, height), (236, 232, 220))
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=height // 22)
+    y = height // 14
+    for line in lines:
+        draw.text((width // 20, y), line, fill=(20, 20, 30), font=font)
+        y += height // 13
+    return image
+
+
+def encode_photo(image: Image.Image, orientation: int, exif: bool = False) -> bytes:
+    """
+    JPEG of the image turned by orientation degrees. With exif the pixels stay
+    upright and only the EXIF Orientation tag says how the camera was held.
+    """
+    output = io.BytesIO()
+    if exif:
+        tag = {0: 1, 90: 6, 180: 3, 270: 8}[orientation]
+        # Pixels as the camera stored them, undone by the tag
+        stored = image.rotate({0: 0, 90: 90, 180: 180, 270: -90}[orientation], expand=True)
+        exif_data = Image.Exif()
+        exif_data[0x0112] = tag
+        stored.save(output, 'JPEG', quality=90, exif=exif_data)
+    else:
+        image.rotate(orientation, expand=True).save(output, 'JPEG', quality=90)
+    return output.getvalue()
+
+
+def scanned_pdf(photos: List[bytes]) -> bytes:
+    """A PDF with one page per photo and no text layer."""
+    document = pymupdf.open()
+    for photo in photos:
+        with Image.open(io.BytesIO(photo)) as image:
+            width, height = image.size
+        page = document.new_page(width=595, height=595 * height / width)
+        page.insert_image(page.rect, stream=photo)
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+def digital_pdf(kinds: List[str], serial: int) -> bytes:
+    """A PDF with a text layer, one page per document, as exported by office software."""
+    document = pymupdf.open()
+    for i, kind in enumerate(kinds):
+        page = document.new_page(width=842, height=595)
+        page.insert_text((40, 60), '\n'.join(document_lines(kind, serial + i)), fontname='cour', fontsize=14)
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+def build_corpus(serial: int = 0) -> List[Sample]:
+    """
+    Every variant once: photos of both documents in each size and orientation,
+    EXIF-rotated photos, and scanned and digital two-page PDFs.
+    Serials differ within a corpus, so the extraction cache never hits.
+    """
+    samples = []
+    for kind in ('passport', 'vehicle_licence'):
+        for size in SIZES:
+            image = document_image(kind, size, serial)
+            serial += 1
+            for orientation in ORIENTATIONS:
+                samples.append(Sample(f"{kind}_{size}_{orientation}.jpg", kind, encode_photo(image, orientation)))
+            samples.append(Sample(f"{kind}_{size}_exif90.jpg", kind, encode_photo(image, 90, exif=True)))
+
+    pages = [encode_photo(document_image(kind, 'scan', serial + i), 0) for i, kind in enumerate(('passport', 'vehicle_licence'))]
+    samples.append(Sample('scanned.pdf', 'mixed', scanned_pdf(pages)))
+    samples.append(Sample('digital.pdf', 'mixed', digital_pdf(['passport', 'vehicle_licence'], serial + 2)))
+    return samples
+
+
+def driver_documents(serial: int) -> List[Sample]:
+    """What a driver usually sends: a passport photo and a licence as a scanned PDF."""
+    passport = encode_photo(document_image('passport', 'phone', serial), 90)
+    licence = encode_photo(document_image('vehicle_licence', 'scan', serial + 1), 0)
+    return [Sample('passport.jpg', 'passport', passport), Sample('licence.pdf', 'vehicle_licence', scanned_pdf([licence]))]
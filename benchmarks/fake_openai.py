@@ -0,0 +1,170 @@
+"""
+Stand-in for the OpenAI chat completions API, for benchmarks without network.
+
+Answers structured output requests with valid documents after a configurable
+latency, and fails a configurable share of them with 503, 429 or a malformed
+reply. The document type follows the prompt, so the bot's parsing, re-asks
+and merging run as they do against the real API.
+
+    python -m benchmarks.fake_openai [--port 8765] [--latency 1.5] [--error-rate 0.05]
+
+then start the bot with OPENAI_BASE_URL=http://127.0.0.1:8765/v1.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Optional
+
+from aiohttp import web
+
+# Values that pass the checks in structured_output.FIELD_CHECKS
+SAMPLE_FIELDS = {
+    'driver_name': 'IVANOV IVAN IVANOVICH',
+    'passport_number': 'AA1234567',
+    'passport_authority': 'MIA 12345',
+    'passport_date_issued': '15/03/2019',
+    'number_plates': '01 123 ABC',
+}
+
+DOCUMENT_FIELDS = {
+    'passport': ['driver_name', 'passport_number', 'passport_authority', 'passport_date_issued'],
+    'vehicle_licence': ['number_plates'],
+}
+
+
+class FakeOpenAI:
+    """
+    An aiohttp app serving /v1/chat/completions.
+
+    latency and jitter are in seconds; error_rate, rate_limit_rate and
+    malformed_rate are the shares of requests answered with a 503, a 429
+    and a reply that does not match the schema.
+    """
+
+    def __init__(self, latency: float = 1.0, jitter: float = 0.3, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, malformed_rate: float = 0.0, seed: Optional[int] = None) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.malformed_rate = malformed_rate
+        self.random = random.Random(seed)
+
+        self.counters = {'requests': 0, 'errors': 0, 'rate_limited': 0, 'malformed': 0, 'images': 0}
+        self._runner: Optional[web.AppRunner] = None
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post('/v1/chat/completions', self.chat_completions)
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Start serving; returns the base URL for OPENAI_BASE_URL. Port 0 picks a free port."""
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        return f"http://{host}:{port}/v1"
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def chat_completions(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.counters['requests'] += 1
+
+        content = body['messages'][-1]['content']
+        prompt = next((part['text'] for part in content if part['type'] == 'text'), '')
+        images = sum(1 for part in content if part['type'] == 'image_url')
+        self.counters['images'] += images
+
+        await asyncio.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+
+        roll = self.random.random()
+        if roll < self.error_rate:
+            self.counters['errors'] += 1
+            return web.json_response({'error': {'message': 'The server is overloaded', 'type': 'server_error'}},
+                                     status=503)
+        if roll < self.error_rate + self.rate_limit_rate:
+            self.counters['rate_limited'] += 1
+            return web.json_response({'error': {'message': 'Rate limit reached', 'type': 'rate_limit_error'}},
+                                     status=429, headers={'Retry-After': '0.5'})
+
+        response_format = body.get('response_format', {}).get('json_schema', {})
+        if roll < self.error_rate + self.rate_limit_rate + self.malformed_rate:
+            self.counters['malformed'] += 1
+            reply = '{"documents": [{"document_type": "passport"'
+        else:
+            reply = json.dumps(self.answer(response_format, prompt, images), ensure_ascii=False)
+
+        return web.json_response({
+            'id': f"chatcmpl-fake-{self.counters['requests']}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'fake'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': reply, 'refusal': None},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': 100 + 800 * images, 'completion_tokens': 60, 'total_tokens': 160 + 800 * images},
+        })
+
+    @staticmethod
+    def answer(response_format: dict, prompt: str, images: int) -> dict:
+        """A reply matching the requested schema."""
+        schema = response_format.get('schema', {})
+        if response_format.get('name') != 'documents':
+            # A re-ask: only the requested fields
+            return {key: SAMPLE_FIELDS.get(key) for key in schema.get('properties', {})}
+
+        if prompt.startswith('Extract the passport'):
+            types = ['passport']
+        elif prompt.startswith('Extract the vehicle licence'):
+            types = ['vehicle_licence']
+        else:
+            # Combined prompt, the bot could not tell the type: the first image is
+            # the passport and the rest are licences, a single image counts as both
+            types = ['passport'] + ['vehicle_licence'] * max(1, images - 1)
+
+        documents = []
+        for document_type in types:
+            document = {key: None for key in SAMPLE_FIELDS}
+            document.update({key: SAMPLE_FIELDS[key] for key in DOCUMENT_FIELDS[document_type]})
+            documents.append({'document_type': document_type, **document})
+        return {'documents': documents}
+
+
+async def serve(args: argparse.Namespace) -> None:
+    server = FakeOpenAI(args.latency, args.jitter, args.error_rate, args.rate_limit_rate, args.malformed_rate, args.seed)
+    base_url = await server.start(args.host, args.port)
+    print(f"Fake OpenAI API on {base_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=1.0)
+    parser.add_argument('--jitter', type=float, default=0.3)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--malformed-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(serve(parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,157 @@
+"""
+Offline Telegram for benchmarks: a Bot API session that answers from memory
+and a driver that feeds updates for a whole DocumentFlow to the dispatcher.
+
+Updates go through Dispatcher.feed_update, so middlewares, filters, FSM
+storage and handlers run exactly as in production; only the HTTP calls to
+Telegram are replaced.
+"""
+import asyncio
+import itertools
+import time
+from collections import Counter, defaultdict
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageText, GetFile, SendDocument, SendMessage, TelegramMethod
+from aiogram.types import Update
+
+from benchmarks.corpus import Sample
+
+BOT_TOKEN = '42:BENCHMARK'
+
+
+class FakeTelegramSession(BaseSession):
+    """
+    Bot API session without network. Files registered with add_file can be
+    downloaded; sent messages and documents are kept per chat. latency is the
+    simulated round trip of every API call, in seconds.
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        super().__init__()
+        self.latency = latency
+        self.files: Dict[str, bytes] = {}
+        self.calls: Counter = Counter()
+        self.texts: Dict[int, List[str]] = defaultdict(list)
+        self.documents: Dict[int, List[str]] = defaultdict(list)
+        self.uploaded_bytes = 0
+        self._message_ids = itertools.count(1_000_000)
+
+    def add_file(self, file_id: str, data: bytes) -> None:
+        self.files[file_id] = data
+
+    def _message(self, chat_id: int, **fields) -> dict:
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            **fields,
+        }
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        await asyncio.sleep(self.latency)
+        self.calls[type(method).__name__] += 1
+
+        if isinstance(method, GetFile):
+            data = self.files[method.file_id]
+            result = {'file_id': method.file_id, 'file_unique_id': method.file_id,
+                      'file_size': len(data), 'file_path': method.file_id}
+        elif isinstance(method, SendMessage):
+            self.texts[method.chat_id].append(method.text)
+            result = self._message(method.chat_id, text=method.text)
+        elif isinstance(method, EditMessageText):
+            self.texts[method.chat_id].append(method.text)
+            result = self._message(method.chat_id, text=method.text)
+        elif isinstance(method, SendDocument):
+            # Handlers send BufferedInputFile, the bytes are at hand
+            self.uploaded_bytes += len(method.document.data)
+            self.documents[method.chat_id].append(method.document.filename)
+            result = self._message(method.chat_id, document={
+                'file_id': f'sent{self.calls["SendDocument"]}', 'file_unique_id': f'sent{self.calls["SendDocument"]}',
+                'file_name': method.document.filename,
+            })
+        else:
+            result = True
+
+        response = self.check_response(bot, method, 200, '{"ok": true, "result": %s}' % self.json_dumps(result))
+        return response.result
+
+    async def stream_content(self, url: str, headers: Optional[Dict[str, Any]] = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        await asyncio.sleep(self.latency)
+        data = self.files[url.rsplit('/', 1)[-1]]
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+
+    async def close(self) -> None:
+        pass
+
+
+class TelegramDriver:
+    """Plays users talking to the bot: builds updates and feeds them to the dispatcher."""
+
+    def __init__(self, dp: Dispatcher, latency: float = 0.0) -> None:
+        self.dp = dp
+        self.session = FakeTelegramSession(latency)
+        self.bot = Bot(BOT_TOKEN, session=self.session)
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _user(self, chat_id: int) -> dict:
+        return {'id': chat_id, 'is_bot': False, 'first_name': 'Benchmark'}
+
+    def _message(self, chat_id: int, **fields) -> dict:
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': self._user(chat_id),
+            **fields,
+        }
+
+    async def feed(self, **update) -> None:
+        update = Update.model_validate({'update_id': next(self._update_ids), **update}, context={'bot': self.bot})
+        await self.dp.feed_update(self.bot, update)
+
+    async def send_text(self, chat_id: int, text: str) -> None:
+        await self.feed(message=self._message(chat_id, text=text))
+
+    async def send_document(self, chat_id: int, sample: Sample) -> None:
+        file_id = f'{chat_id}_{next(self._message_ids)}_{sample.name}'
+        self.session.add_file(file_id, sample.data)
+        await self.feed(message=self._message(chat_id, document={
+            'file_id': file_id, 'file_unique_id': file_id, 'file_name': sample.name, 'file_size': len(sample.data),
+        }))
+
+    async def press_button(self, chat_id: int, data: str) -> None:
+        await self.feed(callback_query={
+            'id': str(next(self._update_ids)),
+            'from': self._user(chat_id),
+            'chat_instance': str(chat_id),
+            'message': self._message(chat_id, text='keyboard'),
+            'data': data,
+        })
+
+    async def document_flow(self, chat_id: int, documents: List[Sample], company: str, factory: str) -> bool:
+        """
+        One form from /new_form to the filled XLSX. The documents are sent at
+        once, as a user does. Returns whether the filled form was sent
+        without an error on the way.
+        """
+        # Imported here: the handlers module needs the bot's environment
+        from bot.handlers.user_handlers import DocumentCallback
+
+        await self.send_text(chat_id, '/new_form')
+        await self.send_text(chat_id, 'Tashkent')
+        await self.send_text(chat_id, 'Almaty')
+        await asyncio.gather(*(self.send_document(chat_id, sample) for sample in documents))
+        await self.send_text(chat_id, '/done')
+        await self.press_button(chat_id, DocumentCallback(action='company', value=company).pack())
+        await self.send_text(chat_id, factory)
+        sent = any(name.endswith('.xlsx') for name in self.session.documents[chat_id])
+        return sent and not any(text.startswith('❌') for text in self.session.texts[chat_id])
+
+    async def close(self) -> None:
+        await self.bot.session.close()
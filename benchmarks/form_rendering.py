@@ -0,0 +1,78 @@
+"""
+Form rendering benchmark: the zip patching engine against the openpyxl
+round-trip insert_data used before it.
+
+    python -m benchmarks.form_rendering [iterations]
+"""
+import io
+import statistics
+import sys
+import time
+import warnings
+from datetime import date, timedelta
+
+from openpyxl import load_workbook
+from openpyxl.drawing.image import Image
+
+from bot.handlers.data_insertion import insert_data
+from bot.handlers.form_templates import FORM_LAYOUTS, form_templates, template_path
+
+SAMPLE_DATA = {
+    'driver_name': 'ИВАНОВ ИВАН ИВАНОВИЧ',
+    'passport_series': 'AA',
+    'passport_number': '1234567',
+    'passport_authority': 'ТОШКЕНТ Ш. ЮНУСОБОД ТУМАНИ ИИБ',
+    'passport_date_issued': '01/02/2020',
+    'number_plates': '01 123 ABC/01 4567 AB',
+    'vendor_name': 'Завод',
+}
+
+
+def openpyxl_insert_data(organisation_name: str, extracted_data: dict) -> io.BytesIO:
+    """The previous implementation: load the workbook, set the cells, save it again."""
+    template = load_workbook(template_path(organisation_name))
+    ws = template.active
+    today = date.today()
+    ws['F10'] = today.strftime('%d/%m/%Y')
+    ws['F11'] = (today + timedelta(days=30)).strftime('%d/%m/%Y')
+
+    cells = form_templates.get(organisation_name).cells
+    for key, value in extracted_data.items():
+        if key in cells:
+            ws[cells[key]] = value
+
+    if organisation_name == 'kedr':
+        logo = Image(f'forms/{organisation_name}_logo.png')
+        logo.width = 100
+        logo.height = 100
+        ws.add_image(logo, 'C44')
+
+    output = io.BytesIO()
+    template.save(output)
+    return output
+
+
+def measure(func, organisation: str, iterations: int) -> list:
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func(organisation, SAMPLE_DATA)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main(iterations: int = 50) -> None:
+    warnings.simplefilter('ignore')
+    form_templates.load_all()
+
+    print(f"{'form':<12}{'engine':<10}{'p50 ms':>10}{'p95 ms':>10}{'size KB':>10}")
+    for organisation in FORM_LAYOUTS:
+        for name, func in (('openpyxl', openpyxl_insert_data), ('patch', insert_data)):
+            timings = sorted(measure(func, organisation, iterations))
+            size = len(func(organisation, SAMPLE_DATA).getvalue()) / 1024
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            print(f"{organisation:<12}{name:<10}{statistics.median(timings):>10.2f}{p95:>10.2f}{size:>10.1f}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -0,0 +1,260 @@
+"""
+Pipeline benchmark, offline: the fake OpenAI server answers the model calls
+and a fake Telegram session the Bot API calls.
+
+Scenarios:
+    extract_file   extraction of every corpus document, as the handlers run it
+    insert_data    filling every form template
+    document_flow  whole forms from /new_form to the sent XLSX, users in parallel
+
+    python -m benchmarks.pipeline [scenario ...] [--runs N] [--concurrency C]
+                                  [--latency S] [--error-rate R] [--json out.json]
+                                  [--baseline old.json] [--tolerance 0.25]
+
+Each scenario runs in its own process, so its peak RSS is its own. Reports
+throughput and p50/p95/p99 of the scenario and of every stage recorded by
+bot.telemetry. With --baseline the run fails when a p95 got worse than the
+tolerance allows, so CI shows regressions.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+SCENARIOS = ('extract_file', 'insert_data', 'document_flow')
+
+
+def configure_environment(work_dir: str) -> None:
+    """Settings for a run without Telegram, OpenAI or state from earlier runs. Set before bot imports."""
+    os.environ.setdefault('TOKEN_API', '42:BENCHMARK')
+    os.environ.setdefault('OPENAI_API', 'benchmark')
+    # The limiter is tuned for the real API; here it would only measure itself
+    os.environ.setdefault('OPENAI_REQUESTS_PER_MINUTE', '600000')
+    os.environ.setdefault('OPENAI_BURST', '1000')
+    os.environ['METRICS_PORT'] = '0'
+    os.environ['FSM_STORAGE'] = 'memory'
+    os.environ['EXTRACTION_CACHE_PATH'] = os.path.join(work_dir, 'extraction_cache.sqlite3')
+    os.environ['DRIVER_REGISTRY_PATH'] = os.path.join(work_dir, 'drivers.sqlite3')
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of unsorted values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def summarise(values: List[float]) -> dict:
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(values, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 2),
+    }
+
+
+async def run_concurrently(jobs, concurrency: int) -> List[float]:
+    """Run the job coroutine functions, at most concurrency at a time; returns their durations."""
+    semaphore = asyncio.Semaphore(concurrency)
+    durations = []
+
+    async def timed(job):
+        async with semaphore:
+            start = time.perf_counter()
+            await job()
+            durations.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(timed(job) for job in jobs))
+    return durations
+
+
+async def scenario_extract_file(args) -> List[float]:
+    from benchmarks.corpus import build_corpus
+    from bot.handlers.extraction_executor import extract_file
+
+    jobs = []
+    for run in range(args.runs):
+        for i, sample in enumerate(build_corpus(serial=run * 1000)):
+            async def job(sample=sample, chat_id=run * 1000 + i):
+                result = await extract_file(sample.data, sample.name, chat_id=chat_id)
+                if 'error' in result:
+                    print(f"[DEBUG] {sample.name}: {result['error']}")
+            jobs.append(job)
+    return await run_concurrently(jobs, args.concurrency)
+
+
+async def scenario_insert_data(args) -> List[float]:
+    from benchmarks.fake_openai import SAMPLE_FIELDS
+    from bot.handlers.data_insertion import insert_data
+    from bot.handlers.form_templates import FORM_LAYOUTS, form_templates
+
+    form_templates.load_all()
+    durations = []
+    for _ in range(args.runs * 20):
+        for organisation in FORM_LAYOUTS:
+            start = time.perf_counter()
+            insert_data(organisation, {**SAMPLE_FIELDS, 'vendor_name': 'Benchmark'})
+            durations.append(time.perf_counter() - start)
+    return durations
+
+
+async def scenario_document_flow(args) -> List[float]:
+    from benchmarks.corpus import driver_documents
+    from benchmarks.fake_telegram import TelegramDriver
+    from bot.handlers.form_templates import form_templates
+    from bot.app import create_dispatcher
+
+    form_templates.load_all()
+    driver = TelegramDriver(create_dispatcher(), latency=args.telegram_latency)
+    failed = []
+
+    jobs = []
+    for run in range(args.runs * args.concurrency):
+        async def job(chat_id=10_000 + run):
+            documents = driver_documents(serial=chat_id * 10)
+            if not await driver.document_flow(chat_id, documents, 'kedr', 'Benchmark'):
+                failed.append(chat_id)
+        jobs.append(job)
+
+    try:
+        durations = await run_concurrently(jobs, args.concurrency)
+    finally:
+        await driver.close()
+    if failed:
+        print(f"[DEBUG] {len(failed)} flows did not send a form")
+    return durations
+
+
+async def run_scenario(name: str, args) -> dict:
+    """Run one scenario in this process and collect its numbers."""
+    with tempfile.TemporaryDirectory(prefix='bench_') as work_dir:
+        configure_environment(work_dir)
+
+        from benchmarks.fake_openai import FakeOpenAI
+        server = FakeOpenAI(args.latency, args.jitter, args.error_rate, seed=args.seed)
+        os.environ['OPENAI_BASE_URL'] = await server.start()
+
+        from bot.handlers.extraction_executor import extraction_executor
+        from bot.handlers.model_router import model_router
+        from bot.handlers.pdf_rendering import pdf_converter
+        from bot.telemetry import telemetry
+
+        stages: Dict[str, List[float]] = defaultdict(list)
+        telemetry.add_listener(lambda stage, seconds: stages[stage].append(seconds))
+
+        start = time.perf_counter()
+        try:
+            durations = await globals()[f'scenario_{name}'](args)
+        finally:
+            elapsed = time.perf_counter() - start
+            await model_router.close()
+            await server.stop()
+            # Workers must exit before their peak RSS is reported
+            extraction_executor.shutdown(wait=True)
+            pdf_converter.close()
+
+    return {
+        'scenario': name,
+        'throughput_per_s': round(len(durations) / elapsed, 2) if elapsed else 0.0,
+        'total': summarise(durations),
+        'stages': {stage: summarise(values) for stage, values in sorted(stages.items())},
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'peak_worker_rss_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        'openai_requests': server.counters['requests'],
+    }
+
+
+def print_report(report: dict) -> None:
+    print(f"\n{report['scenario']}: {report['total']['count']} runs, {report['throughput_per_s']}/s, "
+          f"peak RSS {report['peak_rss_mb']} MB (workers {report['peak_worker_rss_mb']} MB), "
+          f"{report['openai_requests']} model calls")
+    print(f"{'stage':<22}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, numbers in [('total', report['total']), *report['stages'].items()]:
+        print(f"{stage:<22}{numbers['count']:>8}{numbers['p50_ms']:>10.1f}{numbers['p95_ms']:>10.1f}{numbers['p99_ms']:>10.1f}")
+
+
+def regressions(reports: List[dict], baseline: List[dict], tolerance: float) -> List[str]:
+    """p95s that grew by more than the tolerance against the baseline."""
+    old = {report['scenario']: report for report in baseline}
+    found = []
+    for report in reports:
+        if report['scenario'] not in old:
+            continue
+        before = {'total': old[report['scenario']]['total'], **old[report['scenario']]['stages']}
+        for stage, numbers in [('total', report['total']), *report['stages'].items()]:
+            if stage in before and numbers['p95_ms'] > before[stage]['p95_ms'] * (1 + tolerance) + 1:
+                found.append(f"{report['scenario']}/{stage}: p95 {before[stage]['p95_ms']} -> {numbers['p95_ms']} ms")
+    return found
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Offline pipeline benchmark')
+    parser.add_argument('scenarios', nargs='*', metavar='scenario', help=', '.join(SCENARIOS))
+    parser.add_argument('--runs', type=int, default=3, help='corpus passes, or flows per concurrent user')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.5, help='fake model latency, seconds')
+    parser.add_argument('--jitter', type=float, default=0.2)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of model calls answered with 503')
+    parser.add_argument('--telegram-latency', type=float, default=0.02, help='fake Bot API round trip, seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='write the reports to this file')
+    parser.add_argument('--baseline', help='reports of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--in-process', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    scenarios = args.scenarios or list(SCENARIOS)
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        print(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        return 2
+
+    if args.in_process:
+        report = asyncio.run(run_scenario(scenarios[0], args))
+        print('REPORT ' + json.dumps(report))
+        return 0
+
+    reports = []
+    forwarded = [arg for arg in (argv if argv is not None else sys.argv[1:]) if arg not in SCENARIOS]
+    for name in scenarios:
+        # A process per scenario keeps peak RSS and warm caches apart
+        result = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.pipeline', name, '--in-process', *forwarded],
+            stdout=subprocess.PIPE, text=True
+        )
+        lines = [line for line in result.stdout.splitlines() if line.startswith('REPORT ')]
+        if result.returncode != 0 or not lines:
+            print(f"{name} failed with exit code {result.returncode}")
+            return 1
+        report = json.loads(lines[-1][len('REPORT '):])
+        print_report(report)
+        reports.append(report)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(reports, json.load(f), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""
+Startup benchmark: where the import time of the bot process goes.
+
+    python -m benchmarks.startup [--runs 3] [--top 15] [--json out.json]
+
+Imports bot.app in fresh interpreters under `python -X importtime` and reports
+the wall time of the import, the import time of every top-level package (its
+own modules only, so the numbers add up) and the slowest modules of the bot.
+The best of --runs is kept, so a cold disk cache doesn't skew the result.
+The bot's own warm-up after polling begins is in its startup report log.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict
+
+from benchmarks.pipeline import configure_environment
+
+IMPORT_TIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+HEAVY_PACKAGES = ('openai', 'pymupdf', 'openpyxl', 'cv2')
+
+
+def measure(env: dict) -> dict:
+    """One import of the bot in a new interpreter."""
+    start = time.monotonic()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import bot.app'],
+                            env=env, capture_output=True, text=True)
+    wall = time.monotonic() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    packages: Dict[str, float] = defaultdict(float)
+    modules: Dict[str, float] = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_RE.match(line)
+        if match is None:
+            continue
+        own, cumulative, name = int(match.group(1)) / 1e6, int(match.group(2)) / 1e6, match.group(4)
+        packages[name.partition('.')[0]] += own
+        if name.startswith('bot'):
+            modules[name] = cumulative
+    return {'wall': wall, 'packages': dict(packages), 'modules': modules}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Import time of the bot process')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--json', help='write the report to this file')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        configure_environment(work_dir)
+        runs = [measure(dict(os.environ)) for _ in range(max(1, args.runs))]
+    report = min(runs, key=lambda run: run['wall'])
+
+    print(f"import bot.app: {report['wall']:.2f}s wall, best of {len(runs)}")
+    print(f"\n{'package':<28}{'import s':>10}")
+    for name, seconds in sorted(report['packages'].items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{name:<28}{seconds:>10.3f}")
+    print(f"\n{'bot module (cumulative)':<40}{'import s':>10}")
+    for name, seconds in sorted(report['modules'].items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{name:<40}{seconds:>10.3f}")
+
+    loaded = [name for name in HEAVY_PACKAGES if name in report['packages']]
+    print(f"\nHeavy packages imported at startup: {', '.join(loaded) or 'none'}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
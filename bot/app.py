@@ -0,0 +1,153 @@
+import time
+
+# The startup report counts from here, see bot/startup.py
+STARTED = time.monotonic()
+
+import asyncio
+import os
+from typing import Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import BotCommand
+
+from bot_instance import bot
+from bot.handlers.user_handlers import user_router
+from bot.handlers.batch_handlers import batch_router
+from bot.handlers.extraction_executor import extraction_executor
+from bot.handlers.model_router import model_router
+from bot.handlers.extraction_cache import extraction_cache
+from bot.handlers.pdf_rendering import pdf_converter
+from bot.handlers.driver_registry import driver_registry
+from bot.handlers.scheduler import extraction_scheduler
+from bot.handlers import single_flight
+from bot.handlers import structured_output
+
+from bot.config import BotConfig
+from bot.middlewares import AlbumMiddleware
+from bot.storage import build_storage
+from bot.startup import StartupReport, warm_up
+from bot.telemetry import start_metrics_server, telemetry
+from bot.webhook import Health, run_webhook
+
+# 'polling' or 'webhook', see bot/webhook.py for the webhook settings
+RUN_MODE = os.getenv('RUN_MODE', 'polling')
+# Seconds to wait for extractions in flight when shutting down
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', 60))
+
+_metrics_runner = None
+_warm_up_task: Optional[asyncio.Task] = None
+
+startup_report = StartupReport(STARTED)
+startup_report.mark('imports')
+
+
+def register_routers(dp: Dispatcher) -> None:
+    """Register routers for the bot."""
+
+    dp.include_router(user_router)
+    dp.include_router(batch_router)
+
+
+async def setup_bot_commands():
+    bot_commands = [
+        BotCommand(command="/start", description="Стартовать бота"),
+        BotCommand(command="/new_form", description="Создать новую доверенность"),
+        BotCommand(command="/batch", description="Доверенности на нескольких водителей"),
+        BotCommand(command="/driver", description="Водитель, который уже был"),
+        BotCommand(command="/done", description="Закончить загрузку документов"),
+        BotCommand(command="/end", description="Отменить форму")
+    ]
+    await bot.set_my_commands(bot_commands)   
+
+
+async def on_startup() -> None:
+    # Set up bot commands
+    await setup_bot_commands()
+    # Prometheus endpoint, see bot/telemetry.py
+    global _metrics_runner, _warm_up_task
+    _metrics_runner = await start_metrics_server(telemetry)
+    startup_report.mark('startup')
+    # Templates, model clients and workers load while the bot already takes updates
+    _warm_up_task = asyncio.create_task(warm_up(startup_report))
+
+
+async def on_shutdown(health: Optional[Health] = None) -> None:
+    """Drain extractions in flight, then release the workers and clients."""
+    if health is not None:
+        health.ready = False
+    if _warm_up_task is not None:
+        _warm_up_task.cancel()
+
+    if not await extraction_executor.drain(DRAIN_TIMEOUT):
+        print(f"[DEBUG] {extraction_executor.pending_jobs()} extraction jobs still running after {DRAIN_TIMEOUT}s")
+    extraction_executor.shutdown(wait=False)
+    await model_router.close()
+    await extraction_cache.close()
+    pdf_converter.close()
+    await driver_registry.close()
+    if _metrics_runner is not None:
+        await _metrics_runner.cleanup()
+
+
+def create_dispatcher() -> Dispatcher:
+    """Dispatcher with config, storage, routers and lifecycle hooks."""
+
+    config = BotConfig(
+        admin_ids=[1305675],  
+        welcome_message="""👋  Здравствуйте!
+
+🤖 Этот бот создаёт доверенности для водителей. 
+
+1. Нажмите команду /new_form чтобы создать новую доверенность. Доверенность создаётся на одного водителя. 
+2. Загрузите необходимые документы: паспорт водителя и свидетельства о регистрации автотранспортного средства. Бот принимает файлы формата PNG, JPG и PDF. 
+3. После того как вы загрузили все файлы, нажмите команду /done.
+4. Выберите фирму выдающую доверенность.
+5. Введите наименование завода для доверенности.
+{form_step}
+7. Нажмите команду /end чтобы отменить форму.
+
+📦 Для нескольких водителей сразу нажмите /batch.
+🔁 Водителя, для которого уже делали доверенность, не нужно загружать заново: на шаге документов нажмите /driver.
+""".format(form_step=(
+            "6. Бот создаст доверенность в форматах XLSX и PDF. Проверьте данные. "
+            if pdf_converter.available else
+            "6. Бот создаст доверенность в XLSX формате. Проверьте данные и сохраните этот файл в формате PDF. "
+        ))
+    )
+
+    # FSM storage is chosen by FSM_STORAGE, see bot/storage.py
+    dp = Dispatcher(storage=build_storage())
+    dp['config'] = config
+
+    # Albums reach the handlers as one call, see AlbumMiddleware
+    dp.message.outer_middleware(AlbumMiddleware())
+    register_routers(dp)
+
+    # Component counters are exported next to the stage histograms
+    for collector in (extraction_executor.metrics, extraction_scheduler.metrics, model_router.metrics,
+                      extraction_cache.metrics, pdf_converter.metrics, structured_output.metrics,
+                      driver_registry.metrics, single_flight.metrics, startup_report.metrics):
+        telemetry.add_collector(collector)
+
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    startup_report.mark('dispatcher')
+    return dp
+
+
+async def main(bot: Bot) -> None:
+    """Entry point for the bot in polling mode."""
+
+    dp = create_dispatcher()
+    # A webhook left over from webhook mode would block getUpdates
+    await bot.delete_webhook()
+    await dp.start_polling(bot)
+
+
+def run() -> None:
+    """Run the bot in RUN_MODE, see main.py."""
+    if RUN_MODE == 'webhook':
+        run_webhook(create_dispatcher(), bot)
+    else:
+        asyncio.run(main(bot))
+
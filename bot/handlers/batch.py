@@ -0,0 +1,129 @@
+import io
+import os
+import posixpath
+import re
+import zipfile
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from bot.handlers.data_extraction import get_file_type, merge_extracted
+
+load_dotenv()
+BATCH_MAX_FILES = int(os.getenv('BATCH_MAX_FILES', 100))
+# Refuse archives that would unpack to more than this, zip bombs included
+BATCH_MAX_UNPACKED_BYTES = int(os.getenv('BATCH_MAX_UNPACKED_BYTES', 200 * 1024 * 1024))
+
+PASSPORT_FIELDS = ('driver_name', 'passport_number')
+
+
+def is_zip(file_name: str) -> bool:
+    return file_name.lower().endswith('.zip')
+
+
+def unpack_zip(zip_data: bytes) -> List[Tuple[str, bytes]]:
+    """
+    The supported documents in an archive as (path, data), sorted by path.
+    Folders are kept in the path: a folder per driver groups their documents.
+    """
+    with zipfile.ZipFile(io.BytesIO(zip_data)) as archive:
+        entries = [
+            info for info in archive.infolist()
+            if not info.is_dir()
+            and not info.filename.startswith('__MACOSX/')
+            and not posixpath.basename(info.filename).startswith('.')
+            and get_file_type(info.filename) != 'unknown'
+        ]
+        if len(entries) > BATCH_MAX_FILES:
+            raise ValueError(f"В архиве больше {BATCH_MAX_FILES} документов")
+        if sum(info.file_size for info in entries) > BATCH_MAX_UNPACKED_BYTES:
+            raise ValueError("Архив слишком большой")
+
+        return sorted((info.filename, archive.read(info)) for info in entries)
+
+
+@dataclass
+class BatchFile:
+    """One extracted file of a batch, as kept in the FSM state."""
+    name: str
+    # Arrival order: message id, then position in the archive
+    order: Tuple[int, int]
+    # Files with the same group (archive folder or album) belong to one driver
+    group: Optional[str]
+    data: dict
+
+    def to_state(self) -> dict:
+        return {'name': self.name, 'order': list(self.order), 'group': self.group, 'data': self.data}
+
+    @classmethod
+    def from_state(cls, value: dict) -> 'BatchFile':
+        return cls(value['name'], tuple(value['order']), value['group'], value['data'])
+
+    @property
+    def is_passport(self) -> bool:
+        return any(self.data.get(key) for key in PASSPORT_FIELDS)
+
+
+@dataclass
+class DriverGroup:
+    files: List[BatchFile] = field(default_factory=list)
+    data: dict = field(default_factory=dict)
+
+    def add(self, batch_file: BatchFile) -> None:
+        self.files.append(batch_file)
+        merge_extracted(self.data, batch_file.data)
+
+    @property
+    def label(self) -> str:
+        return self.data.get('driver_name') or self.data.get('number_plates') or self.files[0].name
+
+    @property
+    def missing(self) -> List[str]:
+        missing = []
+        if not self.data.get('passport_number'):
+            missing.append('паспорт')
+        if not self.data.get('number_plates'):
+            missing.append('техпаспорт')
+        return missing
+
+
+def group_documents(files: List[BatchFile]) -> List[DriverGroup]:
+    """
+    Group the files of a batch by driver.
+
+    Files that came in the same archive folder or album form one group.
+    The rest are taken in arrival order: every passport starts a new driver,
+    and vehicle documents join the driver before them.
+    """
+    groups: Dict[str, DriverGroup] = {}
+    ordered: List[DriverGroup] = []
+    current: Optional[DriverGroup] = None
+
+    for batch_file in sorted(files, key=lambda f: f.order):
+        if batch_file.group is not None:
+            if batch_file.group not in groups:
+                groups[batch_file.group] = DriverGroup()
+                ordered.append(groups[batch_file.group])
+            groups[batch_file.group].add(batch_file)
+            continue
+
+        if current is None or (batch_file.is_passport and current.files and any(f.is_passport for f in current.files)):
+            current = DriverGroup()
+            ordered.append(current)
+        current.add(batch_file)
+
+    return ordered
+
+
+def safe_file_name(value: str) -> str:
+    return re.sub(r'[^\w\- ]+', '', value, flags=re.UNICODE).strip().replace(' ', '_')[:60] or 'driver'
+
+
+def build_archive(forms: List[Tuple[str, bytes]]) -> bytes:
+    """Zip the filled forms, given as (file name, data)."""
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in forms:
+            archive.writestr(name, data)
+    return output.getvalue()
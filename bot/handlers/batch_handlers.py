@@ -0,0 +1,265 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from aiogram import Bot, F, Router, types
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+
+from bot.handlers.batch import BatchFile, build_archive, group_documents, is_zip, safe_file_name, unpack_zip
+from bot.handlers.data_insertion import insert_data
+from bot.handlers.driver_registry import driver_registry
+from bot.handlers.extraction_executor import extract_file, extraction_executor
+from bot.handlers.pdf_rendering import pdf_converter
+from bot.handlers.scheduler import SchedulerBusy, extraction_scheduler
+from bot.handlers.single_flight import download
+from bot.handlers.user_handlers import DocumentCallback, get_company_keyboard, message_file, wait_uploads
+from bot.storage import pending_upload, state_lock, upload_cancelled
+from bot.telemetry import telemetry
+
+
+class BatchFlow(StatesGroup):
+    collecting = State()
+    waiting_company = State()
+    waiting_factory = State()
+
+
+batch_router = Router()
+
+# Status edits closer together than this are skipped, Telegram rate-limits them
+STATUS_EDIT_INTERVAL = 1.5
+
+_last_edit: Dict[int, float] = {}
+
+
+async def update_status(bot: Bot, chat_id: int, message_id: int, text: str, force: bool = False) -> None:
+    """Edit the batch's status message, at most every STATUS_EDIT_INTERVAL seconds unless forced."""
+    now = time.monotonic()
+    if not force and now - _last_edit.get(chat_id, 0) < STATUS_EDIT_INTERVAL:
+        return
+    _last_edit[chat_id] = now
+    try:
+        await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id)
+    except TelegramBadRequest as e:
+        # "message is not modified" and the like are harmless
+        print(f"[DEBUG] Status edit skipped: {e}")
+
+
+def progress_text(data: dict) -> str:
+    received = data.get('batch_received', 0)
+    processed = len(data.get('batch_files', [])) + len(data.get('batch_errors', []))
+    text = f"⏳ Получено документов: {received}\nОбработано: {processed}"
+    if data.get('batch_errors'):
+        text += f"\nОшибок: {len(data['batch_errors'])}"
+    return text
+
+
+@batch_router.message(Command('batch'))
+async def cmd_batch(msg: types.Message, state: FSMContext) -> None:
+    """Start a batch of authorisations for several drivers."""
+    extraction_executor.cancel_chat(msg.chat.id)
+    await state.clear()
+    await msg.answer(
+        "📦 Пакетный режим: доверенности на нескольких водителей.\n\n"
+        "Отправьте ZIP-архив с папкой на каждого водителя, альбом на каждого водителя "
+        "или документы по очереди: сначала паспорт водителя, затем его техпаспорта.\n"
+        "После отправки нажмите /done."
+    )
+    status = await msg.answer("⏳ Получено документов: 0")
+    await state.set_state(BatchFlow.collecting)
+    await state.update_data(batch_status=status.message_id, batch_received=0, batch_files=[], batch_errors=[])
+
+
+@batch_router.message(BatchFlow.collecting, F.content_type.in_(['document', 'photo']))
+async def batch_file(msg: types.Message, state: FSMContext, album: Optional[List[types.Message]] = None) -> None:
+    """Extract a file, an album or every document in a zip of the batch, as a job of the chat."""
+    try:
+        await extraction_executor.run_async(process_batch_file(msg, state, album), chat_id=msg.chat.id)
+    except asyncio.CancelledError:
+        # The batch was cancelled with /end while the file was processed
+        if asyncio.current_task().cancelling():
+            raise
+
+
+async def process_batch_file(msg: types.Message, state: FSMContext, album: Optional[List[types.Message]]) -> None:
+    """Extract the files of a message of the batch; marked in the FSM data while it runs, see pending_upload()."""
+    async with pending_upload(state) as upload:
+        chat_id = msg.chat.id
+        tickets = []
+        try:
+            files = [message_file(message) for message in album or [msg]]
+            with telemetry.span('telegram_download', files=len(files)):
+                downloads = await asyncio.gather(*(download(msg.bot, file) for file, _ in files))
+
+            entries, groups = [], []
+            for data, (_, file_name) in zip(downloads, files):
+                if not is_zip(file_name):
+                    entries.append((file_name, data))
+                    # An album is one driver
+                    groups.append(msg.media_group_id)
+                    continue
+
+                try:
+                    unpacked = await extraction_executor.run_io(unpack_zip, data, chat_id=chat_id)
+                except Exception as e:
+                    await msg.answer(f"❌ Не удалось открыть архив {file_name}: {e}")
+                    continue
+                entries.extend(unpacked)
+                # A folder in the archive is one driver
+                groups.extend(f"{msg.message_id}:{name.rpartition('/')[0]}" if '/' in name else None for name, _ in unpacked)
+
+            if not entries:
+                return
+
+            # A large archive may not fit in the extraction queue
+            try:
+                tickets = extraction_scheduler.admit(chat_id, len(entries))
+            except SchedulerBusy as e:
+                await msg.answer(f"⏳ {e}")
+                return
+
+            async with state_lock(state):
+                data = await state.get_data()
+                if upload_cancelled(data, upload):
+                    return
+                await state.update_data(batch_received=data.get('batch_received', 0) + len(entries))
+                data = await state.get_data()
+            await update_status(msg.bot, chat_id, data['batch_status'], progress_text(data))
+
+            async def extract_entry(index: int, name: str, file_data: bytes, group: Optional[str], ticket) -> None:
+                try:
+                    result = await extract_file(file_data, name, chat_id=chat_id, ticket=ticket)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    result = {"error": str(e) or type(e).__name__}
+
+                # Record every file as soon as it is done, so a large archive shows progress
+                async with state_lock(state):
+                    data = await state.get_data()
+                    if upload_cancelled(data, upload):
+                        # /end or a new batch on another worker
+                        return
+                    if 'error' in result:
+                        await state.update_data(batch_errors=data.get('batch_errors', []) + [f"{name}: {result['error']}"])
+                    else:
+                        done = BatchFile(name, (msg.message_id, index), group, result)
+                        await state.update_data(batch_files=data.get('batch_files', []) + [done.to_state()])
+                    data = await state.get_data()
+                await update_status(msg.bot, chat_id, data['batch_status'], progress_text(data))
+
+            await asyncio.gather(*(
+                extract_entry(index, name, file_data, group, ticket)
+                for index, ((name, file_data), group, ticket) in enumerate(zip(entries, groups, tickets))
+            ))
+
+            # Edits in between are throttled; the last one must not be skipped
+            data = await state.get_data()
+            if upload_cancelled(data, upload):
+                return
+            await update_status(msg.bot, chat_id, data['batch_status'], progress_text(data), force=True)
+
+        except Exception as e:
+            await msg.answer(f"❌ Ошибка обработки документа: {str(e)}")
+        finally:
+            for ticket in tickets:
+                extraction_scheduler.finish(ticket)
+
+
+@batch_router.message(BatchFlow.collecting, Command('done'))
+async def batch_done(msg: types.Message, state: FSMContext) -> None:
+    """Wait for the files still being extracted, then show the drivers found."""
+    chat_id = msg.chat.id
+    data = await state.get_data()
+
+    # Files sent right before /done may still be extracting
+    while not await wait_uploads(state, chat_id, timeout=STATUS_EDIT_INTERVAL):
+        data = await state.get_data()
+        await update_status(msg.bot, chat_id, data['batch_status'], progress_text(data))
+
+    data = await state.get_data()
+    groups = group_documents([BatchFile.from_state(value) for value in data.get('batch_files', [])])
+    if not groups:
+        await msg.answer("Не было обработано ни одного документа. Пожалуйста, загрузите документы.")
+        return
+
+    lines = [f"Водителей: {len(groups)}"]
+    for i, group in enumerate(groups, 1):
+        line = f"{i}. {group.label}"
+        if group.data.get('number_plates') and group.data.get('driver_name'):
+            line += f" — {group.data['number_plates']}"
+        if group.missing:
+            line += f" ⚠️ нет: {', '.join(group.missing)}"
+        lines.append(line)
+    for error in data.get('batch_errors', []):
+        lines.append(f"❌ {error}")
+    await update_status(msg.bot, chat_id, data['batch_status'], "\n".join(lines), force=True)
+
+    await msg.answer(
+        "Выберите компанию, которая выдала документы:",
+        reply_markup=get_company_keyboard(action="batch_company")
+    )
+    await state.set_state(BatchFlow.waiting_company)
+
+
+@batch_router.callback_query(DocumentCallback.filter(F.action == "batch_company"))
+async def batch_company_chosen(callback: types.CallbackQuery, callback_data: DocumentCallback, state: FSMContext):
+    if await state.get_state() != BatchFlow.waiting_company:
+        await callback.answer("Пожалуйста, начните новый пакет с /batch")
+        return
+
+    await state.update_data(company=callback_data.value)
+    await callback.message.edit_text(f"Выбрана компания: {callback_data.value}\n\nТеперь введите название завода:")
+    await state.set_state(BatchFlow.waiting_factory)
+    await callback.answer()
+
+
+@batch_router.message(BatchFlow.waiting_factory, F.text, ~F.text.startswith('/'))
+async def batch_factory_chosen(msg: types.Message, state: FSMContext):
+    """Fill a form for every driver of the batch and send them in one archive."""
+    chat_id = msg.chat.id
+    factory = msg.text
+    data = await state.get_data()
+    company = data.get('company')
+    status_id = data['batch_status']
+    groups = group_documents([BatchFile.from_state(value) for value in data.get('batch_files', [])])
+
+    try:
+        forms: List[tuple] = []
+        for i, group in enumerate(groups, 1):
+            with telemetry.span('template_fill'):
+                filled_form = insert_data(company, {**group.data, 'vendor_name': factory})
+            forms.append((f"{i:02d}_{safe_file_name(group.label)}.xlsx", filled_form.getvalue()))
+        await update_status(msg.bot, chat_id, status_id, f"⏳ Создано форм: {len(forms)}", force=True)
+
+        if pdf_converter.available:
+            pdfs = await asyncio.gather(*(pdf_converter.convert(xlsx) for _, xlsx in forms), return_exceptions=True)
+            failed = 0
+            for index, ((name, _), pdf_data) in enumerate(zip(list(forms), pdfs), 1):
+                if isinstance(pdf_data, BaseException):
+                    # The file name holds the driver's name, the form number is enough for the log
+                    print(f"[DEBUG] PDF conversion error for form {index:02d}: {pdf_data}")
+                    failed += 1
+                else:
+                    forms.append((name[:-len('.xlsx')] + '.pdf', pdf_data))
+            if failed:
+                await msg.answer(f"⚠️ Не удалось создать PDF для {failed} форм, сохраните XLSX в формате PDF вручную.")
+
+        archive = await extraction_executor.run_io(build_archive, forms, chat_id=chat_id)
+        with telemetry.span('telegram_upload'):
+            await msg.answer_document(
+                document=types.BufferedInputFile(archive, filename=f'{company}_forms.zip'),
+                caption=f"Доверенности для {factory}: {len(groups)}"
+            )
+        await update_status(msg.bot, chat_id, status_id, f"✅ Отправлено доверенностей: {len(groups)}", force=True)
+        for group in groups:
+            await driver_registry.save(msg.from_user.id, group.data)
+
+    except Exception as e:
+        await msg.answer(f"❌ Ошибка обработки формы: {str(e)}")
+
+    # Reset the state
+    _last_edit.pop(chat_id, None)
+    await state.clear()
@@ -1,44 +1,37 @@
-from openai import OpenAI
+import asyncio
+import io
 import os
 import base64
-import tempfile
-import pymupdf
-import shutil
-from contextlib import contextmanager
 from PIL import Image
 import exifread
 import pytesseract
-from typing import Tuple, Optional
-from dotenv import load_dotenv
+from dataclasses import dataclass, field
+from typing import List, Tuple, Optional
 
-load_dotenv()
-OPENAI_API = os.getenv('OPENAI_API')
-
-client = OpenAI(
-  api_key=OPENAI_API
+from bot.handlers.image_preprocessing import preprocess_image
+from bot.handlers.local_extraction import extract_local_fields, is_complete, merge_local_fields
+from bot.handlers.model_router import model_router
+from bot.handlers import structured_output
+from bot.telemetry import redact, stage_timer, telemetry
+from bot.handlers.structured_output import (
+    FIELD_CHECKS,
+    document_fields,
+    ExtractedDocument,
+    ExtractionResponse,
+    fields_model,
+    fields_to_reask,
+    parse_model,
+    reask_prompt,
+    response_format,
 )
 
-import base64
-import tempfile
-import pymupdf
-import shutil
-from contextlib import contextmanager
-
-def encode_image(image_path):
-    """
-    Encodes an image file to a base64 string.
-    """
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
-
-def get_exif_orientation(image_path: str) -> Optional[int]:
+def get_exif_orientation(image_data: bytes) -> Optional[int]:
     """
     Get image orientation from EXIF data.
     Returns rotation angle in degrees (0, 90, 180, or 270) or None if no EXIF data.
     """
     try:
-        with open(image_path, 'rb') as f:
-            tags = exifread.process_file(f)
+        tags = exifread.process_file(io.BytesIO(image_data), details=False)
             
         if 'Image Orientation' in tags:
             orientation = tags['Image Orientation'].values[0]
@@ -54,128 +47,238 @@ def get_exif_orientation(image_path: str) -> Optional[int]:
         print(f"[DEBUG] EXIF read error: {e}")
     return None
 
-def detect_text_orientation(image_path: str) -> Tuple[int, float]:
+# Keywords to look for in passports
+PASSPORT_KEYWORDS = ['PASSPORT', 'PASSPORT NO', 'SURNAME', 'GIVEN NAMES', 'REPUBLIC OF UZBEKISTAN']
+# Keywords to look for in licenses
+LICENSE_KEYWORDS = ['DAVLAT RAQAM BELGISI', 'RAQAM BELGISI']
+
+ROTATIONS = [0, 90, 180, 270]
+# Longest edge of the downscaled copy used for the quick orientation probe
+ORIENTATION_PROBE_EDGE = int(os.getenv('ORIENTATION_PROBE_EDGE', 1600))
+# A rotation scoring above this is a clear winner and stops the search
+ORIENTATION_EARLY_STOP = 0.5
+# Minimum Tesseract OSD confidence to take its angle without reading every rotation
+OSD_MIN_CONFIDENCE = 2.0
+
+def score_orientation_text(text: str) -> float:
+    """
+    Score OCR text by passport and licence keywords.
+    Returns the share of matched keywords of the better matching document type.
+    """
+    text = text.upper()
+    score = 0.0
+
+    # Check for passport keywords
+    passport_matches = sum(1 for keyword in PASSPORT_KEYWORDS if keyword in text)
+    if passport_matches > 0:
+        score = passport_matches / len(PASSPORT_KEYWORDS)
+
+    # Check for license keywords
+    license_matches = sum(1 for keyword in LICENSE_KEYWORDS if keyword in text)
+    if license_matches > 0:
+        score = max(score, license_matches / len(LICENSE_KEYWORDS))
+
+    return score
+
+def classify_document_text(text: str) -> Optional[str]:
+    """
+    Classify a document by the same keywords used for orientation.
+    Returns 'passport', 'vehicle_licence' or None when no keyword matched.
+    """
+    text = text.upper()
+    passport_score = sum(1 for keyword in PASSPORT_KEYWORDS if keyword in text) / len(PASSPORT_KEYWORDS)
+    license_score = sum(1 for keyword in LICENSE_KEYWORDS if keyword in text) / len(LICENSE_KEYWORDS)
+
+    if passport_score == license_score == 0:
+        return None
+    return 'passport' if passport_score >= license_score else 'vehicle_licence'
+
+def osd_rotation(img: Image.Image) -> Optional[int]:
+    """
+    Ask Tesseract OSD which way the text is turned.
+    Returns the counter-clockwise angle that makes the text upright, or None if OSD is unsure.
+    """
+    try:
+        osd = pytesseract.image_to_osd(img, output_type=pytesseract.Output.DICT)
+    except Exception as e:
+        # OSD fails on images with too little text
+        print(f"[DEBUG] OSD error: {e}")
+        return None
+
+    if osd.get('orientation_conf', 0) < OSD_MIN_CONFIDENCE:
+        return None
+    # OSD reports the clockwise correction, PIL rotates counter-clockwise
+    return (360 - int(osd['rotate'])) % 360
+
+def scan_orientations(img: Image.Image, angles) -> Tuple[dict, dict, Optional[int]]:
+    """
+    OCR the image at each angle in order and score it.
+    Returns the scores and texts so far and the angle that stopped the scan early, if any.
+    """
+    scores, texts = {}, {}
+    for angle in angles:
+        rotated = img.rotate(angle, expand=True) if angle != 0 else img
+        texts[angle] = pytesseract.image_to_string(rotated)
+        scores[angle] = score_orientation_text(texts[angle])
+        if scores[angle] > ORIENTATION_EARLY_STOP:
+            return scores, texts, angle
+    return scores, texts, None
+
+def detect_text_orientation(image: Image.Image) -> Tuple[int, float, Optional[str]]:
     """
     Detect document orientation using OCR.
-    Returns (rotation_angle, confidence_score)
+    Returns (rotation_angle, confidence_score, text), the text being the OCR
+    of the downscaled page at that rotation, so it needn't be read again.
+
+    Tesseract OSD is asked first on a downscaled grayscale copy; when it is
+    confident its angle is taken after one OCR pass. Otherwise the copy is
+    read at each rotation until one clearly wins, or the best one is taken.
     """
     try:
-        # Try different orientations
-        orientations = {
-            0: 0.0,   # Current orientation
-            90: 0.0,  # Rotated right
-            180: 0.0, # Upside down
-            270: 0.0  # Rotated left
-        }
-        
-        # Keywords to look for in passports
-        passport_keywords = ['PASSPORT', 'PASSPORT NO', 'SURNAME', 'GIVEN NAMES', 'REPUBLIC OF UZBEKISTAN']
-        # Keywords to look for in licenses
-        license_keywords = ['DAVLAT RAQAM BELGISI', 'RAQAM BELGISI']
-        
-        # Try each orientation
-        for angle in orientations.keys():
-            # Rotate image
-            img = Image.open(image_path)
-            if angle != 0:
-                img = img.rotate(angle, expand=True)
-            
-            # Perform OCR
-            text = pytesseract.image_to_string(img).upper()
-            
-            # Check for passport keywords
-            passport_matches = sum(1 for keyword in passport_keywords if keyword in text)
-            if passport_matches > 0:
-                orientations[angle] = passport_matches / len(passport_keywords)
-            
-            # Check for license keywords
-            license_matches = sum(1 for keyword in license_keywords if keyword in text)
-            if license_matches > 0:
-                orientations[angle] = max(orientations[angle], license_matches / len(license_keywords))
-        
-        # Get the best orientation
-        best_angle = max(orientations.items(), key=lambda x: x[1])
-        print(f"[DEBUG] OCR orientation scores: {orientations}")
-        return best_angle
-        
+        img = image.convert('L')
+
+        probe = img.copy()
+        probe.thumbnail((ORIENTATION_PROBE_EDGE, ORIENTATION_PROBE_EDGE))
+
+        osd_angle = osd_rotation(probe)
+        if osd_angle in ROTATIONS:
+            scores, texts, _ = scan_orientations(probe, [osd_angle])
+            print(f"[DEBUG] OCR orientation from OSD: {osd_angle} (score {scores[osd_angle]})")
+            return osd_angle, 1.0, texts[osd_angle]
+
+        scores, texts, winner = scan_orientations(probe, ROTATIONS)
+        print(f"[DEBUG] OCR orientation probe scores: {scores}")
+        if winner is None:
+            # Best orientation; with no keyword found at all that is 0 with no confidence
+            winner = max(scores, key=scores.get)
+        return winner, scores[winner], texts[winner]
+
     except Exception as e:
         print(f"[DEBUG] OCR error: {e}")
-        return 0, 0.0
+        return 0, 0.0, None
 
-def detect_document_orientation(image_path: str) -> Tuple[int, float]:
+def detect_document_orientation(image: Image.Image, image_data: Optional[bytes] = None,
+                                timings: Optional[dict] = None) -> Tuple[int, float, Optional[str]]:
     """
     Detect document orientation using EXIF data and OCR.
-    Returns (rotation_angle, confidence_score)
+    Returns (rotation_angle, confidence_score, text), text being None unless OCR read the page.
     """
-    print(f"\n[DEBUG] Starting orientation detection for: {image_path}")
+    timings = {} if timings is None else timings
+    print(f"\n[DEBUG] Starting orientation detection for {image.width}x{image.height} image")
     
     # First try EXIF data
-    exif_angle = get_exif_orientation(image_path)
+    with stage_timer(timings, 'exif_read'):
+        exif_angle = get_exif_orientation(image_data) if image_data else None
     if exif_angle is not None:
         print(f"[DEBUG] Found EXIF orientation: {exif_angle}°")
-        return exif_angle, 1.0
+        return exif_angle, 1.0, None
     
     # If no EXIF data, try OCR
     print("[DEBUG] No EXIF data, trying OCR detection...")
-    return detect_text_orientation(image_path)
+    with stage_timer(timings, 'ocr_orientation'):
+        return detect_text_orientation(image)
 
-def rotate_image(image_path: str, angle: int) -> str:
+@dataclass
+class PreparedImage:
+    # None when the local tier already read everything the document is needed for
+    image_url: Optional[str]
+    # Fields read and validated locally (MRZ, plates)
+    local_fields: dict = field(default_factory=dict)
+    # 'passport', 'vehicle_licence' or None, picks the prompt
+    doc_type: Optional[str] = None
+    # Seconds spent in each stage, recorded by the bot process (see telemetry)
+    timings: dict = field(default_factory=dict)
+
+def prepare_image(image: Image.Image, original_size: int, image_data: Optional[bytes] = None) -> PreparedImage:
     """
-    Rotates an image by the specified angle and returns the path to the rotated image.
+    Corrects the orientation of a decoded image, reads what it can locally,
+    then shrinks the image and encodes it as a base64 data URL for the model.
+    This is the CPU-bound part of the extraction (OCR, rotation, encoding).
     """
-    print(f"[DEBUG] Rotating image {image_path} by {angle}°")
-    
-    try:
-        img = Image.open(image_path)
-        if angle != 0:
-            img = img.rotate(angle, expand=True)
-        
-        # Save the rotated image
-        rotated_path = image_path.replace('.', '_rotated.')
-        img.save(rotated_path)
-        print(f"[DEBUG] Saved rotated image to: {rotated_path}")
-        
-        return rotated_path
-    except Exception as e:
-        print(f"[DEBUG] Rotation error: {e}")
-        return image_path
+    timings = {}
+
+    # Detect orientation
+    rotation_angle, confidence, text = detect_document_orientation(image, image_data, timings)
+    print(f"[DEBUG] Detected orientation - Angle: {rotation_angle}°, Confidence: {confidence:.2f}")
+
+    # If we're confident about the orientation and it's not 0 degrees
+    if confidence > 0.5 and rotation_angle != 0:
+        with stage_timer(timings, 'rotation'):
+            image = image.rotate(rotation_angle, expand=True)
+        print(f"[DEBUG] Rotated image by {rotation_angle}°")
+    else:
+        print(f"[DEBUG] Using original image (no rotation needed)")
+        if rotation_angle != 0:
+            # The text read was of a rotation that isn't applied
+            text = None
+
+    # Machine-readable fields don't need the model
+    with stage_timer(timings, 'local_ocr'):
+        local_fields, text = extract_local_fields(image, text)
+    doc_type = classify_document_text(text)
+    if is_complete(local_fields):
+        print("[DEBUG] Document fully read locally, skipping the model")
+        return PreparedImage(None, local_fields, doc_type, timings)
 
-def extract_text_from_openai_api(images):
+    # Crop, downscale and re-encode before sending it to the model
+    with stage_timer(timings, 'encoding'):
+        prepared = preprocess_image(image, original_size)
+        encoded = base64.b64encode(prepared.data).decode('utf-8')
+    print(f"[DEBUG] Pre-processed image: {prepared.original_size} -> {len(prepared.data)} bytes "
+          f"({prepared.bytes_saved} saved, {prepared.size[0]}x{prepared.size[1]})")
+
+    return PreparedImage(f"data:{prepared.mime_type};base64,{encoded}", local_fields, doc_type, timings)
+
+EXTRACTED_KEYS = ['driver_name', 'passport_series', 'passport_number', 'passport_authority', 'passport_date_issued', 'number_plates']
+NOT_EXTRACTED = 'not extracted'
+
+def combine_documents(documents):
     """
-    Sends the base64-encoded image to the OpenAI API and retrieves the extracted text.
+    Combine the dictionaries extracted from single documents into one result.
+    Plates of all vehicle licences are joined with '/'.
     """
-    print("\n[DEBUG] Starting image processing for OpenAI API")
-    
-    # Process each image for correct orientation
-    processed_images = []
-    for i, image_path in enumerate(images):
-        print(f"\n[DEBUG] Processing image {i+1}/{len(images)}: {image_path}")
-        
-        # Detect orientation
-        rotation_angle, confidence = detect_document_orientation(image_path)
-        print(f"[DEBUG] Detected orientation - Angle: {rotation_angle}°, Confidence: {confidence:.2f}")
-        
-        # If we're confident about the orientation and it's not 0 degrees
-        if confidence > 0.5 and rotation_angle != 0:
-            # Rotate the image
-            rotated_path = rotate_image(image_path, rotation_angle)
-            processed_images.append(rotated_path)
-            print(f"[DEBUG] Using rotated image: {rotated_path}")
-        else:
-            processed_images.append(image_path)
-            print(f"[DEBUG] Using original image (no rotation needed)")
-    
-    # encode every image
-    print("\n[DEBUG] Encoding images for API")
-    base64_images = [encode_image(image_path) for image_path in processed_images]
-    print(f'[DEBUG] number of images in base64_images: {len(base64_images)}')
+    number_plates = [i['number_plates'] for i in documents if 'number_plates' in i and i['number_plates']]
+    response_dict = dict.fromkeys(EXTRACTED_KEYS, NOT_EXTRACTED)
+    for i in documents:
+        response_dict.update(i)
+    response_dict['number_plates'] = '/'.join(list(set(number_plates)))
+
+    print(f'[DEBUG] printing response_text_3: {redact(response_dict)} ')
+    return response_dict
+
+def merge_extracted(files_data: dict, extracted: dict) -> dict:
+    """
+    Merge one extraction result into the data collected for a form.
+    Empty and 'not extracted' values never overwrite what we already have,
+    and plates from several licences are collected.
+    """
+    for key, value in extracted.items():
+        if not value or value == NOT_EXTRACTED:
+            continue
+        if key == 'number_plates' and files_data.get(key):
+            plates = files_data[key].split('/') + value.split('/')
+            value = '/'.join(dict.fromkeys(plates))
+        files_data[key] = value
+    return files_data
+
+async def extract_documents(image_urls: List[str], local_documents: List[dict], doc_type: Optional[str] = None) -> dict:
+    """
+    Asks the model about the images the local tier could not fully read and
+    merges its answer with the locally read fields. If the API fails, the
+    local fields are still returned when there are any, marked 'partial'.
+    """
+    documents = []
+    if image_urls:
+        documents = await request_documents(image_urls, doc_type)
+        if isinstance(documents, dict):
+            if not local_documents:
+                return documents
+            print(f"[DEBUG] API failed ({documents['error']}), using locally read fields only")
+            return {**merge_local_fields(combine_documents([]), local_documents, NOT_EXTRACTED), 'partial': True}
 
-    # dictionary with all the content
-    content_list = []
-    content_list.append({
-        "type": "text",
-        "text": """Extract the document information into a Python dictionary format (check all the documents). Based on the document type, extract only the relevant fields:
+    return merge_local_fields(combine_documents(documents), local_documents, NOT_EXTRACTED)
 
+PASSPORT_PROMPT = """
         For passport documents, extract these fields:
         {
             'driver_name': 'full name from passport including surname, name and patronymic',
@@ -183,7 +286,9 @@ def extract_text_from_openai_api(images):
             'passport_authority': 'from authority field from passport, usually starts with MIA',
             'passport_date_issued': 'date of issue in DD/MM/YYYY format'
         }
+"""
 
+LICENCE_PROMPT = """
         For vehicle license documents, extract only the vehicle licence plate / DAVLAT RAQAM BELGISI, found at line 1. and extract info only from the front side of the licence (the one that has the Uzbekistan flag and emblem). Uzbek license plates follow the format: ## ### AAA  (numbers-numbers-letters) or  ## #### AA (numbers-numbers-letters). Be very careful to distinguish between similar characters:
         * Number 1 vs Letter T or I
         * Number 8 vs Letter B  
@@ -191,103 +296,103 @@ def extract_text_from_openai_api(images):
         {
             'number_plates': 'vehicle license plate'
         }
+"""
 
-        Only extract information that is clearly visible and readable. Return ONLY the python dictionaries as a list, no additional text."""
-    })
-    
-    for i in range(len(base64_images)):
-        content_list.append({
-            "type": "image_url",
-            "image_url": {
-                "url": f"data:image/jpeg;base64,{base64_images[i]}"
-            }
-        })
+def build_prompt(doc_type: Optional[str] = None) -> str:
+    """
+    A short prompt for a document of known type, or the combined prompt
+    when the keyword classifier could not tell.
+    """
+    if doc_type == 'passport':
+        return ("Extract the passport information as JSON." + PASSPORT_PROMPT +
+                "\n        Only extract information that is clearly visible and readable, use null for anything else.")
+    if doc_type == 'vehicle_licence':
+        return ("Extract the vehicle licence information as JSON." + LICENCE_PROMPT +
+                "\n        Only extract information that is clearly visible and readable, use null for anything else.")
+    return ("Extract the document information as JSON, one entry per document (check all the documents). Based on the document type, extract only the relevant fields:\n" +
+            PASSPORT_PROMPT + LICENCE_PROMPT +
+            "\n        Only extract information that is clearly visible and readable, use null for anything else.")
+
+def image_content(image_urls: List[str]) -> List[dict]:
+    return [{"type": "image_url", "image_url": {"url": image_url}} for image_url in image_urls]
+
+async def ask_model(prompt: str, image_urls: List[str], model, name: str, route: str = 'default'):
+    """
+    One structured output request along a route of model backends (see
+    model_router). Returns the reply validated against the pydantic model,
+    or None when the reply did not match it.
+    """
+    content_list = [{"type": "text", "text": prompt}] + image_content(image_urls)
     print(f'[DEBUG] number of messages in content_list: {len(content_list)}')
-    try:
-        response = client.chat.completions.create(
-            model="gpt-5-mini",
+    with telemetry.span('api_call', schema=name, route=route, images=len(image_urls)):
+        response = await model_router.chat_completion(
+            route,
             messages=[
                 {
                     "role": "user",
                     "content": content_list
                 }
-            ]
+            ],
+            response_format=response_format(model, name)
         )
-        # Clean the response and convert to dictionary
-        try:
-            response_text = response.choices[0].message.content
-            print(f'[DEBUG] printing response_text_1: {response_text} ')
-            # Remove markdown code block formatting if present
-            response_text = response_text.replace("```python", "").replace("```", "").replace("```json", "").strip()
-            response_text = eval(response_text)
-            print(f'[DEBUG] printing response_text_2: {response_text} ')
-            
-            # Convert single dictionary to list if needed
-            if isinstance(response_text, dict):
-                response_text = [response_text]
-            
-            # Combine both dictionaries
-            number_plates = [i['number_plates'] for i in response_text if 'number_plates' in i and i['number_plates']]
-            keys = ['driver_name', 'passport_series', 'passport_number', 'passport_authority', 'passport_date_issued', 'number_plates']
-            default_value = 'not extracted'
-            response_dict = dict.fromkeys(keys, default_value)
-            for i in response_text:
-                response_dict.update(i)
-            response_dict['number_plates'] = '/'.join(list(set(number_plates)))
-
-            print(f'[DEBUG] printing response_text_3: {response_dict} ')
-            return response_dict
-        except Exception as e:
-            print(f"Error parsing dictionary response: {response.choices[0].message.content}")
-            return {"error": "Failed to parse response as dictionary"}
-    except Exception as e:
-        print(f"\nError extracting text from image {images}: {e}")
-        return {"error": str(e)}
+    message = response.choices[0].message
+    print(f'[DEBUG] printing response_text_1: {redact(message.content)} ')
 
-@contextmanager
-def temporary_directory():
-    """Context manager for creating and cleaning up a temporary directory"""
-    temp_dir = tempfile.mkdtemp()
-    try:
-        yield temp_dir
-    finally:
-        shutil.rmtree(temp_dir)
+    structured_output.counters['responses'] += 1
+    with telemetry.span('parse', schema=name):
+        parsed = parse_model(message.content, model)
+    if parsed is None:
+        structured_output.counters['malformed_responses'] += 1
+        print(f"Error parsing structured response: {redact(message.refusal or message.content)}")
+    return parsed
+
+async def reask_fields(document: ExtractedDocument, fields: List[str], image_urls: List[str]) -> None:
+    """Ask for a few missing or invalid fields only, and fill in what comes back valid."""
+    structured_output.counters['reasks'] += 1
+    answer = await ask_model(reask_prompt(fields), image_urls, fields_model(fields), 'reasked_fields', 'reask')
+    if answer is None:
+        return
+    for key in fields:
+        value = getattr(answer, key)
+        if value and FIELD_CHECKS[key](value):
+            setattr(document, key, value)
+            structured_output.counters['reask_fixed_fields'] += 1
 
-def convert_pdf_to_images(pdf_path, dpi=300):
+async def request_documents(image_urls, doc_type: Optional[str] = None):
     """
-    Convert each page of a PDF to an image and process it through the OpenAI API.
-    
-    Args:
-        pdf_path (str): Path to the PDF file
-        dpi (int): Resolution for the output images (default: 300)
-    
-    Returns:
-        dict: Dictionary containing extracted information or error message
+    Sends already encoded images (data URLs) to the model with a JSON schema
+    for the answer. Returns the list of per-document dictionaries, or an
+    error dictionary.
     """
     try:
-        pdf_document = pymupdf.open(pdf_path)
-        
-        with tempfile.TemporaryDirectory() as temp_dir:
-            images = []
-            for page_num in range(len(pdf_document)):
-                page = pdf_document.load_page(page_num)
-        
-                pix = page.get_pixmap(matrix=pymupdf.Matrix(dpi/72, dpi/72))
-                
-                # Create a unique filename for each page in the temporary directory
-                image_path = os.path.join(temp_dir, f"page_{page_num}.png")
-                pix.save(image_path)
-                images.append(image_path)
-            
-            # Process all images through the OpenAI API
-            return extract_text_from_openai_api(images)
-            
+        route = model_router.route(doc_type)
+        parsed = await ask_model(build_prompt(doc_type), image_urls, ExtractionResponse, 'documents', route)
+        if parsed is None:
+            # Nothing usable came back: one more try with the full request, on the re-ask route
+            parsed = await ask_model(build_prompt(doc_type), image_urls, ExtractionResponse, 'documents', 'reask')
+        if parsed is None:
+            return {"error": "Failed to parse response as dictionary"}
+
+        # Only ask again about the fields that need it, and only with the images they come from
+        reasks = []
+        for i, document in enumerate(parsed.documents):
+            fields = fields_to_reask(document)
+            if not fields:
+                continue
+            document_images = [image_urls[i]] if len(parsed.documents) == len(image_urls) else image_urls
+            print(f"[DEBUG] Re-asking {fields} for document {i + 1}")
+            reasks.append(reask_fields(document, fields, document_images))
+        await asyncio.gather(*reasks)
+
+        documents = [document_fields(document) for document in parsed.documents]
+        print(f'[DEBUG] printing response_text_2: {redact(documents)} ')
+        return documents
+    except asyncio.TimeoutError:
+        print("\nError extracting text from images: model request deadline exceeded")
+        return {"error": "Model request deadline exceeded"}
     except Exception as e:
-        print(f"Error processing PDF: {e}")
+        print(f"\nError extracting text from images: {e}")
         return {"error": str(e)}
-    finally:
-        if 'pdf_document' in locals():
-            pdf_document.close()
 
 def get_file_type(file_path):
     """Determine if file is PDF or image based on extension"""
@@ -300,13 +405,22 @@ def get_file_type(file_path):
     else:
         return 'unknown'
 
-def process_file(file_path):
-    file_type = get_file_type(file_path)
-    
-    if file_type == 'pdf':
-        return convert_pdf_to_images(file_path)
-    elif file_type == 'image':
-        return extract_text_from_openai_api([file_path])
-    else:
-        print(f"Unsupported file type: {file_path}")
-        return {"error": "Unsupported file type"}
+def prepare_file(file_data: bytes, file_name: str):
+    """
+    Encode a downloaded image without calling the API.
+    Returns a list of PreparedImage, or an error dictionary.
+    Runs in a worker process, see extraction_executor. PDFs go through pdf_engine.
+    """
+    file_type = get_file_type(file_name)
+
+    try:
+        if file_type == 'image':
+            image = Image.open(io.BytesIO(file_data))
+            image.load()
+            return [prepare_image(image, len(file_data), file_data)]
+    except Exception as e:
+        print(f"Error preparing file: {e}")
+        return {"error": str(e)}
+
+    print(f"Unsupported file type: {file_name}")
+    return {"error": "Unsupported file type"}
@@ -1,10 +1,14 @@
-from openpyxl import load_workbook
-from openpyxl.drawing.image import Image
 from datetime import date, timedelta
-import os
+import io
 
+from bot.handlers.form_templates import form_templates
 
-def insert_data(organisation_name, extracted_data, temp_dir):
+
+def insert_data(organisation_name, extracted_data):
+    """
+    Fill the organisation's form with the extracted data.
+    Returns the XLSX file in a memory buffer.
+    """
     # Validate input data
     if not isinstance(extracted_data, dict):
         raise ValueError(f"Expected dictionary for extracted_data, got {type(extracted_data)}")
@@ -12,62 +16,35 @@ def insert_data(organisation_name, extracted_data, temp_dir):
     if 'error' in extracted_data:
         raise ValueError(f"Error in extracted data: {extracted_data['error']}")
     
-    # Use the permanent forms directory for the template
-    template_path = f'forms/{organisation_name}_form.xlsx'
-    if not os.path.exists(template_path):
-        raise FileNotFoundError(f"Template file not found: {template_path}")
-    
-    # Use the temporary directory for the output file
-    output_path = os.path.join(temp_dir, f'{organisation_name}_form_filled.xlsx')
+    # Raises FileNotFoundError for an unknown organisation
+    form = form_templates.get(organisation_name)
     
     try:
-        template = load_workbook(template_path)
-        template_ws = template.active
-
         # Get current date and next month's date
         today = date.today()
         next_month = today + timedelta(days=30)  # TODO: change to next month
 
-        # Fill in the template with extracted data
-        template_ws['F10'] = today.strftime('%d/%m/%Y')
-        template_ws['F11'] = next_month.strftime('%d/%m/%Y')
-
-        # Map of cell positions to data keys
-        cell_mapping = {
-            'L20': 'driver_name',
-            'E22': 'passport_series',
-            'J22': 'passport_number',
-            'E23': 'passport_authority',
-            'E24': 'passport_date_issued',
-            'E25': 'number_plates',
-            'E28': 'vendor_name'  # TODO: make an if clause for palisandr bc it's E27 or fix the template
+        values = {
+            'form_date': today.strftime('%d/%m/%Y'),
+            'valid_until': next_month.strftime('%d/%m/%Y'),
         }
 
-        # Add logo to the template - TODO: figure out why this only happens for kedr
-        if organisation_name == 'kedr':
-            logo_path = f'forms/{organisation_name}_logo.png'
-            logo = Image(logo_path)
-            logo.width = 100
-            logo.height = 100
-            template_ws.add_image(logo, 'C44')
-
-        # Fill in each cell with corresponding data
-        for cell, key in cell_mapping.items():
+        # Collect the value for each mapped field, see form_templates for the cell map
+        for key in form.cells:
+            if key in values:
+                continue
             value = extracted_data.get(key)
             if value is None:
                 print(f"Warning: Missing data for key '{key}'")
             elif isinstance(value, list):
                 # Join list items with comma and space if it's a list - TODO: i think i can just remove this step and do it in data extraction instead
-                template_ws[cell] = '/ '.join(str(item) for item in value)
+                values[key] = '/ '.join(str(item) for item in value)
             else:
-                template_ws[cell] = value
+                values[key] = str(value)
 
-        template.save(output_path)
-        return output_path
+        # Only the sheet and its strings are rewritten, the rest of the template is copied as is
+        return io.BytesIO(form.render(values))
         
     except Exception as e:
         print(f"Error in insert_data: {str(e)}")
         raise
-
-
-
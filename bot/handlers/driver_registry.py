@@ -0,0 +1,225 @@
+import asyncio
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+REGISTRY_PATH = os.getenv('DRIVER_REGISTRY_PATH', 'data/drivers.sqlite3')
+# Suggestions shown for a search
+REGISTRY_SUGGESTIONS = int(os.getenv('DRIVER_REGISTRY_SUGGESTIONS', 10))
+# By default a user only finds the drivers of their own forms; 1 shares the registry between all users
+REGISTRY_SHARED = os.getenv('DRIVER_REGISTRY_SHARED', '0') == '1'
+
+# Driver fields the registry keeps; everything a form needs except the trip and the factory
+DRIVER_FIELDS = ('driver_name', 'passport_series', 'passport_number', 'passport_authority',
+                 'passport_date_issued', 'number_plates')
+
+
+def name_key(value: str) -> str:
+    """Upper case letters and single spaces, for prefix search by name."""
+    return ' '.join(re.sub(r'[^\w ]+', ' ', value.upper()).split())
+
+
+def plate_key(value: str) -> str:
+    """A plate without spaces, e.g. '01 123 ABC' -> '01123ABC'."""
+    return re.sub(r'\W+', '', value.upper())
+
+
+def name_suffixes(key: str) -> List[str]:
+    """The name from each of its words on, so a prefix search finds any word: 'A B C' -> 'A B C', 'B C', 'C'."""
+    words = key.split()
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+def prefix_range(prefix: str) -> tuple:
+    """Bounds for `column >= ? AND column < ?`, a prefix match the index can serve."""
+    return prefix, prefix + '\uffff'
+
+
+class DriverRegistry:
+    """
+    SQLite registry of drivers whose forms were completed, so repeat drivers
+    can be filled in without uploads. Drivers are keyed by passport number;
+    names (from each word on) and every plate seen with a driver are indexed
+    for prefix search.
+
+    Queries run on a thread of their own, like SQLiteStorage's: search runs on
+    every keystroke of an inline query and must not block the event loop.
+    """
+
+    def __init__(self, path: str, suggestions: int, shared: bool) -> None:
+        self.path = path
+        self.suggestions = suggestions
+        self.shared = shared
+        self._db: Optional[sqlite3.Connection] = None
+        self._thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix='driver-registry')
+
+        self.counters = {'saved': 0, 'searches': 0, 'used': 0}
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path)
+            self._db.row_factory = sqlite3.Row
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS drivers ('
+                'id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, passport_number TEXT NOT NULL, '
+                'name_key TEXT NOT NULL, driver_name TEXT NOT NULL, passport_series TEXT, '
+                'passport_authority TEXT, passport_date_issued TEXT, number_plates TEXT, '
+                'uses INTEGER NOT NULL DEFAULT 0, updated REAL NOT NULL, '
+                'UNIQUE (user_id, passport_number))'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS drivers_passport ON drivers (passport_number)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS drivers_name ON drivers (name_key)')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS plates ('
+                'plate_key TEXT NOT NULL, driver_id INTEGER NOT NULL REFERENCES drivers (id) ON DELETE CASCADE, '
+                'PRIMARY KEY (plate_key, driver_id))'
+            )
+            indexed = self._db.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'names'"
+            ).fetchone()
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS names ('
+                'name_key TEXT NOT NULL, driver_id INTEGER NOT NULL REFERENCES drivers (id) ON DELETE CASCADE, '
+                'PRIMARY KEY (name_key, driver_id))'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS names_driver ON names (driver_id)')
+            if not indexed:
+                # A registry written before the names were indexed
+                with self._db:
+                    for row in self._db.execute('SELECT id, name_key FROM drivers').fetchall():
+                        self._index_name(row['id'], row['name_key'])
+        return self._db
+
+    def _index_name(self, driver_id: int, key: str) -> None:
+        self.db.execute('DELETE FROM names WHERE driver_id = ?', (driver_id,))
+        self.db.executemany('INSERT OR IGNORE INTO names (name_key, driver_id) VALUES (?, ?)',
+                            [(suffix, driver_id) for suffix in name_suffixes(key)])
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._thread, func, *args)
+
+    async def save(self, user_id: int, fields: dict) -> Optional[int]:
+        """
+        Store the confirmed fields of a form. Returns the driver's id, or None
+        when the fields don't identify a driver (no name or passport number).
+        The latest plates replace the stored ones; older plates stay searchable.
+        """
+        return await self._run(self._save, user_id, fields)
+
+    def _save(self, user_id: int, fields: dict) -> Optional[int]:
+        if not fields.get('passport_number') or not fields.get('driver_name'):
+            return None
+
+        values = {key: fields.get(key) or None for key in DRIVER_FIELDS}
+        values['passport_number'] = plate_key(values['passport_number'])
+        with self.db:
+            self.db.execute(
+                'INSERT INTO drivers (user_id, passport_number, name_key, driver_name, passport_series, '
+                'passport_authority, passport_date_issued, number_plates, updated) '
+                'VALUES (:user_id, :passport_number, :name_key, :driver_name, :passport_series, '
+                ':passport_authority, :passport_date_issued, :number_plates, :updated) '
+                'ON CONFLICT (user_id, passport_number) DO UPDATE SET '
+                'name_key = excluded.name_key, driver_name = excluded.driver_name, '
+                'passport_series = excluded.passport_series, passport_authority = excluded.passport_authority, '
+                'passport_date_issued = excluded.passport_date_issued, '
+                'number_plates = COALESCE(excluded.number_plates, number_plates), updated = excluded.updated',
+                {**values, 'user_id': user_id, 'name_key': name_key(values['driver_name']), 'updated': time.time()}
+            )
+            driver_id = self.db.execute(
+                'SELECT id FROM drivers WHERE user_id = ? AND passport_number = ?',
+                (user_id, values['passport_number'])
+            ).fetchone()['id']
+            self._index_name(driver_id, name_key(values['driver_name']))
+            for plate in (values['number_plates'] or '').split('/'):
+                if plate_key(plate):
+                    self.db.execute('INSERT OR IGNORE INTO plates (plate_key, driver_id) VALUES (?, ?)',
+                                    (plate_key(plate), driver_id))
+
+        self.counters['saved'] += 1
+        return driver_id
+
+    async def search(self, user_id: int, query: str) -> List[dict]:
+        """
+        Drivers whose plate, surname (or any name) or passport number starts
+        with the query, most used first. An empty query lists the most used
+        drivers; a query with nothing to search for, e.g. only punctuation, finds none.
+        """
+        return await self._run(self._search, user_id, query)
+
+    def _search(self, user_id: int, query: str) -> List[dict]:
+        self.counters['searches'] += 1
+        owner = '' if self.shared else 'AND d.user_id = :user_id'
+        params = {'user_id': user_id, 'limit': self.suggestions}
+
+        if not query.strip():
+            rows = self.db.execute(
+                f'SELECT d.* FROM drivers d WHERE 1 {owner} ORDER BY d.uses DESC, d.updated DESC LIMIT :limit',
+                params
+            )
+            return [self._driver(row) for row in rows]
+        if not name_key(query):
+            return []
+
+        params['name_low'], params['name_high'] = prefix_range(name_key(query))
+        params['key_low'], params['key_high'] = prefix_range(plate_key(query))
+        rows = self.db.execute(
+            'SELECT d.* FROM drivers d WHERE d.id IN ('
+            '  SELECT driver_id FROM names WHERE name_key >= :name_low AND name_key < :name_high'
+            '  UNION SELECT id FROM drivers WHERE passport_number >= :key_low AND passport_number < :key_high'
+            '  UNION SELECT driver_id FROM plates WHERE plate_key >= :key_low AND plate_key < :key_high'
+            f') {owner} ORDER BY d.uses DESC, d.updated DESC LIMIT :limit',
+            params
+        )
+        return [self._driver(row) for row in rows]
+
+    async def get(self, user_id: int, driver_id: int) -> Optional[dict]:
+        """A driver's form fields, or None when the user can't see this driver."""
+        return await self._run(self._get, user_id, driver_id)
+
+    def _get(self, user_id: int, driver_id: int) -> Optional[dict]:
+        row = self.db.execute('SELECT * FROM drivers WHERE id = ?', (driver_id,)).fetchone()
+        if row is None or (not self.shared and row['user_id'] != user_id):
+            return None
+        return self._driver(row)
+
+    async def mark_used(self, driver_id: int) -> None:
+        """Count a form made from the registry, so frequent drivers come first."""
+        await self._run(self._mark_used, driver_id)
+
+    def _mark_used(self, driver_id: int) -> None:
+        with self.db:
+            self.db.execute('UPDATE drivers SET uses = uses + 1, updated = ? WHERE id = ?', (time.time(), driver_id))
+        self.counters['used'] += 1
+
+    @staticmethod
+    def _driver(row: sqlite3.Row) -> dict:
+        driver = {key: row[key] for key in DRIVER_FIELDS if row[key]}
+        driver['id'] = row['id']
+        return driver
+
+    def metrics(self) -> dict:
+        """Snapshot of the registry counters."""
+        return {'registry_' + key: value for key, value in self.counters.items()}
+
+    def _close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    async def close(self) -> None:
+        await self._run(self._close)
+        self._thread.shutdown()
+
+
+driver_registry = DriverRegistry(REGISTRY_PATH, REGISTRY_SUGGESTIONS, REGISTRY_SHARED)
@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from PIL import Image
+from dotenv import load_dotenv
+
+load_dotenv()
+CACHE_PATH = os.getenv('EXTRACTION_CACHE_PATH', 'data/extraction_cache.sqlite3')
+CACHE_TTL = float(os.getenv('EXTRACTION_CACHE_TTL', 30 * 24 * 3600))
+CACHE_MAX_ENTRIES = int(os.getenv('EXTRACTION_CACHE_MAX_ENTRIES', 5000))
+# Perceptual matching is opt-in: passports share one layout, so a loose
+# threshold could return another driver's data
+PHASH_ENABLED = os.getenv('EXTRACTION_CACHE_PHASH', '0') == '1'
+PHASH_MAX_DISTANCE = int(os.getenv('EXTRACTION_CACHE_PHASH_DISTANCE', 8))
+
+# 16x16 difference hash, 256 bits
+PHASH_SIZE = 16
+# The hash is indexed as 16 bands of 16 bits. Two hashes within a distance of
+# 15 bits share at least one band, so only entries sharing a band are compared
+PHASH_BANDS = 16
+PHASH_BAND_BITS = PHASH_SIZE * PHASH_SIZE // PHASH_BANDS
+# Most recently used entries compared per lookup: one form layout can fill a band
+PHASH_MAX_CANDIDATES = int(os.getenv('EXTRACTION_CACHE_PHASH_CANDIDATES', 500))
+
+
+def perceptual_hash(image_data: bytes) -> Optional[int]:
+    """
+    Difference hash of an image: similar photos of the same document
+    get hashes with a small Hamming distance.
+    """
+    try:
+        with Image.open(io.BytesIO(image_data)) as img:
+            # draft() lets JPEG decode at reduced size, which is much faster
+            img.draft('L', (PHASH_SIZE * 8, PHASH_SIZE * 8))
+            small = img.convert('L').resize((PHASH_SIZE + 1, PHASH_SIZE), Image.LANCZOS)
+    except Exception as e:
+        print(f"[DEBUG] Perceptual hash error: {e}")
+        return None
+
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(PHASH_SIZE):
+        for col in range(PHASH_SIZE):
+            left = pixels[row * (PHASH_SIZE + 1) + col]
+            right = pixels[row * (PHASH_SIZE + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def document_hashes(file_data: bytes, file_name: str,
+                    with_phash: bool = PHASH_ENABLED) -> Tuple[str, Optional[int]]:
+    """Returns the SHA-256 of the file bytes and, for images, an optional perceptual hash."""
+    digest = hashlib.sha256(file_data).hexdigest()
+
+    phash = None
+    if with_phash and not file_name.lower().endswith('.pdf'):
+        phash = perceptual_hash(file_data)
+    return digest, phash
+
+
+def phash_bands(phash: int) -> List[Tuple[int, int]]:
+    """(band, value) pairs under which a perceptual hash is indexed."""
+    mask = (1 << PHASH_BAND_BITS) - 1
+    return [(band, (phash >> (band * PHASH_BAND_BITS)) & mask) for band in range(PHASH_BANDS)]
+
+
+class ExtractionCache:
+    """
+    SQLite-backed cache of extraction results keyed by document hash,
+    with a TTL and least-recently-used eviction.
+
+    Queries run on a thread of their own, like SQLiteStorage's, so a lookup
+    never blocks the event loop.
+    """
+
+    def __init__(self, path: str, ttl: float, max_entries: int, phash_distance: int) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.phash_distance = phash_distance
+        self._db: Optional[sqlite3.Connection] = None
+        self._thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix='extraction-cache')
+
+        self.counters = {'hits': 0, 'phash_hits': 0, 'misses': 0}
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS extractions ('
+                'digest TEXT PRIMARY KEY, phash TEXT, result TEXT NOT NULL, '
+                'created REAL NOT NULL, accessed REAL NOT NULL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS extractions_accessed ON extractions (accessed)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS extractions_created ON extractions (created)')
+            indexed = self._db.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'phash_bands'"
+            ).fetchone()
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS phash_bands ('
+                'band INTEGER NOT NULL, value INTEGER NOT NULL, digest TEXT NOT NULL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS phash_bands_value ON phash_bands (band, value)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS phash_bands_digest ON phash_bands (digest)')
+            if not indexed:
+                # A cache written before the bands existed
+                with self._db:
+                    for digest, stored in self._db.execute(
+                        'SELECT digest, phash FROM extractions WHERE phash IS NOT NULL'
+                    ).fetchall():
+                        self._index_phash(digest, int(stored, 16))
+        return self._db
+
+    def _index_phash(self, digest: str, phash: int) -> None:
+        self.db.executemany(
+            'INSERT INTO phash_bands (band, value, digest) VALUES (?, ?, ?)',
+            [(band, value, digest) for band, value in phash_bands(phash)]
+        )
+
+    def _find_similar(self, phash: int, oldest: float) -> Optional[str]:
+        bands = phash_bands(phash)
+        rows = self.db.execute(
+            'SELECT digest, phash FROM extractions WHERE created >= ? AND digest IN ('
+            'SELECT digest FROM phash_bands WHERE ' + ' OR '.join(['(band = ? AND value = ?)'] * len(bands)) +
+            ') ORDER BY accessed DESC LIMIT ?',
+            (oldest, *(number for band in bands for number in band), PHASH_MAX_CANDIDATES)
+        )
+        best_digest, best_distance = None, self.phash_distance + 1
+        for digest, stored in rows:
+            distance = (int(stored, 16) ^ phash).bit_count()
+            if distance < best_distance:
+                best_digest, best_distance = digest, distance
+        return best_digest
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._thread, func, *args)
+
+    async def get(self, digest: str, phash: Optional[int] = None) -> Optional[dict]:
+        """Returns the cached result for a document, or None."""
+        return await self._run(self._get, digest, phash)
+
+    async def put(self, digest: str, phash: Optional[int], result: dict) -> None:
+        """Stores a result and evicts expired and least recently used entries."""
+        await self._run(self._put, digest, phash, result)
+
+    def _get(self, digest: str, phash: Optional[int]) -> Optional[dict]:
+        now = time.time()
+        oldest = now - self.ttl
+
+        row = self.db.execute(
+            'SELECT result FROM extractions WHERE digest = ? AND created >= ?',
+            (digest, oldest)
+        ).fetchone()
+        counter = 'hits'
+
+        if row is None and phash is not None:
+            similar = self._find_similar(phash, oldest)
+            if similar is not None:
+                digest = similar
+                row = self.db.execute('SELECT result FROM extractions WHERE digest = ?', (digest,)).fetchone()
+                counter = 'phash_hits'
+
+        if row is None:
+            self.counters['misses'] += 1
+            return None
+
+        with self.db:
+            self.db.execute('UPDATE extractions SET accessed = ? WHERE digest = ?', (now, digest))
+        self.counters[counter] += 1
+        return json.loads(row[0])
+
+    def _put(self, digest: str, phash: Optional[int], result: dict) -> None:
+        now = time.time()
+        with self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO extractions (digest, phash, result, created, accessed) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (digest, None if phash is None else format(phash, 'x'),
+                 json.dumps(result, ensure_ascii=False), now, now)
+            )
+            # Bands of a previous entry for the file are replaced too
+            self.db.execute('DELETE FROM phash_bands WHERE digest = ?', (digest,))
+
+            evicted = self.db.execute(
+                'SELECT digest FROM extractions WHERE created < ? UNION '
+                'SELECT digest FROM (SELECT digest FROM extractions ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                (now - self.ttl, self.max_entries)
+            ).fetchall()
+            self.db.executemany('DELETE FROM extractions WHERE digest = ?', evicted)
+            self.db.executemany('DELETE FROM phash_bands WHERE digest = ?', evicted)
+            if phash is not None:
+                self._index_phash(digest, phash)
+
+    def metrics(self) -> dict:
+        """Snapshot of the hit and miss counters."""
+        return {'cache_' + key: value for key, value in self.counters.items()}
+
+    def _close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    async def close(self) -> None:
+        await self._run(self._close)
+        self._thread.shutdown()
+
+
+extraction_cache = ExtractionCache(CACHE_PATH, CACHE_TTL, CACHE_MAX_ENTRIES, PHASH_MAX_DISTANCE)
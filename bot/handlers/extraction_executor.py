@@ -0,0 +1,438 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+from bot.handlers.data_extraction import (
+    PreparedImage,
+    extract_documents,
+    get_file_type,
+    merge_extracted,
+    prepare_file,
+)
+from bot.handlers.pdf_engine import stream_pdf_pages
+from bot.handlers.extraction_cache import document_hashes, extraction_cache
+from bot.handlers.scheduler import Ticket, extraction_scheduler
+from bot.handlers.single_flight import FlightAbandoned, extraction_flights
+from bot.telemetry import telemetry
+
+load_dotenv()
+PROCESS_WORKERS = int(os.getenv('EXTRACTION_PROCESS_WORKERS', os.cpu_count() or 1))
+THREAD_WORKERS = int(os.getenv('EXTRACTION_THREAD_WORKERS', 8))
+JOB_TIMEOUT = float(os.getenv('EXTRACTION_JOB_TIMEOUT', 180))
+# 'forkserver' or 'spawn'; neither forks the parent, which runs an event loop and threads
+START_METHOD = os.getenv('EXTRACTION_START_METHOD',
+                         'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+# Imported by every extraction worker before its first document
+WORKER_MODULES = ('pymupdf', 'bot.handlers.data_extraction', 'bot.handlers.pdf_engine')
+
+
+class ExtractionExecutor:
+    """
+    Runs blocking extraction work off the event loop.
+
+    CPU-bound work (OCR, PDF rendering, image encoding) goes to a process pool,
+    blocking I/O (API calls) goes to a thread pool. Every job is tracked by chat
+    so that /end can cancel whatever the user still has in flight.
+    """
+
+    def __init__(self, process_workers: int, thread_workers: int, job_timeout: float) -> None:
+        self.process_workers = max(1, process_workers)
+        self.thread_workers = max(1, thread_workers)
+        self.job_timeout = job_timeout
+
+        # Pools are created on first use so importing this module stays cheap
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._slots: Dict[str, asyncio.Semaphore] = {}
+        self._jobs: Dict[int, Set[asyncio.Task]] = {}
+        self._active: Set[asyncio.Task] = set()
+
+        self.queued = {'cpu': 0, 'io': 0}
+        self.running = {'cpu': 0, 'io': 0}
+        self.counters = {'completed': 0, 'failed': 0, 'timed_out': 0, 'cancelled': 0}
+
+    def _pool(self, kind: str) -> Executor:
+        if kind == 'cpu':
+            if self._process_pool is None:
+                context = multiprocessing.get_context(START_METHOD)
+                if START_METHOD == 'forkserver':
+                    # The server imports the extraction modules once; every worker,
+                    # a replacement for a crashed one too, is forked from it ready
+                    context.set_forkserver_preload(list(WORKER_MODULES))
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=self.process_workers,
+                    mp_context=context
+                )
+            return self._process_pool
+
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(
+                max_workers=self.thread_workers,
+                thread_name_prefix='extraction-io'
+            )
+        return self._thread_pool
+
+    def _slot(self, kind: str) -> asyncio.Semaphore:
+        # One slot per pool worker, so waiting jobs are visible as queue depth
+        if kind not in self._slots:
+            size = self.process_workers if kind == 'cpu' else self.thread_workers
+            self._slots[kind] = asyncio.Semaphore(size)
+        return self._slots[kind]
+
+    async def _execute(self, kind: str, func, *args):
+        loop = asyncio.get_running_loop()
+        slot = self._slot(kind)
+
+        self.queued[kind] += 1
+        try:
+            await slot.acquire()
+        finally:
+            self.queued[kind] -= 1
+
+        self.running[kind] += 1
+        future = self._pool(kind).submit(func, *args)
+
+        def release(_):
+            # The worker is only free once the underlying call really returns,
+            # even if we stopped waiting for it because of a timeout or /end
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self._release, kind)
+
+        future.add_done_callback(release)
+
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), self.job_timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            self.counters['timed_out'] += 1
+            raise
+        except asyncio.CancelledError:
+            future.cancel()
+            self.counters['cancelled'] += 1
+            raise
+        except Exception:
+            self.counters['failed'] += 1
+            raise
+
+        self.counters['completed'] += 1
+        return result
+
+    def _release(self, kind: str) -> None:
+        self.running[kind] -= 1
+        self._slot(kind).release()
+
+    async def _track(self, chat_id: Optional[int], coro):
+        task = asyncio.create_task(coro)
+        self._active.add(task)
+        task.add_done_callback(self._active.discard)
+
+        if chat_id is not None:
+            jobs = self._jobs.setdefault(chat_id, set())
+            jobs.add(task)
+            task.add_done_callback(lambda t: self._forget(chat_id, t))
+
+        return await task
+
+    def _forget(self, chat_id: int, task: asyncio.Task) -> None:
+        jobs = self._jobs.get(chat_id)
+        if jobs is None:
+            return
+        jobs.discard(task)
+        if not jobs:
+            del self._jobs[chat_id]
+
+    async def run_cpu(self, func, *args, chat_id: Optional[int] = None):
+        """Run a CPU-bound function in the process pool."""
+        return await self._track(chat_id, self._execute('cpu', func, *args))
+
+    async def run_io(self, func, *args, chat_id: Optional[int] = None):
+        """Run a blocking I/O function in the thread pool."""
+        return await self._track(chat_id, self._execute('io', func, *args))
+
+    async def run_async(self, coro, chat_id: Optional[int] = None):
+        """Run a coroutine as a job of the chat, so /end cancels it too."""
+        return await self._track(chat_id, coro)
+
+    def cancel_chat(self, chat_id: int) -> int:
+        """Cancel every queued or running job of a chat. Returns how many were cancelled."""
+        extraction_scheduler.purge_chat(chat_id)
+        jobs = self._jobs.pop(chat_id, set())
+        for task in jobs:
+            task.cancel()
+        return len(jobs)
+
+    def chat_jobs(self, chat_id: int) -> int:
+        """Number of jobs of a chat that are queued or running."""
+        return len(self._jobs.get(chat_id, ()))
+
+    async def wait_chat(self, chat_id: int, timeout: Optional[float] = None) -> bool:
+        """
+        Wait up to `timeout` seconds for the jobs of a chat.
+        Returns True once the chat has nothing left in flight.
+        """
+        jobs = self._jobs.get(chat_id)
+        if jobs:
+            await asyncio.wait(set(jobs), timeout=timeout)
+        return not self._jobs.get(chat_id)
+
+    def pending_jobs(self) -> int:
+        """Number of jobs that are queued or running."""
+        return len(self._active)
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        Wait for the jobs in flight to finish, at most `timeout` seconds.
+        Returns False if some were still running when the time was up.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        # Handlers still running may start their next job, so wait until nothing is left
+        while self._active:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            print(f"[DEBUG] Draining {len(self._active)} extraction jobs")
+            await asyncio.wait(set(self._active), timeout=remaining)
+        return True
+
+    def metrics(self) -> dict:
+        """Snapshot of queue depths and job counters."""
+        return {
+            'cpu_queued': self.queued['cpu'],
+            'cpu_running': self.running['cpu'],
+            'io_queued': self.queued['io'],
+            'io_running': self.running['io'],
+            'chats_with_jobs': len(self._jobs),
+            **self.counters,
+        }
+
+    async def warm_up(self, func, *args) -> list:
+        """
+        Start every worker process now and run func(*args) in each, so the first
+        documents after a (re)start don't wait for workers to spawn and import
+        the extraction modules. Returns the results.
+        """
+        loop = asyncio.get_running_loop()
+        pool = self._pool('cpu')
+        return await asyncio.gather(*(loop.run_in_executor(pool, func, *args) for _ in range(self.process_workers)))
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop the worker pools."""
+        for pool in (self._process_pool, self._thread_pool):
+            if pool is not None:
+                pool.shutdown(wait=wait, cancel_futures=True)
+        self._process_pool = None
+        self._thread_pool = None
+
+
+extraction_executor = ExtractionExecutor(PROCESS_WORKERS, THREAD_WORKERS, JOB_TIMEOUT)
+
+
+async def prepared_documents(file_data: bytes, file_name: str,
+                             chat_id: Optional[int] = None) -> AsyncIterator[PreparedImage]:
+    """
+    Yields every document of a file as soon as it is rendered and prepared:
+    a photo is one document, a PDF has one per page.
+    """
+    if get_file_type(file_name) == 'pdf':
+        async for page in stream_pdf_pages(file_data, extraction_executor, chat_id):
+            telemetry.record(page.prepared.timings)
+            yield page.prepared
+        return
+
+    prepared = await extraction_executor.run_cpu(prepare_file, file_data, file_name, chat_id=chat_id)
+    if isinstance(prepared, dict):
+        # prepare_file reports unsupported or broken files as an error dict
+        raise ValueError(prepared['error'])
+    for image in prepared:
+        # Stage timings measured in the worker process
+        telemetry.record(image.timings)
+        yield image
+
+
+async def extract_file_documents(file_data: bytes, file_name: str, chat_id: Optional[int] = None,
+                                 ticket: Optional[Ticket] = None) -> AsyncIterator[dict]:
+    """
+    Extract a file document by document and yield each result as soon as it is ready.
+
+    OCR and rendering run in the process pool. Every document that still needs
+    the model gets its own request with a prompt for its type, and all requests
+    run concurrently with the rendering of the remaining pages. Documents seen
+    before are answered from the extraction cache, and a file that is being
+    extracted already gets the results of that extraction.
+
+    A file that has to be extracted waits for its turn in extraction_scheduler,
+    with the ticket the handler got on admission or a new one, and only then
+    leads the extraction: a leader never waits in the queue behind the uploads
+    that follow it. A follower gives its ticket back while it waits. The ticket
+    is given back when the file is done.
+    """
+    try:
+        digest, phash = await extraction_executor.run_io(document_hashes, file_data, file_name, chat_id=chat_id)
+        cached = await extraction_cache.get(digest, phash)
+
+        while cached is None:
+            # The same file is being extracted already, e.g. sent twice: share its results
+            flight = extraction_flights.join(digest)
+            if flight is not None:
+                if ticket is not None:
+                    extraction_scheduler.finish(ticket)
+                    ticket = None
+                try:
+                    results = await extraction_flights.wait(flight)
+                except FlightAbandoned:
+                    continue
+                print(f"[DEBUG] Shared the extraction in flight for {digest[:12]}")
+                for result in results:
+                    yield result
+                return
+
+            if ticket is None:
+                ticket, = extraction_scheduler.admit(chat_id)
+            if ticket.state == 'running':
+                break
+            await ticket.wait()
+            # Another upload of the file may have been extracted while this one waited
+            cached = await extraction_cache.get(digest, phash)
+
+        if cached is not None:
+            print(f"[DEBUG] Extraction cache hit for {digest[:12]}")
+            yield cached
+            return
+
+        flight = extraction_flights.lead(digest)
+        results = []
+        try:
+            async for result in extract_new_file_documents(file_data, file_name, digest, phash, chat_id):
+                results.append(result)
+                yield result
+        except BaseException:
+            # Cancelled, stopped early or failed: whoever waits extracts the file itself
+            extraction_flights.abandon(digest, flight)
+            raise
+        extraction_flights.finish(digest, flight, results)
+    finally:
+        if ticket is not None:
+            extraction_scheduler.finish(ticket)
+
+
+async def extract_new_file_documents(file_data: bytes, file_name: str, digest: str, phash: Optional[int],
+                                     chat_id: Optional[int] = None) -> AsyncIterator[dict]:
+    """extract_file_documents for a file that is neither cached nor in flight."""
+    finished: asyncio.Queue = asyncio.Queue()
+    tasks = []
+
+    async def extract(image: PreparedImage) -> dict:
+        return await extraction_executor.run_async(extract_documents(
+            [image.image_url] if image.image_url else [],
+            [image.local_fields] if image.local_fields else [],
+            image.doc_type
+        ), chat_id=chat_id)
+
+    async def dispatch() -> None:
+        async for image in prepared_documents(file_data, file_name, chat_id):
+            task = asyncio.create_task(extract(image))
+            task.add_done_callback(finished.put_nowait)
+            tasks.append(task)
+
+    dispatcher = asyncio.create_task(dispatch())
+    dispatcher.add_done_callback(finished.put_nowait)
+
+    combined, failed = {}, False
+    dispatched, received = False, 0
+    try:
+        while not dispatched or received < len(tasks):
+            task = await finished.get()
+
+            if task is dispatcher:
+                dispatched = True
+                error = None if task.cancelled() else task.exception()
+                if error is not None and not isinstance(error, asyncio.TimeoutError):
+                    # Rendering failed: report it, documents already dispatched still finish
+                    print(f"Error preparing file: {error}")
+                    failed = True
+                    yield {"error": str(error)}
+                    continue
+                task.result()
+                continue
+
+            received += 1
+            result = task.result()
+            # Only the locally read fields, the model couldn't be asked: shown but not cached
+            partial = result.pop('partial', False)
+            if 'error' in result or partial:
+                failed = True
+            else:
+                merge_extracted(combined, result)
+            yield result
+    finally:
+        # The consumer stopped early, was cancelled or a job failed
+        dispatcher.cancel()
+        for task in tasks:
+            task.cancel()
+
+    if combined and not failed:
+        await extraction_cache.put(digest, phash, combined)
+
+
+async def extract_files_documents(files: List[Tuple[bytes, str]], chat_id: Optional[int] = None,
+                                  tickets: Optional[List[Ticket]] = None) -> AsyncIterator[dict]:
+    """
+    extract_file_documents for several files at once, e.g. an album:
+    all files are extracted concurrently and results are yielded as they come.
+    tickets, when given, are the files' tickets from admission, in order.
+    """
+    finished: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    async def consume(index: int, file_data: bytes, file_name: str, ticket: Optional[Ticket]) -> None:
+        try:
+            async for result in extract_file_documents(file_data, file_name, chat_id, ticket):
+                finished.put_nowait(result)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            # One slow file doesn't stop the others
+            finished.put_nowait({"error": f"file {index} of {len(files)}: timed out"})
+        except Exception as e:
+            # Uploaded file names may hold the driver's name, so only the position is logged
+            print(f"Error extracting file {index} of {len(files)}: {e}")
+            finished.put_nowait({"error": str(e) or type(e).__name__})
+        finally:
+            finished.put_nowait(done)
+
+    tickets = tickets or [None] * len(files)
+    tasks = [asyncio.create_task(consume(index, file_data, file_name, ticket))
+             for index, ((file_data, file_name), ticket) in enumerate(zip(files, tickets), 1)]
+    remaining = len(tasks)
+    try:
+        while remaining:
+            result = await finished.get()
+            if result is done:
+                remaining -= 1
+                continue
+            yield result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def extract_file(file_data: bytes, file_name: str, chat_id: Optional[int] = None,
+                       ticket: Optional[Ticket] = None) -> dict:
+    """
+    Extracts all documents of a file and returns the merged result.
+    """
+    combined, error = {}, None
+    async for result in extract_file_documents(file_data, file_name, chat_id, ticket):
+        if 'error' in result:
+            error = result
+        else:
+            merge_extracted(combined, result)
+    if not combined and error is not None:
+        return error
+    return combined
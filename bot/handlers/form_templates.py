@@ -0,0 +1,103 @@
+import os
+from dataclasses import dataclass
+from typing import Dict
+
+from dotenv import load_dotenv
+
+from bot.handlers.xlsx_patch import XlsxTemplate, cell_position, load_template, patch_template
+
+load_dotenv()
+FORMS_DIR = os.getenv('FORMS_DIR', 'forms')
+
+# Form field -> cell, shared by every organisation's template
+DEFAULT_CELLS = {
+    'form_date': 'F10',
+    'valid_until': 'F11',
+    'driver_name': 'L20',
+    'passport_series': 'E22',
+    'passport_number': 'J22',
+    'passport_authority': 'E23',
+    'passport_date_issued': 'E24',
+    'number_plates': 'E25',
+    'vendor_name': 'E28',
+}
+
+# Where each organisation's template differs from the defaults
+FORM_LAYOUTS = {
+    'chinwood': {},
+    'kedr': {},
+    # The "На получение от" line is one row higher in this template
+    'palisandr': {'cells': {'vendor_name': 'E27'}},
+}
+
+
+@dataclass
+class FormTemplate:
+    organisation: str
+    xlsx: XlsxTemplate
+    cells: Dict[str, str]
+    # Modification time of the file the template was loaded from
+    mtime: float = 0.0
+
+    def render(self, values: Dict[str, str]) -> bytes:
+        """The filled XLSX file. Fields without a cell in this template are ignored."""
+        return patch_template(self.xlsx, {
+            self.cells[key]: value for key, value in values.items() if key in self.cells
+        })
+
+
+def template_path(organisation: str) -> str:
+    return os.path.join(FORMS_DIR, f'{organisation}_form.xlsx')
+
+
+def validate_template(template: FormTemplate) -> None:
+    """Every mapped cell must be writable: a plain cell or the top-left cell of a merged range."""
+    for key, cell in template.cells.items():
+        if cell_position(cell) in template.xlsx.covered_cells:
+            raise ValueError(f"Template {template.organisation}: cell {cell} for '{key}' is inside a merged range")
+
+
+class TemplateRegistry:
+    """
+    Form templates loaded once and kept in memory, split into their zip
+    parts. A template is reloaded when its file changes on disk.
+    """
+
+    def __init__(self, layouts: Dict[str, dict]) -> None:
+        self.layouts = layouts
+        self._templates: Dict[str, FormTemplate] = {}
+
+    def _load(self, organisation: str, mtime: float) -> FormTemplate:
+        with open(template_path(organisation), 'rb') as f:
+            data = f.read()
+
+        template = FormTemplate(
+            organisation,
+            load_template(data),
+            cells={**DEFAULT_CELLS, **self.layouts[organisation].get('cells', {})},
+            mtime=mtime,
+        )
+        validate_template(template)
+        print(f"[DEBUG] Loaded form template: {organisation}")
+        return template
+
+    def get(self, organisation: str) -> FormTemplate:
+        """The organisation's template, reloaded if its file changed."""
+        path = template_path(organisation)
+        if organisation not in self.layouts or not os.path.exists(path):
+            raise FileNotFoundError(f"Template file not found: {path}")
+
+        mtime = os.stat(path).st_mtime
+        template = self._templates.get(organisation)
+        if template is None or template.mtime != mtime:
+            template = self._load(organisation, mtime)
+            self._templates[organisation] = template
+        return template
+
+    def load_all(self) -> None:
+        """Load and validate every template, so a broken one shows up at startup."""
+        for organisation in self.layouts:
+            self.get(organisation)
+
+
+form_templates = TemplateRegistry(FORM_LAYOUTS)
@@ -0,0 +1,120 @@
+import io
+import os
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from PIL import Image, ImageChops, ImageFilter, ImageStat
+from dotenv import load_dotenv
+
+load_dotenv()
+# Longest edge sent to the model; an MRZ stays readable well below 300 DPI
+MAX_EDGE = int(os.getenv('IMAGE_MAX_EDGE', 2000))
+OUTPUT_FORMAT = os.getenv('IMAGE_OUTPUT_FORMAT', 'JPEG').upper()
+OUTPUT_QUALITY = int(os.getenv('IMAGE_OUTPUT_QUALITY', 85))
+# Images with a lower mean saturation (0-255) are sent in grayscale
+GRAYSCALE_MAX_SATURATION = int(os.getenv('IMAGE_GRAYSCALE_MAX_SATURATION', 40))
+
+MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp'}
+
+# Pixels differing from the background by more than this count as document
+CROP_THRESHOLD = 40
+# Keep a margin around the detected document, as a share of its size
+CROP_MARGIN = 0.03
+# Only crop when the document covers between these shares of the image
+CROP_MIN_AREA = 0.3
+CROP_MAX_AREA = 0.95
+
+
+@dataclass
+class PreprocessedImage:
+    data: bytes
+    mime_type: str
+    original_size: int
+    size: Tuple[int, int]
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_size - len(self.data)
+
+
+def document_bbox(img: Image.Image) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Find the document on a photo by comparing every pixel with the background colour,
+    estimated from the image border. Returns None if there is nothing sensible to crop.
+    """
+    # The search runs on a small copy, the box is scaled back afterwards
+    gray = img.convert('L')
+    gray.thumbnail((512, 512))
+    scale_x = img.width / gray.width
+    scale_y = img.height / gray.height
+    width, height = gray.size
+
+    # Median of a thin frame around the image is the background
+    border = max(1, min(width, height) // 50)
+    frame = []
+    for box in ((0, 0, width, border), (0, height - border, width, height),
+                (0, 0, border, height), (width - border, 0, width, height)):
+        frame.extend(gray.crop(box).getdata())
+    background = sorted(frame)[len(frame) // 2]
+
+    diff = ImageChops.difference(gray, Image.new('L', gray.size, background))
+    # The median filter drops noise and thin lines so they don't stretch the box
+    mask = diff.point(lambda p: 255 if p > CROP_THRESHOLD else 0).filter(ImageFilter.MedianFilter(5))
+    bbox = mask.getbbox()
+    if bbox is None:
+        return None
+
+    left, top, right, bottom = bbox
+    area = (right - left) * (bottom - top) / (width * height)
+    if not CROP_MIN_AREA <= area <= CROP_MAX_AREA:
+        return None
+
+    margin_x = (right - left) * CROP_MARGIN
+    margin_y = (bottom - top) * CROP_MARGIN
+    return (
+        max(0, int((left - margin_x) * scale_x)),
+        max(0, int((top - margin_y) * scale_y)),
+        min(img.width, int((right + margin_x) * scale_x)),
+        min(img.height, int((bottom + margin_y) * scale_y)),
+    )
+
+
+def is_grayscale_safe(img: Image.Image) -> bool:
+    """Colour carries no information when the image is barely saturated."""
+    if img.mode in ('L', '1'):
+        return True
+
+    thumb = img.convert('RGB')
+    thumb.thumbnail((256, 256))
+    saturation = ImageStat.Stat(thumb.convert('HSV').getchannel('S')).mean[0]
+    return saturation <= GRAYSCALE_MAX_SATURATION
+
+
+def preprocess_image(img: Image.Image, original_size: int) -> PreprocessedImage:
+    """
+    Prepare an upright image for the vision model: crop to the document,
+    downscale to MAX_EDGE, drop colour when it is safe, and re-encode in memory.
+    """
+    bbox = document_bbox(img)
+    if bbox is not None:
+        img = img.crop(bbox)
+
+    if max(img.size) > MAX_EDGE:
+        img = img.copy()
+        img.thumbnail((MAX_EDGE, MAX_EDGE), Image.LANCZOS)
+
+    if is_grayscale_safe(img):
+        img = img.convert('L')
+    elif img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    output_format = OUTPUT_FORMAT if OUTPUT_FORMAT in MIME_TYPES else 'JPEG'
+    buffer = io.BytesIO()
+    img.save(buffer, format=output_format, quality=OUTPUT_QUALITY, optimize=True)
+
+    return PreprocessedImage(
+        data=buffer.getvalue(),
+        mime_type=MIME_TYPES[output_format],
+        original_size=original_size,
+        size=img.size
+    )
@@ -0,0 +1,210 @@
+import os
+import re
+from datetime import date
+from typing import List, Optional, Tuple
+
+import pytesseract
+from PIL import Image
+from dotenv import load_dotenv
+
+load_dotenv()
+LOCAL_EXTRACTION = os.getenv('LOCAL_EXTRACTION', '1') == '1'
+# 'ocrb' reads MRZ noticeably better if its traineddata is installed
+MRZ_TESSERACT_LANG = os.getenv('MRZ_TESSERACT_LANG', 'eng')
+
+MRZ_CONFIG = '--psm 6 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789<'
+MRZ_LINE_LENGTH = 44
+# Longest edge for the full-page OCR pass
+OCR_MAX_EDGE = 1600
+
+# Uzbek plates: ## ### AAA or ## #### AA
+PLATE_PATTERN = re.compile(r'\b(\d{2})\s?(\d{3})\s?([A-Z]{3})\b|\b(\d{2})\s?(\d{4})\s?([A-Z]{2})\b')
+PLATE_LABEL = 'RAQAM BELGISI'
+# The plate is printed right after its label on the licence
+PLATE_SEARCH_WINDOW = 80
+
+# OCR confusions that are safe to fix where MRZ expects digits
+DIGIT_FIXES = str.maketrans({'O': '0', 'Q': '0', 'D': '0', 'I': '1', 'L': '1', 'Z': '2', 'S': '5', 'B': '8', 'G': '6'})
+
+
+def mrz_check_digit(value: str) -> int:
+    """ICAO 9303 check digit: weights 7, 3, 1; '<' counts as 0, letters as 10-35."""
+    total = 0
+    for i, char in enumerate(value):
+        if char.isdigit():
+            number = int(char)
+        elif char.isalpha():
+            number = ord(char) - ord('A') + 10
+        else:
+            number = 0
+        total += number * (7, 3, 1)[i % 3]
+    return total % 10
+
+
+def parse_mrz_date(value: str, future: bool) -> Optional[str]:
+    """YYMMDD to DD/MM/YYYY. Birth dates are in the past, expiry dates may be in the future."""
+    try:
+        year, month, day = int(value[0:2]), int(value[2:4]), int(value[4:6])
+        century = 2000 if (year <= date.today().year % 100 + (20 if future else 0)) else 1900
+        parsed = date(century + year, month, day)
+    except ValueError:
+        return None
+    return parsed.strftime('%d/%m/%Y')
+
+
+def parse_td3(line1: str, line2: str) -> Optional[dict]:
+    """
+    Parse a passport (TD3) MRZ. Returns None unless every check digit matches.
+    """
+    if len(line1) != MRZ_LINE_LENGTH or len(line2) != MRZ_LINE_LENGTH or not line1.startswith('P'):
+        return None
+
+    # Digits are expected everywhere in line 2 except the document number,
+    # nationality, sex and the personal number
+    line2 = ''.join(
+        char.translate(DIGIT_FIXES) if i in range(13, 20) or i in range(21, 28) or i in (9, 42, 43) else char
+        for i, char in enumerate(line2)
+    )
+
+    number, number_check = line2[0:9], line2[9]
+    birth, birth_check = line2[13:19], line2[19]
+    expiry, expiry_check = line2[21:27], line2[27]
+    personal, personal_check = line2[28:42], line2[42]
+    composite = line2[0:10] + line2[13:20] + line2[21:43]
+
+    checks = [
+        (number, number_check),
+        (birth, birth_check),
+        (expiry, expiry_check),
+        (composite, line2[43]),
+    ]
+    # An empty personal number may have '<' as its check digit
+    if personal.strip('<') or personal_check != '<':
+        checks.append((personal, personal_check))
+
+    for value, check in checks:
+        if not check.isdigit() or mrz_check_digit(value) != int(check):
+            return None
+
+    names = line1[5:].split('<<', 1)
+    surname = names[0].replace('<', ' ').strip()
+    given_names = names[1].replace('<', ' ').strip() if len(names) > 1 else ''
+
+    return {
+        'driver_name': f"{surname} {given_names}".strip(),
+        'passport_number': number.replace('<', ''),
+        'date_of_birth': parse_mrz_date(birth, future=False),
+        'date_of_expiry': parse_mrz_date(expiry, future=True),
+    }
+
+
+def find_mrz(text: str) -> Optional[dict]:
+    """Look for two consecutive lines of OCR text that form a valid TD3 MRZ."""
+    lines = [re.sub(r'\s+', '', line).upper() for line in text.splitlines()]
+    lines = [line for line in lines if len(line) >= MRZ_LINE_LENGTH - 2]
+
+    for line1, line2 in zip(lines, lines[1:]):
+        # OCR tends to lose or add filler characters at the end
+        line1 = line1[:MRZ_LINE_LENGTH].ljust(MRZ_LINE_LENGTH, '<')
+        line2 = line2[:MRZ_LINE_LENGTH].ljust(MRZ_LINE_LENGTH, '<')
+        parsed = parse_td3(line1, line2)
+        if parsed:
+            return parsed
+    return None
+
+
+def find_plates(text: str, require_label: bool = True) -> List[str]:
+    """
+    Find plates in the Uzbek formats. With require_label, only text right
+    after DAVLAT RAQAM BELGISI is searched, so other numbers are not mistaken for plates.
+    """
+    text = text.upper()
+    if require_label:
+        windows = [text[m.end():m.end() + PLATE_SEARCH_WINDOW] for m in re.finditer(PLATE_LABEL, text)]
+    else:
+        windows = [text]
+
+    plates = []
+    for window in windows:
+        for match in PLATE_PATTERN.finditer(window):
+            plates.append(' '.join(part for part in match.groups() if part))
+    return list(dict.fromkeys(plates))
+
+
+def fields_from_text(text: str, require_label: bool = True) -> dict:
+    """
+    Validated form fields found in document text: MRZ data for passports,
+    plates for vehicle licences.
+    """
+    fields = {}
+
+    mrz = find_mrz(text)
+    if mrz:
+        fields['driver_name'] = mrz['driver_name']
+        fields['passport_number'] = mrz['passport_number']
+
+    plates = find_plates(text, require_label)
+    if plates:
+        fields['number_plates'] = '/'.join(plates)
+
+    return fields
+
+
+def is_complete(fields: dict) -> bool:
+    """
+    A vehicle licence is fully read once its plate is known. A passport always
+    needs the model: its authority and issue date are not in the MRZ.
+    """
+    return bool(fields.get('number_plates')) and 'passport_number' not in fields
+
+
+def extract_local_fields(image: Image.Image, text: Optional[str] = None) -> Tuple[dict, str]:
+    """
+    Read validated fields from an upright document image with Tesseract:
+    the plate from a vehicle licence and the MRZ from a passport.
+    `text` is the page's OCR text when orientation detection read it already.
+    Returns the fields (empty when nothing could be read reliably) and the page text.
+    """
+    if not LOCAL_EXTRACTION:
+        return {}, ''
+
+    try:
+        gray = image.convert('L')
+        if text is None:
+            probe = gray.copy()
+            probe.thumbnail((OCR_MAX_EDGE, OCR_MAX_EDGE))
+            text = pytesseract.image_to_string(probe)
+        fields = fields_from_text(text)
+
+        # The MRZ is in the bottom part of the data page and needs a strict character set
+        if 'passport_number' not in fields and ('P<' in text or 'PASSPORT' in text.upper()):
+            mrz_zone = gray.crop((0, gray.height * 2 // 3, gray.width, gray.height))
+            mrz_text = pytesseract.image_to_string(mrz_zone, lang=MRZ_TESSERACT_LANG, config=MRZ_CONFIG)
+            fields.update(fields_from_text(mrz_text))
+    except Exception as e:
+        print(f"[DEBUG] Local extraction error: {e}")
+        return {}, ''
+
+    print(f"[DEBUG] Local extraction found: {sorted(fields)}")
+    return fields, text
+
+
+def merge_local_fields(result: dict, local_documents: List[dict], not_extracted: str) -> dict:
+    """
+    Merge locally read fields into the model's combined result.
+    Check-digit validated passport numbers replace the model's reading, plates
+    are added to the model's, and the MRZ name (which has no patronymic) only
+    fills in when the model returned no name.
+    """
+    plates = [plate for plate in result.get('number_plates', '').split('/') if plate]
+
+    for fields in local_documents:
+        if fields.get('passport_number'):
+            result['passport_number'] = fields['passport_number']
+        if fields.get('driver_name') and result.get('driver_name') in (None, '', not_extracted):
+            result['driver_name'] = fields['driver_name']
+        if fields.get('number_plates'):
+            plates.extend(fields['number_plates'].split('/'))
+
+    result['number_plates'] = '/'.join(dict.fromkeys(plates))
+    return result
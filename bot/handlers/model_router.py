@@ -0,0 +1,172 @@
+import asyncio
+import os
+from typing import Dict, List, Optional, Set
+
+from dotenv import load_dotenv
+
+from bot.handlers.openai_backend import OpenAIBackend
+from bot.telemetry import telemetry
+
+load_dotenv()
+# Backends by name, e.g. 'small,large,local'; each one is set up with
+# MODEL_BACKEND_<NAME>_URL, _MODEL, _API_KEY, _MAX_CONCURRENCY,
+# _REQUESTS_PER_MINUTE, _BURST, _MAX_RETRIES, _REQUEST_DEADLINE and _FAILOVER_AFTER.
+# A backend named 'openai' also reads the older OPENAI_* settings.
+MODEL_BACKENDS = [name.strip() for name in os.getenv('MODEL_BACKENDS', 'openai').split(',') if name.strip()]
+
+# Routes: the backends to try, in order, for each kind of request.
+# 'default' is the first request for a document, 'passport' and 'vehicle_licence'
+# override it for documents the local classifier recognised, and 'reask' is
+# used after a reply failed validation (a larger model is a good fit there).
+ROUTE_NAMES = ('default', 'passport', 'vehicle_licence', 'reask')
+
+# Older settings of the single OpenAI backend
+LEGACY_SETTINGS = {
+    'API_KEY': 'OPENAI_API',
+    'MAX_CONCURRENCY': 'OPENAI_MAX_CONCURRENCY',
+    'REQUESTS_PER_MINUTE': 'OPENAI_REQUESTS_PER_MINUTE',
+    'BURST': 'OPENAI_BURST',
+    'MAX_RETRIES': 'OPENAI_MAX_RETRIES',
+    'REQUEST_DEADLINE': 'OPENAI_REQUEST_DEADLINE',
+}
+
+
+def backend_from_env(name: str) -> OpenAIBackend:
+    """A backend configured by its MODEL_BACKEND_<NAME>_* settings."""
+    def setting(key: str, default):
+        value = os.getenv(f'MODEL_BACKEND_{name.upper()}_{key}')
+        if value is None and name == 'openai' and key in LEGACY_SETTINGS:
+            value = os.getenv(LEGACY_SETTINGS[key])
+        return default if value in (None, '') else value
+
+    failover_after = float(setting('FAILOVER_AFTER', 0))
+    return OpenAIBackend(
+        name=name,
+        model=setting('MODEL', 'gpt-5-mini'),
+        # None: the OpenAI API, or OPENAI_BASE_URL when that is set
+        base_url=setting('URL', None),
+        # Local servers usually accept any key
+        api_key=setting('API_KEY', None if name == 'openai' else 'local'),
+        # Defaults match the gpt-5-mini limits of our usage tier
+        max_concurrency=int(setting('MAX_CONCURRENCY', 8)),
+        requests_per_minute=float(setting('REQUESTS_PER_MINUTE', 500)),
+        burst=int(setting('BURST', 20)),
+        max_retries=int(setting('MAX_RETRIES', 4)),
+        deadline=float(setting('REQUEST_DEADLINE', 90)),
+        failover_after=failover_after or None,
+    )
+
+
+def routes_from_env(backends: List[str]) -> Dict[str, List[str]]:
+    """MODEL_ROUTE_<NAME> for every route; by default all backends in the order of MODEL_BACKENDS."""
+    default = os.getenv('MODEL_ROUTE_DEFAULT') or ','.join(backends)
+    routes = {}
+    for route in ROUTE_NAMES:
+        value = os.getenv(f'MODEL_ROUTE_{route.upper()}') or default
+        routes[route] = [name.strip() for name in value.split(',') if name.strip()]
+    return routes
+
+
+class ModelRouter:
+    """
+    Sends each model request along a route of backends. The first backend of
+    the route is asked first; the next one is asked as well when the current
+    one fails, or when it has not answered within its failover_after seconds.
+    The first good answer wins and the requests still running are cancelled.
+    """
+
+    def __init__(self, backends: Dict[str, OpenAIBackend], routes: Dict[str, List[str]]) -> None:
+        for route, names in routes.items():
+            unknown = [name for name in names if name not in backends]
+            if unknown or not names:
+                raise ValueError(f"Route {route!r} uses unknown model backends: {unknown or names}")
+        self.backends = backends
+        self.routes = routes
+
+        self.counters = {'slow_failovers': 0, 'error_failovers': 0}
+        self.wins = {name: 0 for name in backends}
+
+    def route(self, doc_type: Optional[str]) -> str:
+        """The route for the first request about a document of this type."""
+        return doc_type if doc_type in self.routes else 'default'
+
+    async def _call(self, backend: OpenAIBackend, kwargs: dict):
+        with telemetry.span(f'model_{backend.name}'):
+            return await backend.chat_completion(**kwargs)
+
+    async def chat_completion(self, route: str, **kwargs):
+        """A chat completion from the first backend of the route that answers."""
+        loop = asyncio.get_running_loop()
+        owners: Dict[asyncio.Task, OpenAIBackend] = {}
+        pending: Set[asyncio.Task] = set()
+        error: Optional[BaseException] = None
+
+        def first_result(done) -> Optional[asyncio.Task]:
+            nonlocal error
+            for task in done:
+                if task.exception() is None:
+                    return task
+                error = task.exception()
+                print(f"[DEBUG] Model backend {owners[task].name} failed: {error.__class__.__name__}")
+            return None
+
+        try:
+            chain = self.routes[route]
+            for i, name in enumerate(chain):
+                backend = self.backends[name]
+                current = asyncio.create_task(self._call(backend, dict(kwargs)))
+                owners[current] = backend
+                pending.add(current)
+                if i == len(chain) - 1:
+                    break
+
+                # Wait for this backend until it fails or counts as slow, then add the next one
+                deadline = None if backend.failover_after is None else loop.time() + backend.failover_after
+                while pending:
+                    timeout = None if deadline is None else max(0.0, deadline - loop.time())
+                    done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        self.counters['slow_failovers'] += 1
+                        break
+                    winner = first_result(done)
+                    if winner is not None:
+                        self.wins[owners[winner].name] += 1
+                        return winner.result()
+                    if current in done:
+                        self.counters['error_failovers'] += 1
+                        break
+
+            # Every backend of the route is asked: take the first good answer
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = first_result(done)
+                if winner is not None:
+                    self.wins[owners[winner].name] += 1
+                    return winner.result()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def metrics(self) -> dict:
+        """Counters of every backend and of the failovers between them."""
+        metrics = {'router_' + key: value for key, value in self.counters.items()}
+        for name, backend in self.backends.items():
+            metrics.update(backend.metrics())
+            metrics[f'{name}_wins'] = self.wins[name]
+        return metrics
+
+    def warm_up(self) -> None:
+        """Create the client of every backend now rather than on the first request."""
+        for backend in self.backends.values():
+            backend.client
+
+    async def close(self) -> None:
+        for backend in self.backends.values():
+            await backend.close()
+
+
+model_router = ModelRouter(
+    {name: backend_from_env(name) for name in MODEL_BACKENDS},
+    routes_from_env(MODEL_BACKENDS)
+)
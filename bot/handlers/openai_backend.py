@@ -0,0 +1,154 @@
+import asyncio
+import random
+import time
+from typing import Optional
+
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Async token bucket: allows `rate` requests per second on average
+    with bursts of up to `capacity` requests.
+    """
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        # The lock keeps waiters in FIFO order
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class OpenAIBackend:
+    """
+    Async client of one OpenAI-compatible endpoint (the OpenAI API or a local
+    server such as vLLM, Ollama or llama.cpp) and the model to use there.
+    Pooled HTTP connections, a limit on requests in flight, client-side rate
+    limiting and retries with backoff. See model_router for the configuration.
+    """
+
+    def __init__(self, name: str, model: str, base_url: Optional[str], api_key: Optional[str],
+                 max_concurrency: int, requests_per_minute: float, burst: int, max_retries: int,
+                 deadline: float, failover_after: Optional[float] = None) -> None:
+        self.name = name
+        self.model = model
+        self.base_url = base_url
+        self.api_key = api_key
+        # Seconds without an answer after which the router also asks the next backend
+        self.failover_after = failover_after
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.deadline = deadline
+
+        self._client = None
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._bucket = TokenBucket(requests_per_minute / 60, burst)
+
+        self.counters = {'requests': 0, 'retries': 0, 'failed': 0, 'deadline_exceeded': 0}
+
+    @property
+    def client(self):
+        """
+        The AsyncOpenAI client, created on first use. openai takes about half a
+        second to import, so it is imported here rather than by every process
+        that imports the handlers, e.g. the extraction workers.
+        """
+        if self._client is None:
+            import httpx
+            from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+            http_client = DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency
+                )
+            )
+            # Retries are done here, not by the SDK, so they respect the limiter
+            self._client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                http_client=http_client,
+                max_retries=0,
+                timeout=self.deadline
+            )
+        return self._client
+
+    @staticmethod
+    def _retry_delay(attempt: int, error: Exception) -> float:
+        from openai import APIStatusError
+
+        # Respect Retry-After when the API sends it
+        if isinstance(error, APIStatusError):
+            retry_after = error.response.headers.get('retry-after')
+            if retry_after:
+                try:
+                    return float(retry_after)
+                except ValueError:
+                    pass
+
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(30.0, 0.5 * 2 ** attempt))
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        from openai import APIConnectionError, APIStatusError, APITimeoutError
+
+        if isinstance(error, (APIConnectionError, APITimeoutError)):
+            return True
+        return isinstance(error, APIStatusError) and error.status_code in RETRY_STATUS_CODES
+
+    async def _create(self, **kwargs):
+        attempt = 0
+        while True:
+            await self._bucket.acquire()
+            try:
+                async with self._semaphore:
+                    self.counters['requests'] += 1
+                    return await self.client.chat.completions.create(**kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not self._is_retryable(e):
+                    self.counters['failed'] += 1
+                    raise
+
+                delay = self._retry_delay(attempt, e)
+                print(f"[DEBUG] OpenAI request failed ({e.__class__.__name__}), retry {attempt + 1} in {delay:.1f}s")
+                self.counters['retries'] += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def chat_completion(self, **kwargs):
+        """
+        Create a chat completion with this backend's model. Waiting for the
+        limiter and all retries together must finish within the request deadline.
+        """
+        kwargs.setdefault('model', self.model)
+        try:
+            return await asyncio.wait_for(self._create(**kwargs), self.deadline)
+        except asyncio.TimeoutError:
+            self.counters['deadline_exceeded'] += 1
+            raise
+
+    def metrics(self) -> dict:
+        """Snapshot of the request counters."""
+        return {f'{self.name}_{key}': value for key, value in self.counters.items()}
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
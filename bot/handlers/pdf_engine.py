@@ -0,0 +1,134 @@
+import asyncio
+import os
+from dataclasses import dataclass, field
+from typing import AsyncIterator, List, Optional
+
+from PIL import Image, ImageStat
+from dotenv import load_dotenv
+
+from bot.handlers.data_extraction import PreparedImage, prepare_image
+from bot.handlers.local_extraction import fields_from_text, is_complete
+from bot.telemetry import stage_timer, telemetry
+
+load_dotenv()
+# Pages after the cap are ignored: authorisations need a passport and a licence
+PDF_MAX_PAGES = int(os.getenv('PDF_MAX_PAGES', 6))
+PDF_MAX_DPI = int(os.getenv('PDF_MAX_DPI', 200))
+PDF_DPI = 300
+
+# Rendered pages with less contrast than this are blank scans
+BLANK_MAX_STDDEV = 4.0
+
+
+@dataclass
+class PdfPage:
+    page_num: int
+    # Fields already read from the embedded text layer
+    fields: dict = field(default_factory=dict)
+    # Set once the page is rendered, or straight away when the text layer is enough
+    prepared: Optional[PreparedImage] = None
+
+    @property
+    def needs_rendering(self) -> bool:
+        return self.prepared is None
+
+
+def plan_pdf(pdf_data: bytes) -> List[PdfPage]:
+    """
+    Decide what to do with each page without rendering anything.
+    Pages without any content are dropped, pages whose text layer already
+    yields all their fields come back prepared, the rest need rendering.
+    """
+    import pymupdf  # imported where PDFs are opened, i.e. in the workers
+
+    pdf_document = pymupdf.open(stream=pdf_data, filetype='pdf')
+    try:
+        pages = []
+        for page_num in range(min(len(pdf_document), PDF_MAX_PAGES)):
+            page = pdf_document.load_page(page_num)
+            text = page.get_text()
+
+            if not text.strip() and not page.get_images() and not page.get_drawings():
+                print(f"[DEBUG] Skipping empty PDF page {page_num + 1}")
+                continue
+
+            page_info = PdfPage(page_num, fields=fields_from_text(text))
+            if is_complete(page_info.fields):
+                page_info.prepared = PreparedImage(None, page_info.fields)
+            pages.append(page_info)
+
+        if len(pdf_document) > PDF_MAX_PAGES:
+            print(f"[DEBUG] PDF has {len(pdf_document)} pages, only the first {PDF_MAX_PAGES} are used")
+        return pages
+    finally:
+        pdf_document.close()
+
+
+def render_page(pdf_data: bytes, page_num: int, dpi: int = PDF_DPI) -> Optional[PreparedImage]:
+    """
+    Render one page and prepare it for the model. Returns None for a blank page.
+    Runs in a worker process, one page per call.
+    """
+    import pymupdf
+
+    dpi = min(dpi, PDF_MAX_DPI)
+    timings = {}
+    with stage_timer(timings, 'pdf_rasterise'):
+        pdf_document = pymupdf.open(stream=pdf_data, filetype='pdf')
+        try:
+            page = pdf_document.load_page(page_num)
+            pix = page.get_pixmap(matrix=pymupdf.Matrix(dpi/72, dpi/72))
+            # Wrap the pixmap samples directly, no intermediate PNG
+            image = Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+        finally:
+            pdf_document.close()
+
+    thumb = image.convert('L')
+    thumb.thumbnail((256, 256))
+    if ImageStat.Stat(thumb).stddev[0] < BLANK_MAX_STDDEV:
+        print(f"[DEBUG] Skipping blank PDF page {page_num + 1}")
+        return None
+
+    print(f"\n[DEBUG] Processing PDF page {page_num + 1}")
+    prepared = prepare_image(image, image.width * image.height * 3)
+    prepared.timings.update(timings)
+    return prepared
+
+
+def finish_page(page: PdfPage, prepared: Optional[PreparedImage]) -> PdfPage:
+    """Attach the rendered page, keeping what the text layer already gave."""
+    if prepared is not None:
+        prepared.local_fields = {**page.fields, **prepared.local_fields}
+    else:
+        prepared = PreparedImage(None, page.fields)
+    page.prepared = prepared
+    return page
+
+
+async def stream_pdf_pages(pdf_data: bytes, executor, chat_id: Optional[int] = None) -> AsyncIterator[PdfPage]:
+    """
+    Render the pages of a PDF in parallel on the executor's process pool and
+    yield each page as soon as it is ready, in completion order.
+    """
+    with telemetry.span('pdf_plan'):
+        pages = await executor.run_cpu(plan_pdf, pdf_data, chat_id=chat_id)
+
+    async def render(page: PdfPage) -> PdfPage:
+        prepared = await executor.run_cpu(render_page, pdf_data, page.page_num, chat_id=chat_id)
+        return finish_page(page, prepared)
+
+    # Start rendering every page before handing anything to the consumer
+    pending = [asyncio.ensure_future(render(page)) for page in pages if page.needs_rendering]
+
+    try:
+        for page in pages:
+            if not page.needs_rendering:
+                # The text layer already gave us what this page is for
+                yield page
+
+        for next_page in asyncio.as_completed(pending):
+            yield await next_page
+    finally:
+        # The consumer stopped early or was cancelled
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,135 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import signal
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from bot.telemetry import telemetry
+
+load_dotenv()
+# LibreOffice binary used to convert filled forms to PDF; conversion is off when it is missing
+SOFFICE_PATH = os.getenv('SOFFICE_PATH', 'soffice')
+PDF_CONVERT_WORKERS = int(os.getenv('PDF_CONVERT_WORKERS', 2))
+PDF_CONVERT_TIMEOUT = float(os.getenv('PDF_CONVERT_TIMEOUT', 60))
+PDF_CACHE_MAX_ENTRIES = int(os.getenv('PDF_CACHE_MAX_ENTRIES', 100))
+
+
+class PdfConverter:
+    """
+    Converts filled XLSX forms to PDF with headless LibreOffice.
+
+    Conversions run as subprocesses, so the event loop is never blocked.
+    Each worker slot has its own LibreOffice profile, because two soffice
+    processes sharing a profile would block each other. Results are kept in an
+    LRU cache keyed by the hash of the XLSX bytes.
+    """
+
+    def __init__(self, soffice: str, workers: int, timeout: float, max_entries: int) -> None:
+        self.soffice = shutil.which(soffice)
+        self.workers = workers
+        self.timeout = timeout
+        self.max_entries = max_entries
+
+        self._profiles: Optional[asyncio.Queue] = None
+        self._profile_root: Optional[str] = None
+        self._cache: OrderedDict = OrderedDict()
+
+        self.counters = {'conversions': 0, 'failed': 0, 'cache_hits': 0, 'convert_seconds': 0.0}
+
+    @property
+    def available(self) -> bool:
+        return self.soffice is not None
+
+    def _profile_slots(self) -> asyncio.Queue:
+        if self._profiles is None:
+            self._profile_root = tempfile.mkdtemp(prefix='soffice_profiles_')
+            self._profiles = asyncio.Queue()
+            for i in range(self.workers):
+                self._profiles.put_nowait(os.path.join(self._profile_root, str(i)))
+        return self._profiles
+
+    async def _run(self, xlsx_data: bytes, profile: str) -> bytes:
+        with tempfile.TemporaryDirectory() as work_dir:
+            source = os.path.join(work_dir, 'form.xlsx')
+            with open(source, 'wb') as f:
+                f.write(xlsx_data)
+
+            process = await asyncio.create_subprocess_exec(
+                self.soffice,
+                f'-env:UserInstallation=file://{profile}',
+                '--headless', '--norestore', '--nologo',
+                '--convert-to', 'pdf', '--outdir', work_dir, source,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+                # soffice starts soffice.bin, which must be killed together with it
+                start_new_session=True,
+            )
+            try:
+                _, stderr = await asyncio.wait_for(process.communicate(), self.timeout)
+            except BaseException:
+                # Timed out or cancelled: don't leave soffice running
+                if process.returncode is None:
+                    os.killpg(process.pid, signal.SIGKILL)
+                    await process.wait()
+                raise
+
+            output = os.path.join(work_dir, 'form.pdf')
+            if process.returncode != 0 or not os.path.exists(output):
+                raise RuntimeError(f"soffice exited with {process.returncode}: {stderr.decode(errors='replace').strip()}")
+
+            with open(output, 'rb') as f:
+                return f.read()
+
+    async def convert(self, xlsx_data: bytes) -> bytes:
+        """PDF version of a filled XLSX form, from the cache when the same form was converted before."""
+        if not self.available:
+            raise RuntimeError("PDF conversion needs LibreOffice (soffice)")
+
+        digest = hashlib.sha256(xlsx_data).hexdigest()
+        cached = self._cache.get(digest)
+        if cached is not None:
+            self._cache.move_to_end(digest)
+            self.counters['cache_hits'] += 1
+            return cached
+
+        profiles = self._profile_slots()
+        profile = await profiles.get()
+        start = time.perf_counter()
+        try:
+            with telemetry.span('pdf_convert'):
+                pdf_data = await self._run(xlsx_data, profile)
+        except Exception:
+            self.counters['failed'] += 1
+            raise
+        finally:
+            profiles.put_nowait(profile)
+
+        self.counters['conversions'] += 1
+        self.counters['convert_seconds'] += time.perf_counter() - start
+
+        self._cache[digest] = pdf_data
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return pdf_data
+
+    def metrics(self) -> dict:
+        """Snapshot of the conversion counters."""
+        metrics = {'pdf_' + key: value for key, value in self.counters.items()}
+        metrics['pdf_convert_seconds'] = round(metrics['pdf_convert_seconds'], 2)
+        metrics['pdf_busy_workers'] = self.workers - self._profiles.qsize() if self._profiles is not None else 0
+        return metrics
+
+    def close(self) -> None:
+        if self._profile_root is not None:
+            shutil.rmtree(self._profile_root, ignore_errors=True)
+            self._profile_root = None
+            self._profiles = None
+
+
+pdf_converter = PdfConverter(SOFFICE_PATH, PDF_CONVERT_WORKERS, PDF_CONVERT_TIMEOUT, PDF_CACHE_MAX_ENTRIES)
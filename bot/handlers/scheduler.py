@@ -0,0 +1,164 @@
+import asyncio
+import itertools
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from bot.telemetry import telemetry
+
+load_dotenv()
+# Files extracted at the same time, over all chats. Most of a file's time is spent
+# waiting for the model, so this is well above the number of worker processes
+EXTRACTION_MAX_RUNNING = int(os.getenv('EXTRACTION_MAX_RUNNING', 16))
+# Files of one chat extracted at the same time; the rest of the chat's files wait their turn
+EXTRACTION_CHAT_QUOTA = int(os.getenv('EXTRACTION_CHAT_QUOTA', 2))
+# Files waiting over all chats; uploads beyond this are turned away
+EXTRACTION_MAX_QUEUE = int(os.getenv('EXTRACTION_MAX_QUEUE', 200))
+# Weights of chats that get a bigger share, e.g. '12345:2,67890:0.5'; others weigh 1
+EXTRACTION_CHAT_WEIGHTS = {
+    int(chat_id): float(weight)
+    for chat_id, weight in (item.split(':') for item in os.getenv('EXTRACTION_CHAT_WEIGHTS', '').split(',') if item)
+}
+
+
+class SchedulerBusy(Exception):
+    """The extraction queue is full."""
+
+    def __init__(self, queued: int) -> None:
+        super().__init__(f"Бот сейчас обрабатывает много документов (в очереди: {queued}). "
+                         "Пожалуйста, отправьте документы ещё раз через пару минут.")
+        self.queued = queued
+
+
+@dataclass
+class Ticket:
+    """A file's place in the extraction queue."""
+    chat_id: Optional[int]
+    # Virtual finish time, see FairScheduler
+    tag: float
+    seq: int
+    enqueued: float = field(default_factory=time.monotonic)
+    state: str = 'queued'
+    started: Optional[asyncio.Future] = None
+
+    async def wait(self) -> None:
+        """
+        Wait until the scheduler lets this file run. Cancelling the waiter
+        leaves the ticket to finish(), which takes it out of the queue.
+        """
+        await asyncio.shield(self.started)
+
+
+class FairScheduler:
+    """
+    Admission and weighted fair queuing of file extractions across chats.
+
+    Every file gets a ticket. Tickets are tagged with a virtual finish time:
+    the chat's previous tag (or the current virtual time, whichever is
+    later) plus 1 / weight. The smallest tag runs next, so a chat that sends
+    40 scans is served in turn with a chat that sends one passport instead of
+    ahead of it. A chat never runs more than its quota at once, and when too
+    many files are waiting new uploads are refused with SchedulerBusy.
+    """
+
+    def __init__(self, max_running: int, chat_quota: int, max_queue: int, weights: Dict[int, float]) -> None:
+        self.max_running = max(1, max_running)
+        self.chat_quota = max(1, chat_quota)
+        self.max_queue = max_queue
+        self.weights = weights
+
+        self._queue: List[Ticket] = []
+        self._running: Dict[Optional[int], int] = {}
+        self._last_tag: Dict[Optional[int], float] = {}
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+
+        self.counters = {'admitted': 0, 'rejected': 0, 'purged': 0}
+
+    def admit(self, chat_id: Optional[int], count: int = 1) -> List[Ticket]:
+        """
+        Queue `count` files of a chat. Raises SchedulerBusy when they would
+        not fit. Every ticket must be given back with finish().
+        """
+        if len(self._queue) + count > self.max_queue:
+            self.counters['rejected'] += count
+            raise SchedulerBusy(len(self._queue))
+
+        loop = asyncio.get_running_loop()
+        weight = self.weights.get(chat_id, 1.0)
+        tickets = []
+        for _ in range(count):
+            tag = max(self._virtual_time, self._last_tag.get(chat_id, 0.0)) + 1 / weight
+            self._last_tag[chat_id] = tag
+            ticket = Ticket(chat_id, tag, next(self._seq), started=loop.create_future())
+            self._queue.append(ticket)
+            tickets.append(ticket)
+        self.counters['admitted'] += count
+        self._dispatch()
+        return tickets
+
+    def position(self, ticket: Ticket) -> int:
+        """1 for the next file to run, 2 for the one after it...; 0 once it is running."""
+        if ticket.state != 'queued':
+            return 0
+        return 1 + sum(1 for other in self._queue if (other.tag, other.seq) < (ticket.tag, ticket.seq))
+
+    def _dispatch(self) -> None:
+        while sum(self._running.values()) < self.max_running:
+            candidates = [t for t in self._queue if self._running.get(t.chat_id, 0) < self.chat_quota]
+            if not candidates:
+                return
+            ticket = min(candidates, key=lambda t: (t.tag, t.seq))
+            self._queue.remove(ticket)
+            if ticket.started.done():
+                # Cancelled from outside; nobody waits for it any more
+                ticket.state = 'done'
+                continue
+            ticket.state = 'running'
+            self._running[ticket.chat_id] = self._running.get(ticket.chat_id, 0) + 1
+            self._virtual_time = max(self._virtual_time, ticket.tag - 1 / self.weights.get(ticket.chat_id, 1.0))
+            telemetry.observe('queue_wait', time.monotonic() - ticket.enqueued)
+            ticket.started.set_result(None)
+
+    def finish(self, ticket: Ticket) -> None:
+        """Give a ticket back, whether its file ran, was cancelled or never started. Safe to repeat."""
+        if ticket.state == 'queued':
+            self._queue.remove(ticket)
+            ticket.started.cancel()
+        elif ticket.state == 'running':
+            self._running[ticket.chat_id] -= 1
+            if not self._running[ticket.chat_id]:
+                del self._running[ticket.chat_id]
+        else:
+            return
+        ticket.state = 'done'
+
+        chat_id = ticket.chat_id
+        if chat_id not in self._running and not any(t.chat_id == chat_id for t in self._queue):
+            # An idle chat starts from the virtual time when it comes back
+            self._last_tag.pop(chat_id, None)
+        self._dispatch()
+
+    def purge_chat(self, chat_id: int) -> int:
+        """Drop the chat's files that are still waiting, e.g. on /end. Returns how many."""
+        queued = [ticket for ticket in self._queue if ticket.chat_id == chat_id]
+        for ticket in queued:
+            self.finish(ticket)
+        self.counters['purged'] += len(queued)
+        return len(queued)
+
+    def metrics(self) -> dict:
+        """Snapshot of the queue."""
+        return {
+            'scheduler_queued': len(self._queue),
+            'scheduler_running': sum(self._running.values()),
+            'scheduler_chats_queued': len({ticket.chat_id for ticket in self._queue}),
+            **{'scheduler_' + key: value for key, value in self.counters.items()},
+        }
+
+
+extraction_scheduler = FairScheduler(EXTRACTION_MAX_RUNNING, EXTRACTION_CHAT_QUOTA, EXTRACTION_MAX_QUEUE,
+                                     EXTRACTION_CHAT_WEIGHTS)
@@ -0,0 +1,160 @@
+import asyncio
+import os
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from dotenv import load_dotenv
+
+if TYPE_CHECKING:
+    # Extraction workers import this module through the executor; they don't need aiogram
+    from aiogram import Bot
+
+load_dotenv()
+# Downloaded Telegram files kept in memory by file_unique_id, in bytes
+DOWNLOAD_CACHE_MAX_BYTES = int(os.getenv('DOWNLOAD_CACHE_MAX_BYTES', 100 * 1024 * 1024))
+
+
+class FlightAbandoned(Exception):
+    """The call a follower was waiting for was cancelled; the follower should run it itself."""
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one execution: the first caller
+    (the leader) runs it and the others (followers) wait for its result.
+    A follower's cancellation doesn't touch the leader. When the leader is
+    cancelled, e.g. its chat sent /end, the followers run the call themselves.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._flights: Dict[Hashable, asyncio.Future] = {}
+        self.counters = {'leaders': 0, 'followers': 0}
+
+    def join(self, key: Hashable) -> Optional[asyncio.Future]:
+        """The future of the call in flight for the key, or None when there is none."""
+        future = self._flights.get(key)
+        if future is not None:
+            self.counters['followers'] += 1
+        return future
+
+    def lead(self, key: Hashable) -> asyncio.Future:
+        """Register a call for the key; finish it with finish() or abandon()."""
+        future = asyncio.get_running_loop().create_future()
+        # Nobody may be following; don't warn about an exception never retrieved
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._flights[key] = future
+        self.counters['leaders'] += 1
+        return future
+
+    def finish(self, key: Hashable, future: asyncio.Future, result: Any = None,
+               error: Optional[BaseException] = None) -> None:
+        if self._flights.get(key) is future:
+            del self._flights[key]
+        if not future.done():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def abandon(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._flights.get(key) is future:
+            del self._flights[key]
+        future.cancel()
+
+    @staticmethod
+    async def wait(future: asyncio.Future) -> Any:
+        """A follower's wait for the leader's result. Raises FlightAbandoned when the leader was cancelled."""
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if future.cancelled() and not asyncio.current_task().cancelling():
+                raise FlightAbandoned() from None
+            raise
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Run func() for the key, or wait for the run already in flight."""
+        while True:
+            future = self.join(key)
+            if future is None:
+                break
+            try:
+                return await self.wait(future)
+            except FlightAbandoned:
+                continue
+
+        future = self.lead(key)
+        try:
+            result = await func()
+        except (asyncio.CancelledError, GeneratorExit):
+            self.abandon(key, future)
+            raise
+        except Exception as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result)
+        return result
+
+    def metrics(self) -> dict:
+        return {f'{self.name}_{key}': value for key, value in self.counters.items()}
+
+
+class DownloadCache:
+    """Telegram files already downloaded, by file_unique_id, least recently used first out."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._files: OrderedDict = OrderedDict()
+        self._size = 0
+        self.counters = {'hits': 0, 'misses': 0}
+
+    def get(self, key: str) -> Optional[bytes]:
+        data = self._files.get(key)
+        if data is None:
+            self.counters['misses'] += 1
+            return None
+        self._files.move_to_end(key)
+        self.counters['hits'] += 1
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes or key in self._files:
+            return
+        self._files[key] = data
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            _, evicted = self._files.popitem(last=False)
+            self._size -= len(evicted)
+
+    def metrics(self) -> dict:
+        return {'download_cache_' + key: value for key, value in self.counters.items()}
+
+
+extraction_flights = SingleFlight('extraction')
+download_flights = SingleFlight('download')
+download_cache = DownloadCache(DOWNLOAD_CACHE_MAX_BYTES)
+
+
+async def download(bot: 'Bot', file) -> bytes:
+    """
+    The bytes of a Telegram file (document or photo size). A file already
+    downloaded is not downloaded again, and concurrent downloads of the same
+    file share one request.
+    """
+    key = file.file_unique_id
+    data = download_cache.get(key)
+    if data is not None:
+        return data
+
+    async def fetch() -> bytes:
+        buffer = await bot.download(file)
+        data = buffer.getvalue()
+        download_cache.put(key, data)
+        return data
+
+    return await download_flights.do(key, fetch)
+
+
+def metrics() -> dict:
+    """Snapshot of the coalescing counters."""
+    return {**extraction_flights.metrics(), **download_flights.metrics(), **download_cache.metrics()}
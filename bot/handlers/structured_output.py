@@ -0,0 +1,142 @@
+import copy
+import re
+from datetime import datetime
+from typing import Dict, List, Literal, Optional, Type
+
+from pydantic import BaseModel, ConfigDict, ValidationError, create_model
+
+from bot.handlers.local_extraction import PLATE_PATTERN
+
+# Fields the model is asked for, by document type
+TYPE_FIELDS = {
+    'passport': ['driver_name', 'passport_number', 'passport_authority', 'passport_date_issued'],
+    'vehicle_licence': ['number_plates'],
+}
+
+# Structured output counters, shown in /stats
+counters = {'responses': 0, 'malformed_responses': 0, 'reasks': 0, 'reask_fixed_fields': 0}
+
+
+class ExtractedDocument(BaseModel):
+    """One document in the model's answer. Fields that are not visible are null."""
+    model_config = ConfigDict(extra='ignore')
+
+    document_type: Literal['passport', 'vehicle_licence', 'other']
+    driver_name: Optional[str] = None
+    passport_number: Optional[str] = None
+    passport_authority: Optional[str] = None
+    passport_date_issued: Optional[str] = None
+    number_plates: Optional[str] = None
+
+
+class ExtractionResponse(BaseModel):
+    documents: List[ExtractedDocument]
+
+
+def strict_json_schema(model: Type[BaseModel]) -> dict:
+    """
+    The model's JSON schema in the form strict structured outputs accept:
+    every property required, no additional properties, no defaults or titles.
+    """
+    def fix(node):
+        if isinstance(node, dict):
+            node.pop('title', None)
+            node.pop('default', None)
+            if node.get('type') == 'object' and 'properties' in node:
+                node['required'] = list(node['properties'])
+                node['additionalProperties'] = False
+            for value in node.values():
+                fix(value)
+        elif isinstance(node, list):
+            for value in node:
+                fix(value)
+        return node
+
+    return fix(copy.deepcopy(model.model_json_schema()))
+
+
+def response_format(model: Type[BaseModel], name: str) -> dict:
+    """response_format argument for a chat completion that must match the model."""
+    return {
+        'type': 'json_schema',
+        'json_schema': {'name': name, 'strict': True, 'schema': strict_json_schema(model)},
+    }
+
+
+def fields_model(fields: List[str]) -> Type[BaseModel]:
+    """A response model with only the given fields, for a targeted re-ask."""
+    return create_model(
+        'ReaskedFields',
+        __config__=ConfigDict(extra='ignore'),
+        **{key: (Optional[str], None) for key in fields}
+    )
+
+
+def valid_date(value: str) -> bool:
+    try:
+        parsed = datetime.strptime(value, '%d/%m/%Y')
+    except ValueError:
+        return False
+    return 1950 <= parsed.year <= datetime.now().year
+
+
+def valid_plates(value: str) -> bool:
+    plates = [plate.strip().upper() for plate in value.split('/')]
+    return all(plate and PLATE_PATTERN.fullmatch(plate) for plate in plates)
+
+
+FIELD_CHECKS = {
+    'driver_name': lambda value: len(value.split()) >= 2,
+    'passport_number': lambda value: re.fullmatch(r'[A-Z0-9]{6,12}', re.sub(r'\s', '', value.upper())) is not None,
+    'passport_authority': lambda value: bool(value.strip()),
+    'passport_date_issued': valid_date,
+    'number_plates': valid_plates,
+}
+
+FIELD_RULES = {
+    'driver_name': 'full name: surname, name and patronymic',
+    'passport_number': 'passport number, letters and digits only',
+    'passport_authority': 'the issuing authority, usually starts with MIA',
+    'passport_date_issued': 'date of issue as DD/MM/YYYY',
+    'number_plates': 'plate in the format ## ### AAA or ## #### AA; several plates separated by /',
+}
+
+
+def fields_to_reask(document: ExtractedDocument) -> List[str]:
+    """
+    Fields of a document worth asking about again: values in the wrong format,
+    and fields missing from a document whose other fields were read.
+    A document with none of its fields (e.g. the back side of a licence) is left alone.
+    """
+    fields = TYPE_FIELDS.get(document.document_type, [])
+    values = {key: getattr(document, key) for key in fields}
+    if not any(values.values()):
+        return []
+    return [key for key, value in values.items() if not value or not FIELD_CHECKS[key](value)]
+
+
+def reask_prompt(fields: List[str]) -> str:
+    rules = "\n".join(f"- {key}: {FIELD_RULES[key]}" for key in fields)
+    return ("Read only these fields from the document again, carefully. "
+            "Use null for a field that is not visible.\n" + rules)
+
+
+def parse_model(text: Optional[str], model: Type[BaseModel]) -> Optional[BaseModel]:
+    """The reply validated against the model, or None if it does not match."""
+    if not text:
+        return None
+    try:
+        return model.model_validate_json(text)
+    except ValidationError as e:
+        print(f"[DEBUG] Malformed model response: {e.error_count()} errors")
+        return None
+
+
+def document_fields(document: ExtractedDocument) -> Dict[str, str]:
+    """The values of a document for the form, without the nulls."""
+    return {key: value for key, value in document.model_dump(exclude={'document_type'}).items() if value}
+
+
+def metrics() -> dict:
+    """Snapshot of the structured output counters."""
+    return {'extraction_' + key: value for key, value in counters.items()}
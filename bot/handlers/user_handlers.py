@@ -1,11 +1,23 @@
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.filters.callback_data import CallbackData
 from aiogram import Router, types, F
 from datetime import date, timedelta
+from typing import List, Optional
 
 from bot.config import BotConfig
-from bot.handlers.data_extraction import process_file
+from bot.handlers.data_extraction import merge_extracted
+from bot.handlers.extraction_executor import extract_files_documents, extraction_executor
+from bot.handlers.model_router import model_router
+from bot.handlers.extraction_cache import extraction_cache
 from bot.handlers.data_insertion import insert_data
+from bot.handlers.driver_registry import DRIVER_FIELDS, driver_registry
+from bot.handlers.pdf_rendering import pdf_converter
+from bot.handlers.scheduler import SchedulerBusy, extraction_scheduler
+from bot.handlers.single_flight import download
+from bot.handlers import single_flight
+from bot.handlers import structured_output
+from bot.storage import pending_upload, state_lock, upload_cancelled, uploads_pending
+from bot.telemetry import mask, redact, telemetry
 
 from aiogram.fsm.state import State, StatesGroup
 
@@ -19,11 +31,16 @@ class DocumentFlow(StatesGroup):
 
 from aiogram.fsm.context import FSMContext
 
-import tempfile
-import os
+import asyncio
+from contextlib import aclosing
 
 user_router = Router()
 
+# How often /done updates its progress while uploads are still extracting
+DONE_PROGRESS_INTERVAL = 2.0
+# How often /done checks the upload marks of other workers, see pending_upload()
+UPLOAD_POLL_INTERVAL = 0.25
+
 @user_router.message(Command('start'))
 async def cmd_start(msg: types.Message, config: BotConfig) -> None:
     """Process the /start command."""
@@ -36,21 +53,74 @@ async def cmd_admin_info(msg: types.Message, config: BotConfig) -> None:
     else:
         await msg.answer("You are not an admin.")
 
+@user_router.message(Command('stats'))
+async def cmd_stats(msg: types.Message, config: BotConfig) -> None:
+    """Show extraction queue metrics to admins."""
+    if msg.from_user.id not in config.admin_ids:
+        return
+
+    metrics = {
+        **extraction_executor.metrics(),
+        **extraction_scheduler.metrics(),
+        **model_router.metrics(),
+        **extraction_cache.metrics(),
+        **pdf_converter.metrics(),
+        **structured_output.metrics(),
+        **driver_registry.metrics(),
+        **single_flight.metrics(),
+        **telemetry.metrics(),
+    }
+    await msg.answer("\n".join(f"{key}: {value}" for key, value in metrics.items()))
+
 @user_router.message(Command('end'))
 async def cmd_end(msg: types.Message, state: FSMContext) -> None:
     """Process the /end command."""
+    extraction_executor.cancel_chat(msg.chat.id)
     await state.clear()
     await msg.answer("Форма отменена. Нажмите /new_form чтобы начать новую форму.")
 
 @user_router.message(Command('new_form'))
 async def cmd_new_form(msg: types.Message, state: FSMContext) -> None:
     """Process the /new_form command."""
+    extraction_executor.cancel_chat(msg.chat.id)
     await state.clear()
-    await msg.answer("место погрузки")
+    await msg.answer("место погрузки\n\nДокументы водителя можно отправлять уже сейчас.")
     await state.set_state(DocumentFlow.waiting_outbound)
 
 
-@user_router.message(DocumentFlow.waiting_outbound, F.text)
+# Registered before the trip handlers, which take any text
+@user_router.message(
+    StateFilter(DocumentFlow.waiting_outbound, DocumentFlow.waiting_inbound, DocumentFlow.waiting_files),
+    Command('driver')
+)
+async def cmd_driver(msg: types.Message, state: FSMContext, command: CommandObject) -> None:
+    """
+    Fill the form with a driver from the registry. `/driver #id` is what the
+    inline search sends; `/driver text` searches by plate, name or passport number.
+    """
+    query = (command.args or '').strip()
+    if query.startswith('#') and query[1:].isdigit():
+        driver = await driver_registry.get(msg.from_user.id, int(query[1:]))
+        if driver is None:
+            await msg.answer("Водитель не найден. Отправьте документы водителя.")
+            return
+        await use_driver(msg, state, driver)
+        return
+
+    drivers = await driver_registry.search(msg.from_user.id, query)
+    if not drivers:
+        await msg.answer("Водитель не найден. Отправьте документы водителя.")
+        return
+    await msg.answer("Выберите водителя:", reply_markup=types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(
+            text=driver_label(driver),
+            callback_data=DocumentCallback(action="driver", value=str(driver['id'])).pack()
+        )] for driver in drivers
+    ]))
+
+
+# Commands are left to their handlers, e.g. /batch of batch_router, which is included after this router
+@user_router.message(DocumentFlow.waiting_outbound, F.text, ~F.text.startswith('/'))
 async def get_outbound(msg: types.Message, state: FSMContext):
     """Handle outbound location input."""
     outbound = msg.text
@@ -65,7 +135,7 @@ async def get_outbound(msg: types.Message, state: FSMContext):
     
 
 # ask for files 
-@user_router.message(DocumentFlow.waiting_inbound, F.text)
+@user_router.message(DocumentFlow.waiting_inbound, F.text, ~F.text.startswith('/'))
 async def get_inbound(msg: types.Message, state: FSMContext):
     """Handle inbound location input."""
     inbound = msg.text
@@ -75,52 +145,170 @@ async def get_inbound(msg: types.Message, state: FSMContext):
         return
     
     await state.update_data(inbound=inbound)
-    await msg.answer("Отправьте документы водителя. После отправки нажмите /done.")
     await state.set_state(DocumentFlow.waiting_files)
+    # The driver was already taken from the registry, nothing to upload
+    if (await state.get_data()).get('registry_driver'):
+        await summarise_form(msg, state)
+        return
+    await msg.answer("Отправьте документы водителя. После отправки нажмите /done. "
+                     "Для водителя, который уже был, нажмите /driver или введите его номер: /driver 01 123")
+
 
 
+def message_file(msg: types.Message):
+    """The file of a document or photo message and a name for it."""
+    if msg.document:
+        return msg.document, msg.document.file_name or 'document'
+    # photo: take the highest quality
+    file = msg.photo[-1]
+    return file, f"photo_{file.file_id}.jpg"
 
-@user_router.message(DocumentFlow.waiting_files, F.content_type.in_(['document', 'photo']))
-async def handle_files(msg: types.Message, state: FSMContext) -> None:
-    """Handle files sent by the user."""
+
+# Documents are accepted from /new_form on, while the trip is still being asked
+@user_router.message(
+    StateFilter(DocumentFlow.waiting_outbound, DocumentFlow.waiting_inbound, DocumentFlow.waiting_files),
+    F.content_type.in_(['document', 'photo'])
+)
+async def handle_files(msg: types.Message, state: FSMContext, album: Optional[List[types.Message]] = None) -> None:
+    """
+    Handle files sent by the user, a whole album at once (see AlbumMiddleware).
+    Extraction runs as a job of the chat, so /done can wait for it and /end cancels it.
+    """
     try:
-        # Create a temporary directory to store the file
-        with tempfile.TemporaryDirectory() as temp_dir:
-            if msg.document:
-                file = msg.document
-                file_path = os.path.join(temp_dir, file.file_name)
-            else:  # photo
-                file = msg.photo[-1]  # Get the highest quality photo
-                file_path = os.path.join(temp_dir, f"photo_{file.file_id}.jpg")
-            
-            # Download the file
-            await msg.bot.download(file, destination=file_path)
-            
-            # Process the file and extract data
-            extracted_data = process_file(file_path)
-            print(f"DEBUG: Extracted data from file: {extracted_data}")
-            
-            # Get current data and merge with new data
-            current_data = await state.get_data()
-            files_data = current_data.get('files_data', {})
-            
-            # Merge the new data with existing data
-            for key, value in extracted_data.items():
-                if value:  # Only update if the new value is not empty
-                    files_data[key] = value
-            
-            await state.update_data(files_data=files_data)
-            print(f"DEBUG: Current files_data in state: {files_data}")
-            
+        await extraction_executor.run_async(process_files(msg, state, album), chat_id=msg.chat.id)
+    except asyncio.CancelledError:
+        # The form was cancelled with /end while the document was processed
+        if asyncio.current_task().cancelling():
+            raise
+
+
+async def process_files(msg: types.Message, state: FSMContext, album: Optional[List[types.Message]]) -> None:
+    """
+    Download and extract the files of a message or an album and merge them into the form.
+    The upload is marked in the FSM data while it runs, see pending_upload().
+    """
+    async with pending_upload(state) as upload:
+        tickets = []
+        try:
+            files = [message_file(message) for message in album or [msg]]
+
+            # Take places in the extraction queue first; when it is full, say so instead of piling up work
+            try:
+                tickets = extraction_scheduler.admit(msg.chat.id, len(files))
+            except SchedulerBusy as e:
+                await msg.answer(f"⏳ {e}")
+                return
+        
+            # Download the files into memory in parallel
+            with telemetry.span('telegram_download', files=len(files)):
+                downloads = await asyncio.gather(*(download(msg.bot, file) for file, _ in files))
+            position = extraction_scheduler.position(tickets[0])
+            if position:
+                status = await msg.answer(f"⏳ Бот сейчас занят, ваша очередь: {position}. Документы будут обработаны автоматически.")
+            else:
+                status = await msg.answer("⏳ Документ обрабатывается..." if len(files) == 1 else f"⏳ Документов в альбоме: {len(files)}, обрабатываются...")
+        
+            # Every document (photo or PDF page) is extracted off the event loop,
+            # results are merged into the form as soon as each one is ready
+            processed = 0
+            documents = [(data, file_name) for data, (_, file_name) in zip(downloads, files)]
+            results = extract_files_documents(documents, chat_id=msg.chat.id, tickets=tickets)
+            async with aclosing(results):
+                async for extracted_data in results:
+                    print(f"DEBUG: Extracted data from document: {redact(extracted_data)}")
+                    if 'error' in extracted_data:
+                        await msg.answer(f"❌ Ошибка обработки документа: {extracted_data['error']}")
+                        continue
+
+                    # Merge with the current data; other uploads of this chat may be merging too
+                    async with state_lock(state):
+                        current_data = await state.get_data()
+                        if upload_cancelled(current_data, upload):
+                            # /end or /new_form on another worker: drop the rest of the upload
+                            await status.delete()
+                            return
+                        files_data = merge_extracted(current_data.get('files_data', {}), extracted_data)
+                        await state.update_data(files_data=files_data)
+                    print(f"DEBUG: Current files_data in state: {redact(files_data)}")
+
+                    processed += 1
+                    await status.edit_text(f"⏳ Обработано документов: {processed}\n" + format_summary(files_data))
+        
+            if processed == 0:
+                await status.delete()
+                return
+        
             # Acknowledge receipt
-            await msg.answer("✅ Документы получены и обработаны. Вы можете отправить больше документов или нажать /done когда закончите.")
+            if await state.get_state() == DocumentFlow.waiting_files:
+                await status.edit_text("✅ Документы получены и обработаны. Вы можете отправить больше документов или нажать /done когда закончите.")
+            else:
+                await status.edit_text("✅ Документы получены и обработаны.\n" + format_summary(files_data))
             
-    except Exception as e:
-        await msg.answer(f"❌ Ошибка обработки документа: {str(e)}")
+        except asyncio.TimeoutError:
+            await msg.answer("❌ Обработка документа заняла слишком много времени. Пожалуйста, попробуйте снова.")
+        except Exception as e:
+            await msg.answer(f"❌ Ошибка обработки документа: {str(e)}")
+        finally:
+            # Places of files that never got to extraction, e.g. a download failed
+            for ticket in tickets:
+                extraction_scheduler.finish(ticket)
+
+SUMMARY_FIELDS = {
+    'load_date': 'Дата погрузки',
+    'number_plates': 'Тягач',
+    'driver_name': 'ФИО',
+    # 'passport_series': 'Серия паспорта',
+    'passport_number': 'Номер паспорта',
+    'passport_authority': 'Кем выдан',
+    'passport_date_issued': 'Дата выдачи паспорта',
+}
+
+def format_summary(files_data: dict) -> str:
+    """Format the extracted fields as a list for the user."""
+    response = ""
+    for field_key, field_name in SUMMARY_FIELDS.items():
+        value = files_data.get(field_key, '')
+        response += f"- {field_name}: {value}\n"
+    return response
 
 @user_router.message(DocumentFlow.waiting_files, Command('done'))
 async def cmd_done(msg: types.Message, state: FSMContext) -> None:
-    """Process the /done command."""
+    """Process the /done command once every upload of the chat is extracted."""
+    await summarise_form(msg, state)
+
+
+async def wait_uploads(state: FSMContext, chat_id: int, timeout: float) -> bool:
+    """
+    Wait up to `timeout` seconds for the uploads of a chat, on this worker or
+    another one sharing the FSM storage. Returns True once none are left.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    if not await extraction_executor.wait_chat(chat_id, timeout=timeout):
+        return False
+    # What is still marked runs on other workers
+    while await uploads_pending(state):
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return False
+        await asyncio.sleep(min(UPLOAD_POLL_INTERVAL, remaining))
+    return True
+
+
+async def summarise_form(msg: types.Message, state: FSMContext) -> None:
+    """Wait for the uploads still extracting, show the data and ask for the company."""
+    if extraction_executor.chat_jobs(msg.chat.id) or await uploads_pending(state):
+        text = "⏳ Дожидаемся обработки документов..."
+        progress = await msg.answer(text)
+        started = asyncio.get_running_loop().time()
+        while not await wait_uploads(state, msg.chat.id, timeout=DONE_PROGRESS_INTERVAL):
+            elapsed = int(asyncio.get_running_loop().time() - started)
+            # Telegram rejects edits that don't change the text
+            if f"{elapsed} с" not in text:
+                text = f"⏳ Дожидаемся обработки документов... {elapsed} с"
+                await progress.edit_text(text)
+        await progress.delete()
+
     data = await state.get_data()
     files_data = data.get('files_data', {})
     files_data.update({'load_date': date.today().strftime('%d/%m/%Y')})
@@ -134,20 +322,7 @@ async def cmd_done(msg: types.Message, state: FSMContext) -> None:
     inbound = data.get('inbound')
     response = f"{outbound.upper()} - {inbound.upper()}\n"
     #response = "📄 Данные:\n"
-    fields = {
-        'load_date': 'Дата погрузки',
-        'number_plates': 'Тягач',
-        'driver_name': 'ФИО',
-        # 'passport_series': 'Серия паспорта',
-        'passport_number': 'Номер паспорта',
-        'passport_authority': 'Кем выдан',
-        'passport_date_issued': 'Дата выдачи паспорта',
-        
-    }
-    
-    for field_key, field_name in fields.items():
-        value = files_data.get(field_key, '')
-        response += f"- {field_name}: {value}\n"
+    response += format_summary(files_data)
     
     await msg.answer(response)
     await msg.answer(
@@ -162,19 +337,19 @@ class DocumentCallback(CallbackData, prefix="doc"):
     step: int = 1
 
 # Create keyboard for company selection
-def get_company_keyboard():
+def get_company_keyboard(action: str = "company"):
     return types.InlineKeyboardMarkup(inline_keyboard=[
         [types.InlineKeyboardButton(
             text="🚛 Kedr", 
-            callback_data=DocumentCallback(action="company", value="kedr").pack()
+            callback_data=DocumentCallback(action=action, value="kedr").pack()
         )],
         [types.InlineKeyboardButton(
             text="🏭 Chinwood", 
-            callback_data=DocumentCallback(action="company", value="chinwood").pack()
+            callback_data=DocumentCallback(action=action, value="chinwood").pack()
         )],
         [types.InlineKeyboardButton(
             text="🔧 Palisandr", 
-            callback_data=DocumentCallback(action="company", value="palisandr").pack()
+            callback_data=DocumentCallback(action=action, value="palisandr").pack()
         )]
     ])
 
@@ -196,7 +371,59 @@ async def company_chosen(callback: types.CallbackQuery, callback_data: DocumentC
     # Important: acknowledge the callback
     await callback.answer()
 
-@user_router.message(DocumentFlow.waiting_factory, F.text)
+def driver_label(driver: dict) -> str:
+    return ' — '.join(filter(None, [driver['driver_name'], driver.get('number_plates')]))
+
+
+async def use_driver(msg: types.Message, state: FSMContext, driver: dict) -> None:
+    """Take a registry driver's data for the form; on the files step go straight to the company."""
+    async with state_lock(state):
+        data = await state.get_data()
+        files_data = {**data.get('files_data', {}), **{key: driver[key] for key in DRIVER_FIELDS if key in driver}}
+        await state.update_data(files_data=files_data, registry_driver=driver['id'])
+
+    if await state.get_state() == DocumentFlow.waiting_files:
+        await summarise_form(msg, state)
+    else:
+        await msg.answer(f"✅ Водитель: {driver_label(driver)}. Документы отправлять не нужно.")
+
+
+# Inline mode (enable it with @BotFather): typing @bot and a plate or name suggests known drivers
+@user_router.inline_query()
+async def driver_search(query: types.InlineQuery) -> None:
+    drivers = await driver_registry.search(query.from_user.id, query.query)
+    await query.answer(
+        [
+            types.InlineQueryResultArticle(
+                id=str(driver['id']),
+                title=driver['driver_name'],
+                description=' · '.join(filter(None, [driver.get('number_plates'), mask(driver['passport_number'])])),
+                input_message_content=types.InputTextMessageContent(message_text=f"/driver #{driver['id']}"),
+            )
+            for driver in drivers
+        ],
+        cache_time=5,
+        is_personal=True
+    )
+
+
+@user_router.callback_query(DocumentCallback.filter(F.action == "driver"))
+async def driver_chosen(callback: types.CallbackQuery, callback_data: DocumentCallback, state: FSMContext):
+    if await state.get_state() not in (DocumentFlow.waiting_outbound, DocumentFlow.waiting_inbound, DocumentFlow.waiting_files):
+        await callback.answer("Пожалуйста, начните новую форму с /new_form")
+        return
+
+    driver = await driver_registry.get(callback.from_user.id, int(callback_data.value))
+    if driver is None:
+        await callback.answer("Водитель не найден")
+        return
+
+    await callback.message.edit_text(f"Выбран водитель: {driver_label(driver)}")
+    await callback.answer()
+    await use_driver(callback.message, state, driver)
+
+
+@user_router.message(DocumentFlow.waiting_factory, F.text, ~F.text.startswith('/'))
 async def factory_chosen(msg: types.Message, state: FSMContext):
     """Handle factory name input."""
     factory_name = msg.text
@@ -213,24 +440,40 @@ async def factory_chosen(msg: types.Message, state: FSMContext):
     files_data = data.get('files_data', {})
     
     try:
-        # Create a temporary directory for our output files
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Add the factory name to the extracted data
-            files_data['vendor_name'] = factory
-            print(f"DEBUG: Added vendor_name: {factory}")
-            print(f"DEBUG: Complete data to process: {files_data}")
-            
-            filled_form_path = insert_data(company, files_data, temp_dir)
-            print(f"DEBUG: Created filled form at: {filled_form_path}")
-            
-            # Send the filled form to the user
-            with open(filled_form_path, 'rb') as file:
+        # Add the factory name to the extracted data
+        files_data['vendor_name'] = factory
+        print(f"DEBUG: Added vendor_name: {factory}")
+        print(f"DEBUG: Complete data to process: {redact(files_data)}")
+        
+        with telemetry.span('template_fill'):
+            filled_form = insert_data(company, files_data)
+        print(f"DEBUG: Created filled form for: {company}")
+        
+        # Send the filled form to the user straight from memory
+        with telemetry.span('telegram_upload'):
+            await msg.answer_document(
+                document=types.BufferedInputFile(filled_form.getvalue(), filename=f'{company}_form_filled.xlsx'),
+                caption=f"Filled form for {factory}"
+            )
+
+        if pdf_converter.available:
+            try:
+                pdf_data = await pdf_converter.convert(filled_form.getvalue())
                 await msg.answer_document(
-                    document=types.FSInputFile(filled_form_path),
-                    caption=f"Filled form for {factory}"
+                    document=types.BufferedInputFile(pdf_data, filename=f'{company}_form_filled.pdf'),
+                    caption=f"PDF for {factory}"
                 )
+            except Exception as e:
+                # The XLSX is already sent, the user can still convert it by hand
+                print(f"[DEBUG] PDF conversion error: {e}")
+                await msg.answer("⚠️ Не удалось создать PDF, сохраните XLSX в формате PDF вручную.")
         
         await msg.answer("✅ Форма была обработана и отправлена!")
+
+        # The user went through the form with this data: remember the driver for next time
+        if data.get('registry_driver'):
+            await driver_registry.mark_used(data['registry_driver'])
+        await driver_registry.save(msg.from_user.id, files_data)
         
     except Exception as e:
         await msg.answer(f"❌ Ошибка обработки формы: {str(e)}")
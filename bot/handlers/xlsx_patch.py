@@ -0,0 +1,185 @@
+import io
+import posixpath
+import re
+import zipfile
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+# The bits of SpreadsheetML the patcher needs; everything else is copied untouched
+SHEET_RE = re.compile(rb'<sheet\b[^>]*?\br:id="([^"]+)"')
+RELATIONSHIP_RE = re.compile(rb'<Relationship\b[^>]*?/>')
+ATTRIBUTE_RE = re.compile(rb'\b(Id|Type|Target)="([^"]*)"')
+MERGE_RE = re.compile(rb'<mergeCell\b[^>]*?\bref="([^"]+)"')
+ROW_RE = re.compile(rb'<row\b[^>]*?\br="(\d+)"[^>]*?(/>|>)')
+CELL_RE = re.compile(rb'<c\b[^>]*?\br="([A-Z]+)(\d+)"[^>]*?(?:/>|>.*?</c>)', re.S)
+STYLE_RE = re.compile(rb'\bs="(\d+)"')
+SST_COUNTS_RE = re.compile(rb'<sst\b[^>]*>')
+COORDINATE_RE = re.compile(r'\$?([A-Z]{1,3})\$?(\d+)')
+
+WORKSHEET_TYPE = b'/worksheet'
+SHARED_STRINGS_TYPE = b'/sharedStrings'
+
+
+@dataclass
+class XlsxTemplate:
+    """A workbook split into parts once, ready to be patched many times."""
+    parts: List[Tuple[zipfile.ZipInfo, bytes]]
+    sheet_path: str
+    shared_strings_path: Optional[str]
+    # Cells of the sheet that belong to a merged range but are not its top-left cell
+    covered_cells: frozenset
+
+    def part(self, path: str) -> bytes:
+        for info, data in self.parts:
+            if info.filename == path:
+                return data
+        raise KeyError(path)
+
+
+def _relationships(rels: bytes) -> List[Dict[bytes, bytes]]:
+    return [dict(ATTRIBUTE_RE.findall(match)) for match in RELATIONSHIP_RE.findall(rels)]
+
+
+def column_index(column: str) -> int:
+    """'A' -> 1, 'Z' -> 26, 'AA' -> 27."""
+    index = 0
+    for letter in column:
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index
+
+
+def split_coordinate(coordinate: str) -> Tuple[str, int]:
+    """'B12' -> ('B', 12). Plain string work: openpyxl takes a tenth of a second to import."""
+    match = COORDINATE_RE.fullmatch(coordinate.upper())
+    if match is None:
+        raise ValueError(f"Invalid cell coordinate: {coordinate!r}")
+    return match.group(1), int(match.group(2))
+
+
+def _covered_cells(sheet: bytes) -> frozenset:
+    covered = set()
+    for ref in MERGE_RE.findall(sheet):
+        first, _, last = ref.decode().partition(':')
+        min_row, min_col = cell_position(first)
+        max_row, max_col = cell_position(last or first)
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                if (row, col) != (min_row, min_col):
+                    covered.add((row, col))
+    return frozenset(covered)
+
+
+def load_template(data: bytes) -> XlsxTemplate:
+    """Split an XLSX file into its parts and find the first sheet and the shared strings."""
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        parts = [(info, archive.read(info)) for info in archive.infolist()]
+    files = {info.filename: content for info, content in parts}
+
+    rel_id = SHEET_RE.search(files['xl/workbook.xml']).group(1)
+    sheet_path = shared_strings_path = None
+    for rel in _relationships(files['xl/_rels/workbook.xml.rels']):
+        # Targets are relative to xl/, or absolute within the package
+        target = posixpath.normpath(posixpath.join('/xl', rel[b'Target'].decode())).lstrip('/')
+        if rel[b'Id'] == rel_id:
+            sheet_path = target
+        elif rel[b'Type'].endswith(SHARED_STRINGS_TYPE):
+            shared_strings_path = target
+
+    if sheet_path is None or sheet_path not in files:
+        raise ValueError("Workbook has no worksheet")
+
+    return XlsxTemplate(parts, sheet_path, shared_strings_path, _covered_cells(files[sheet_path]))
+
+
+def cell_position(coordinate: str) -> Tuple[int, int]:
+    column, row = split_coordinate(coordinate)
+    return row, column_index(column)
+
+
+def _cell_xml(column: bytes, row: bytes, old: Optional[bytes], value: bytes, shared: bool) -> bytes:
+    style = STYLE_RE.search(old[:old.index(b'>')]) if old else None
+    style_attr = b' s="' + style.group(1) + b'"' if style else b''
+    ref = column + row
+    if shared:
+        return b'<c r="' + ref + b'"' + style_attr + b' t="s"><v>' + value + b'</v></c>'
+    return b'<c r="' + ref + b'"' + style_attr + b' t="inlineStr"><is><t xml:space="preserve">' + value + b'</t></is></c>'
+
+
+def _set_cell(sheet: bytes, coordinate: str, value: bytes, shared: bool) -> bytes:
+    row_num, col_num = cell_position(coordinate)
+    column = split_coordinate(coordinate)[0].encode()
+    row = str(row_num).encode()
+
+    # Existing cell: replace it, keeping its style
+    for match in CELL_RE.finditer(sheet):
+        if match.group(1) == column and match.group(2) == row:
+            return sheet[:match.start()] + _cell_xml(column, row, match.group(0), value, shared) + sheet[match.end():]
+
+    new_cell = _cell_xml(column, row, None, value, shared)
+
+    # Existing row: insert the cell in column order
+    for match in ROW_RE.finditer(sheet):
+        if int(match.group(1)) != row_num:
+            continue
+        if match.group(2) == b'/>':
+            opening = match.group(0)[:-2] + b'>'
+            return sheet[:match.start()] + opening + new_cell + b'</row>' + sheet[match.end():]
+
+        row_end = sheet.index(b'</row>', match.end())
+        position = row_end
+        for cell in CELL_RE.finditer(sheet, match.end(), row_end):
+            if column_index(cell.group(1).decode()) > col_num:
+                position = cell.start()
+                break
+        return sheet[:position] + new_cell + sheet[position:]
+
+    # No such row: insert it in row order
+    position = sheet.index(b'</sheetData>')
+    for match in ROW_RE.finditer(sheet):
+        if int(match.group(1)) > row_num:
+            position = match.start()
+            break
+    return sheet[:position] + b'<row r="' + row + b'">' + new_cell + b'</row>' + sheet[position:]
+
+
+def _append_shared_strings(sst: bytes, strings: List[str]) -> Tuple[bytes, int]:
+    """Appends strings to the shared string table. Returns the table and the index of the first one."""
+    first = sst.count(b'<si>') + sst.count(b'<si ')
+    items = b''.join(b'<si><t xml:space="preserve">' + escape(s).encode() + b'</t></si>' for s in strings)
+    sst = sst.replace(b'</sst>', items + b'</sst>')
+
+    def bump(match: re.Match) -> bytes:
+        return re.sub(
+            rb'\b(count|uniqueCount)="(\d+)"',
+            lambda m: m.group(1) + b'="' + str(int(m.group(2)) + len(strings)).encode() + b'"',
+            match.group(0)
+        )
+
+    return SST_COUNTS_RE.sub(bump, sst, count=1), first
+
+
+def patch_template(template: XlsxTemplate, values: Dict[str, str]) -> bytes:
+    """
+    Write string values into cells of the template's sheet and return the new
+    XLSX file. Only the sheet and the shared strings are rewritten.
+    """
+    sheet = template.part(template.sheet_path)
+    replaced = {template.sheet_path: None}
+
+    cells = list(values.items())
+    if template.shared_strings_path:
+        sst, first = _append_shared_strings(template.part(template.shared_strings_path), [v for _, v in cells])
+        replaced[template.shared_strings_path] = sst
+        for i, (coordinate, _) in enumerate(cells):
+            sheet = _set_cell(sheet, coordinate, str(first + i).encode(), shared=True)
+    else:
+        for coordinate, value in cells:
+            sheet = _set_cell(sheet, coordinate, escape(value).encode(), shared=False)
+    replaced[template.sheet_path] = sheet
+
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w') as archive:
+        for info, data in template.parts:
+            archive.writestr(info, replaced.get(info.filename, data))
+    return output.getvalue()
@@ -0,0 +1,99 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, List
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message, TelegramObject
+from dotenv import load_dotenv
+
+from bot.handlers.extraction_executor import extraction_executor
+from bot.storage import pending_upload, upload_cancelled
+
+load_dotenv()
+# Telegram delivers the photos of an album as separate updates a few
+# hundred milliseconds apart; wait this long after the last one
+ALBUM_LATENCY = float(os.getenv('ALBUM_LATENCY', 0.8))
+
+
+class AlbumMiddleware(BaseMiddleware):
+    """
+    Collects the messages of a media group and calls the handler once, for the
+    first message, with every message of the group in `album`.
+    Only works within one process: albums split across webhook workers are
+    handled per worker.
+
+    The handler filters see the FSM state of the first message (aiogram reads
+    it before any message middleware), and the wait is a job of the chat: /done
+    sent while an album is still being collected waits for it like for any
+    other upload, and /end cancels it. The album is marked as an upload in
+    the FSM data meanwhile, so this holds across workers too.
+    """
+
+    def __init__(self, latency: float = ALBUM_LATENCY) -> None:
+        self.latency = latency
+        self._albums: Dict[tuple, List[Message]] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, Message) or event.media_group_id is None:
+            return await handler(event, data)
+
+        key = (event.chat.id, event.media_group_id)
+        album = self._albums.get(key)
+        if album is not None:
+            # The handler call for the first message takes care of this one
+            album.append(event)
+            return None
+
+        self._albums[key] = album = [event]
+        try:
+            return await extraction_executor.run_async(self._collect(handler, key, album, data), chat_id=event.chat.id)
+        except asyncio.CancelledError:
+            # The form was cancelled with /end while the album was collected
+            if asyncio.current_task().cancelling():
+                raise
+            return None
+
+    async def _wait(self, key: tuple, album: List[Message]) -> None:
+        # Wait until no new message of the group came in for a whole window
+        try:
+            size = 0
+            while size != len(album):
+                size = len(album)
+                await asyncio.sleep(self.latency)
+        finally:
+            del self._albums[key]
+
+    async def _collect(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        key: tuple,
+        album: List[Message],
+        data: Dict[str, Any],
+    ) -> Any:
+        state = data.get('state')
+        if state is None:
+            await self._wait(key, album)
+            return await self._handle(handler, album, data)
+
+        # Marked until the handler took over, which marks the upload itself
+        async with pending_upload(state) as upload:
+            await self._wait(key, album)
+            if upload_cancelled(await state.get_data(), upload):
+                # /end or /new_form on another worker
+                return None
+            return await self._handle(handler, album, data)
+
+    @staticmethod
+    async def _handle(
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        album: List[Message],
+        data: Dict[str, Any],
+    ) -> Any:
+        album.sort(key=lambda message: message.message_id)
+        data['album'] = album
+        return await handler(album[0], data)
@@ -0,0 +1,73 @@
+import asyncio
+import importlib
+import sys
+import time
+from typing import Dict, Iterable
+
+from bot.handlers.extraction_executor import WORKER_MODULES, extraction_executor
+from bot.handlers.form_templates import form_templates
+from bot.handlers.model_router import model_router
+
+
+def import_modules(names: Iterable[str]) -> Dict[str, float]:
+    """Import the modules, returning the seconds each one took; 0 for a module imported already."""
+    timings = {}
+    for name in names:
+        start = time.monotonic()
+        if name not in sys.modules:
+            importlib.import_module(name)
+        timings[name] = time.monotonic() - start
+    return timings
+
+
+class StartupReport:
+    """
+    Where the time to start the bot goes: consecutive phases from the start of
+    bot/app.py, then the warm-up that runs in the background once the bot polls.
+    """
+
+    def __init__(self, started: float) -> None:
+        self.started = started
+        self._last = started
+        self.phases: Dict[str, float] = {}
+        self.imports: Dict[str, float] = {}
+
+    def mark(self, phase: str) -> None:
+        """End a phase: the time since the previous mark is counted towards it."""
+        now = time.monotonic()
+        self.phases[phase] = now - self._last
+        self._last = now
+
+    def render(self) -> str:
+        lines = [f"{phase}: {seconds:.2f}s" for phase, seconds in self.phases.items()]
+        if self.imports:
+            slowest = sorted(self.imports.items(), key=lambda item: -item[1])
+            lines.append("worker imports: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in slowest))
+        return "\n".join(lines)
+
+    def metrics(self) -> dict:
+        return {f'startup_{phase}_seconds': round(seconds, 3) for phase, seconds in self.phases.items()}
+
+
+async def warm_up(report: StartupReport) -> None:
+    """
+    Load what the first form needs while the bot already answers: the model
+    clients (and openai with them), the form templates and the extraction
+    workers. A failed step is reported and left to happen on first use.
+    """
+    async def step(phase: str, coro):
+        try:
+            return await coro
+        except Exception as e:
+            print(f"[DEBUG] Warm-up step {phase} failed: {e}")
+            return None
+        finally:
+            report.mark(phase)
+
+    await step('model_clients', asyncio.to_thread(model_router.warm_up))
+    await step('templates', asyncio.to_thread(form_templates.load_all))
+    imports = await step('workers', extraction_executor.warm_up(import_modules, WORKER_MODULES))
+    if imports:
+        report.imports = imports[0]
+
+    print(f"[DEBUG] Startup report:\n{report.render()}")
@@ -0,0 +1,276 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Any, AsyncIterator, Dict, Optional
+from weakref import WeakKeyDictionary, WeakValueDictionary
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import (
+    BaseEventIsolation,
+    BaseStorage,
+    DefaultKeyBuilder,
+    KeyBuilder,
+    StateType,
+    StorageKey,
+)
+from aiogram.fsm.storage.memory import MemoryStorage
+from dotenv import load_dotenv
+
+load_dotenv()
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'memory')
+FSM_SQLITE_PATH = os.getenv('FSM_SQLITE_PATH', 'data/fsm.sqlite3')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+# Abandoned forms are dropped after this many seconds without activity
+FSM_TTL = int(os.getenv('FSM_TTL', 2 * 24 * 3600))
+# An upload still marked after this many seconds is taken to be lost with its worker
+PENDING_UPLOAD_TTL = float(os.getenv('PENDING_UPLOAD_TTL', 600))
+# A lock of a worker that died is free again after this many seconds
+SHARED_LOCK_TTL = 60
+SHARED_LOCK_POLL = 0.05
+
+# FSM data key of the uploads of a chat in flight, see pending_upload()
+PENDING_UPLOADS = 'pending_uploads'
+
+# One lock per FSM key, dropped as soon as nobody holds it
+_state_locks: 'WeakValueDictionary[StorageKey, asyncio.Lock]' = WeakValueDictionary()
+# Locks shared by the workers using a storage, for storages that have them
+_isolations: 'WeakKeyDictionary[BaseStorage, BaseEventIsolation]' = WeakKeyDictionary()
+
+# Compact JSON: no whitespace, Cyrillic kept as is
+json_dumps = partial(json.dumps, ensure_ascii=False, separators=(',', ':'))
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Durable FSM storage in a local SQLite file. Every key expires `ttl`
+    seconds after its last write, so abandoned forms don't pile up.
+    Several bot processes on one host can share the file.
+
+    Queries run on a thread of their own: waiting for another process's write
+    lock (up to 10 s) doesn't stall the event loop, and the connection is only
+    ever used from that thread.
+    """
+
+    def __init__(self, path: str, ttl: Optional[int] = None, key_builder: Optional[KeyBuilder] = None) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self._db: Optional[sqlite3.Connection] = None
+        self._writes = 0
+        self._thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fsm-sqlite')
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path, timeout=10)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS fsm ('
+                'key TEXT NOT NULL, part TEXT NOT NULL, value TEXT, expires REAL, '
+                'PRIMARY KEY (key, part))'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS fsm_expires ON fsm (expires)')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS fsm_locks (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)'
+            )
+        return self._db
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._thread, func, *args)
+
+    def _expires(self) -> Optional[float]:
+        return time.time() + self.ttl if self.ttl else None
+
+    def _read(self, key: StorageKey, part: str) -> Optional[str]:
+        row = self.db.execute(
+            'SELECT value FROM fsm WHERE key = ? AND part = ? AND (expires IS NULL OR expires > ?)',
+            (self.key_builder.build(key), part, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def _write(self, key: StorageKey, part: str, value: Optional[str]) -> None:
+        storage_key = self.key_builder.build(key)
+        with self.db:
+            if value is None:
+                self.db.execute('DELETE FROM fsm WHERE key = ? AND part = ?', (storage_key, part))
+            else:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO fsm (key, part, value, expires) VALUES (?, ?, ?, ?)',
+                    (storage_key, part, value, self._expires())
+                )
+                # Keep the other part of the record alive as long as this one
+                self.db.execute(
+                    'UPDATE fsm SET expires = ? WHERE key = ?', (self._expires(), storage_key)
+                )
+
+            # Expired rows are purged every now and then
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self.db.execute('DELETE FROM fsm WHERE expires IS NOT NULL AND expires <= ?', (time.time(),))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._run(self._write, key, 'state', state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self._run(self._read, key, 'state')
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._run(self._write, key, 'data', json_dumps(data) if data else None)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        value = await self._run(self._read, key, 'data')
+        return json.loads(value) if value else {}
+
+    def _acquire(self, key: StorageKey, owner: str) -> bool:
+        now = time.time()
+        with self.db:
+            cursor = self.db.execute(
+                'INSERT INTO fsm_locks (key, owner, expires) VALUES (?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, expires = excluded.expires '
+                'WHERE fsm_locks.expires <= ?',
+                (self.key_builder.build(key, 'lock'), owner, now + SHARED_LOCK_TTL, now)
+            )
+        return cursor.rowcount == 1
+
+    def _release(self, key: StorageKey, owner: str) -> None:
+        with self.db:
+            self.db.execute('DELETE FROM fsm_locks WHERE key = ? AND owner = ?', (self.key_builder.build(key, 'lock'), owner))
+
+    def create_isolation(self) -> 'SQLiteEventIsolation':
+        return SQLiteEventIsolation(self)
+
+    def _close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    async def close(self) -> None:
+        await self._run(self._close)
+        self._thread.shutdown()
+
+
+class SQLiteEventIsolation(BaseEventIsolation):
+    """
+    Lock of an FSM key shared by the processes using one SQLiteStorage file,
+    the counterpart of aiogram's RedisEventIsolation. A lock left by a process
+    that died expires after SHARED_LOCK_TTL seconds.
+    """
+
+    def __init__(self, storage: SQLiteStorage) -> None:
+        self.storage = storage
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncIterator[None]:
+        owner = uuid.uuid4().hex
+        while not await self.storage._run(self.storage._acquire, key, owner):
+            await asyncio.sleep(SHARED_LOCK_POLL)
+        try:
+            yield
+        finally:
+            await self.storage._run(self.storage._release, key, owner)
+
+    async def close(self) -> None:
+        pass
+
+
+@asynccontextmanager
+async def state_lock(state: FSMContext) -> AsyncIterator[None]:
+    """
+    Lock for a read-modify-write of a chat's FSM data, so concurrent handlers
+    of one chat don't overwrite each other's updates. With the SQLite or Redis
+    storage the lock is shared by every worker using it.
+    """
+    lock = _state_locks.get(state.key)
+    if lock is None:
+        lock = _state_locks[state.key] = asyncio.Lock()
+
+    isolation = _isolations.get(state.storage)
+    if isolation is None and hasattr(state.storage, 'create_isolation'):
+        isolation = _isolations[state.storage] = state.storage.create_isolation()
+
+    # Handlers of this process queue up here, so only one of them polls the shared lock
+    async with lock:
+        if isolation is None:
+            yield
+            return
+        async with isolation.lock(state.key):
+            yield
+
+
+def live_uploads(data: Dict[str, Any]) -> Dict[str, float]:
+    """Uploads of the chat in flight, by token, with the time their mark expires."""
+    now = time.time()
+    return {token: expires for token, expires in data.get(PENDING_UPLOADS, {}).items() if expires > now}
+
+
+def upload_cancelled(data: Dict[str, Any], token: str) -> bool:
+    """Whether the form an upload belongs to was cancelled (/end, /new_form...) since it started."""
+    return token not in data.get(PENDING_UPLOADS, {})
+
+
+async def uploads_pending(state: FSMContext) -> int:
+    """Number of uploads of the chat in flight on any worker."""
+    return len(live_uploads(await state.get_data()))
+
+
+@asynccontextmanager
+async def pending_upload(state: FSMContext) -> AsyncIterator[str]:
+    """
+    Mark an upload as in flight in the chat's FSM data, so /done waits for it
+    on whichever worker /done arrives, and yield the mark's token. Clearing the
+    state (/end, /new_form) drops the mark: the upload checks upload_cancelled()
+    before it merges a result, which stops it on another worker too.
+    """
+    token = uuid.uuid4().hex
+    async with state_lock(state):
+        data = await state.get_data()
+        await state.update_data({PENDING_UPLOADS: {**live_uploads(data), token: time.time() + PENDING_UPLOAD_TTL}})
+    try:
+        yield token
+    finally:
+        async with state_lock(state):
+            pending = (await state.get_data()).get(PENDING_UPLOADS, {})
+            if token in pending:
+                del pending[token]
+                await state.update_data({PENDING_UPLOADS: pending})
+
+
+def build_storage(backend: str = FSM_STORAGE) -> BaseStorage:
+    """
+    FSM storage selected by FSM_STORAGE: 'memory' (single process, lost on
+    restart), 'sqlite' (durable, one host) or 'redis' (shared by many workers).
+    Workers sharing the SQLite or Redis storage share state_lock() and the
+    upload marks of pending_upload() too.
+    """
+    if backend == 'memory':
+        return MemoryStorage()
+
+    if backend == 'sqlite':
+        return SQLiteStorage(FSM_SQLITE_PATH, ttl=FSM_TTL)
+
+    if backend == 'redis':
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError as e:
+            raise RuntimeError("FSM_STORAGE=redis needs the redis package: pip install redis") from e
+
+        return RedisStorage.from_url(
+            REDIS_URL,
+            key_builder=DefaultKeyBuilder(with_destiny=True),
+            state_ttl=FSM_TTL,
+            data_ttl=FSM_TTL,
+            json_dumps=json_dumps,
+        )
+
+    raise ValueError(f"Unknown FSM_STORAGE: {backend}")
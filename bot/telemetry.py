@@ -0,0 +1,195 @@
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+if TYPE_CHECKING:
+    # Only the bot process serves /metrics; the extraction workers don't need aiohttp
+    from aiohttp import web
+
+load_dotenv()
+# Prometheus endpoint, local only by default; port 0 turns it off
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9100))
+# Share of spans also written to the log as JSON lines; histograms always see every span
+SPAN_SAMPLE_RATE = float(os.getenv('SPAN_SAMPLE_RATE', 0.0))
+# Mask passport data and plates in logs
+REDACT_PII = os.getenv('REDACT_PII', '1') == '1'
+
+# Seconds; from a quick OCR call up to a slow model answer
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+PII_FIELDS = {
+    'driver_name', 'passport_series', 'passport_number', 'passport_authority',
+    'passport_date_issued', 'number_plates', 'date_of_birth', 'date_of_expiry',
+}
+
+
+def redact(value):
+    """
+    A copy of the value that is safe to log: PII fields of dicts are masked
+    and free text (e.g. a raw model reply) is replaced by its length.
+    Other dict values are kept, they are ours (counts, names of stages).
+    """
+    if not REDACT_PII:
+        return value
+    if isinstance(value, dict):
+        return {
+            key: mask(item) if key in PII_FIELDS else redact(item) if isinstance(item, (dict, list, tuple)) else item
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    if isinstance(value, str):
+        return f"<{len(value)} chars>"
+    return value
+
+
+def mask(value) -> str:
+    """Keeps the first character and the length, e.g. 'I***(11)'."""
+    if not value or not isinstance(value, str):
+        return str(value)
+    return f"{value[0]}***({len(value)})"
+
+
+@contextmanager
+def stage_timer(timings: Dict[str, float], stage: str) -> Iterator[None]:
+    """
+    Adds the duration of a stage to a dict. Used in worker processes, whose
+    timings travel back with the result and are recorded by the bot process.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile; inf past the last bucket."""
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float('inf')
+
+
+class Telemetry:
+    """
+    Per-stage latency histograms and the counters of the bot's components,
+    rendered in the Prometheus text format.
+    """
+
+    def __init__(self, sample_rate: float) -> None:
+        self.sample_rate = sample_rate
+        self.stages: Dict[str, Histogram] = {}
+        self._collectors: List[Callable[[], dict]] = []
+        self._listeners: List[Callable[[str, float], None]] = []
+
+    def observe(self, stage: str, seconds: float, **attributes) -> None:
+        if stage not in self.stages:
+            self.stages[stage] = Histogram()
+        self.stages[stage].observe(seconds)
+        for listener in self._listeners:
+            listener(stage, seconds)
+
+        if self.sample_rate and random.random() < self.sample_rate:
+            print(json.dumps({'span': stage, 'ms': round(seconds * 1000, 1), **redact(attributes)},
+                             ensure_ascii=False, default=str))
+
+    def record(self, timings: Dict[str, float]) -> None:
+        """Record stage durations measured elsewhere, see stage_timer."""
+        for stage, seconds in timings.items():
+            self.observe(stage, seconds)
+
+    @contextmanager
+    def span(self, stage: str, **attributes) -> Iterator[None]:
+        """Time a stage of the pipeline; works around sync and async code alike."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, **attributes)
+
+    def add_collector(self, collector: Callable[[], dict]) -> None:
+        """Register a metrics() function whose numbers are exported as gauges."""
+        self._collectors.append(collector)
+
+    def add_listener(self, listener: Callable[[str, float], None]) -> None:
+        """Also pass every observation to listener(stage, seconds), e.g. to keep raw samples."""
+        self._listeners.append(listener)
+
+    def render(self) -> str:
+        lines = [
+            '# HELP bot_stage_seconds Duration of each pipeline stage',
+            '# TYPE bot_stage_seconds histogram',
+        ]
+        for stage, histogram in sorted(self.stages.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'bot_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'bot_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+            lines.append(f'bot_stage_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+            lines.append(f'bot_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+        for collector in self._collectors:
+            for key, value in collector().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f'# TYPE bot_{key} gauge')
+                    lines.append(f'bot_{key} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def metrics(self) -> dict:
+        """p50 and p95 of every stage, in seconds, for /stats."""
+        metrics = {}
+        for stage, histogram in sorted(self.stages.items()):
+            metrics[f'stage_{stage}_p50'] = histogram.quantile(0.5)
+            metrics[f'stage_{stage}_p95'] = histogram.quantile(0.95)
+        return metrics
+
+    async def handle_metrics(self, request: 'web.Request') -> 'web.Response':
+        from aiohttp import web
+
+        return web.Response(body=self.render().encode(),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+async def start_metrics_server(telemetry: Telemetry, host: str = METRICS_HOST,
+                               port: int = METRICS_PORT) -> Optional['web.AppRunner']:
+    """Serve /metrics on a local port. Returns the runner to clean up, or None when disabled."""
+    if not port:
+        return None
+    from aiohttp import web
+
+    app = web.Application()
+    app.router.add_get('/metrics', telemetry.handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"[DEBUG] Metrics on http://{host}:{port}/metrics")
+    return runner
+
+
+telemetry = Telemetry(SPAN_SAMPLE_RATE)
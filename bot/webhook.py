@@ -0,0 +1,106 @@
+import asyncio
+import os
+import signal
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from dotenv import load_dotenv
+
+load_dotenv()
+# Public HTTPS address Telegram sends updates to, e.g. https://bot.example.com
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+# Seconds /readyz answers 503 after SIGTERM before the listener closes, so the
+# load balancer takes the worker out before its connections are refused
+WEBHOOK_STOP_DELAY = float(os.getenv('WEBHOOK_STOP_DELAY', 5))
+
+
+class Health:
+    """Readiness flag for the load balancer: off until the webhook is set and again while draining."""
+
+    def __init__(self) -> None:
+        self.ready = False
+
+    async def live(self, request: web.Request) -> web.Response:
+        return web.Response(text='ok')
+
+    async def readiness(self, request: web.Request) -> web.Response:
+        if self.ready:
+            return web.Response(text='ready')
+        return web.Response(status=503, text='not ready')
+
+
+def create_app(dp: Dispatcher, bot: Bot) -> web.Application:
+    """
+    aiohttp application that feeds webhook updates to the dispatcher and
+    exposes /healthz (liveness) and /readyz (readiness).
+    """
+    if not WEBHOOK_BASE_URL:
+        raise RuntimeError("RUN_MODE=webhook needs WEBHOOK_BASE_URL")
+
+    health = Health()
+    dp['health'] = health
+
+    async def set_webhook(bot: Bot) -> None:
+        # Every worker sets the same URL, so this is safe to repeat
+        await bot.set_webhook(
+            f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=False
+        )
+        health.ready = True
+
+    dp.startup.register(set_webhook)
+
+    app = web.Application()
+    app.router.add_get('/healthz', health.live)
+    app.router.add_get('/readyz', health.readiness)
+
+    # Updates are acknowledged right away and handled in the background
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET,
+        handle_in_background=True
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def serve(app: web.Application, health: Health, host: str, port: int, stop_delay: float) -> None:
+    """
+    Serve the app until SIGINT or SIGTERM. On the signal readiness turns off
+    at once and the app keeps serving for `stop_delay` seconds; only then the
+    listener closes and the shutdown hooks drain the extractions.
+    """
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+        print(f"[DEBUG] Webhook server listening on {host}:{port}")
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        try:
+            await stop.wait()
+        finally:
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(signum)
+
+        health.ready = False
+        await asyncio.sleep(stop_delay)
+    finally:
+        await runner.cleanup()
+
+
+def run_webhook(dp: Dispatcher, bot: Bot) -> None:
+    """Serve the webhook until SIGINT or SIGTERM."""
+    app = create_app(dp, bot)
+    asyncio.run(serve(app, dp['health'], WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_STOP_DELAY))
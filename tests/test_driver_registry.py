@@ -0,0 +1,57 @@
+import asyncio
+import sqlite3
+
+from bot.handlers.driver_registry import DriverRegistry
+
+IVANOV = {'driver_name': 'Ivanov Ivan Ivanovich', 'passport_number': 'AA 1234567', 'number_plates': '01 123 ABC'}
+PETROV = {'driver_name': 'Petrov Pyotr', 'passport_number': 'AB7654321', 'number_plates': '10 777 XYZ'}
+
+
+def names(drivers):
+    return sorted(driver['driver_name'] for driver in drivers)
+
+
+def test_search_by_any_word_plate_or_passport(tmp_path):
+    async def main():
+        registry = DriverRegistry(str(tmp_path / 'drivers.sqlite3'), suggestions=10, shared=False)
+        await registry.save(1, IVANOV)
+        await registry.save(1, PETROV)
+
+        assert names(await registry.search(1, 'ivanov')) == ['Ivanov Ivan Ivanovich']
+        assert names(await registry.search(1, 'ivanovi')) == ['Ivanov Ivan Ivanovich']
+        assert names(await registry.search(1, 'Ivan Ivanov')) == ['Ivanov Ivan Ivanovich']
+        assert names(await registry.search(1, 'pyo')) == ['Petrov Pyotr']
+        assert names(await registry.search(1, '10 777')) == ['Petrov Pyotr']
+        assert names(await registry.search(1, 'aa123')) == ['Ivanov Ivan Ivanovich']
+        assert names(await registry.search(1, 'van')) == []
+        assert names(await registry.search(2, 'ivanov')) == []
+
+        assert names(await registry.search(1, ' ')) == ['Ivanov Ivan Ivanovich', 'Petrov Pyotr']
+        assert await registry.search(1, '...') == []
+
+        # A corrected name replaces the old one in the index
+        await registry.save(1, {**PETROV, 'driver_name': 'Sidorov Pyotr'})
+        assert await registry.search(1, 'petrov') == []
+        assert names(await registry.search(1, 'sid')) == ['Sidorov Pyotr']
+        await registry.close()
+
+    asyncio.run(main())
+
+
+def test_registry_written_before_the_name_index(tmp_path):
+    path = str(tmp_path / 'drivers.sqlite3')
+
+    async def main():
+        registry = DriverRegistry(path, suggestions=10, shared=False)
+        await registry.save(1, IVANOV)
+        await registry.close()
+
+        db = sqlite3.connect(path)
+        db.execute('DROP TABLE names')
+        db.close()
+
+        registry = DriverRegistry(path, suggestions=10, shared=False)
+        assert names(await registry.search(1, 'ivanovich')) == ['Ivanov Ivan Ivanovich']
+        await registry.close()
+
+    asyncio.run(main())
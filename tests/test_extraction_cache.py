@@ -0,0 +1,74 @@
+import asyncio
+import sqlite3
+
+from bot.handlers.extraction_cache import ExtractionCache
+
+
+def flip(phash: int, bits) -> int:
+    for bit in bits:
+        phash ^= 1 << bit
+    return phash
+
+
+def test_similar_photos_are_found_through_the_bands(tmp_path):
+    async def main():
+        path = str(tmp_path / 'cache.sqlite3')
+        cache = ExtractionCache(path, ttl=3600, max_entries=2, phash_distance=8)
+        phash = int('9f' * 32, 16)
+        await cache.put('a', phash, {'driver_name': 'A'})
+
+        # 8 bits apart, spread over half of the bands
+        assert await cache.get('b', flip(phash, range(0, 256, 32))) == {'driver_name': 'A'}
+        assert await cache.get('c', flip(phash, range(0, 256, 16))) is None
+        assert cache.counters == {'hits': 0, 'phash_hits': 1, 'misses': 1}
+
+        # Evicted entries leave the index with them
+        await cache.put('d', None, {})
+        await cache.put('e', None, {})
+        assert await cache.get('f', phash) is None
+        await cache.close()
+        assert sqlite3.connect(path).execute('SELECT COUNT(*) FROM phash_bands').fetchone() == (0,)
+
+    asyncio.run(main())
+
+
+def test_cache_written_before_the_bands_is_indexed(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    db = sqlite3.connect(path)
+    db.execute('CREATE TABLE extractions (digest TEXT PRIMARY KEY, phash TEXT, result TEXT NOT NULL, '
+               'created REAL NOT NULL, accessed REAL NOT NULL)')
+    db.execute("INSERT INTO extractions VALUES ('a', 'ff00', '{}', 1e12, 1e12)")
+    db.commit()
+    db.close()
+
+    async def main():
+        cache = ExtractionCache(path, ttl=3600, max_entries=10, phash_distance=8)
+        assert await cache.get('b', 0xff01) == {}
+        await cache.close()
+
+    asyncio.run(main())
+
+
+def test_fields_read_without_the_model_are_not_cached(tmp_path, monkeypatch):
+    from bot.handlers import data_extraction, extraction_executor
+    from bot.handlers.data_extraction import PreparedImage
+
+    async def prepared_documents(file_data, file_name, chat_id=None):
+        yield PreparedImage('data:image/jpeg;base64,', {'passport_number': 'AA1234567'}, 'passport')
+
+    async def request_documents(image_urls, doc_type=None):
+        return {'error': 'Error code: 429'}
+
+    async def main():
+        cache = ExtractionCache(str(tmp_path / 'cache.sqlite3'), ttl=3600, max_entries=10, phash_distance=8)
+        monkeypatch.setattr(extraction_executor, 'extraction_cache', cache)
+        results = [result async for result in extraction_executor.extract_new_file_documents(
+            b'passport', 'passport.jpg', 'digest', None)]
+        assert results[0]['passport_number'] == 'AA1234567'
+        assert 'partial' not in results[0]
+        assert await cache.get('digest') is None
+        await cache.close()
+
+    monkeypatch.setattr(extraction_executor, 'prepared_documents', prepared_documents)
+    monkeypatch.setattr(data_extraction, 'request_documents', request_documents)
+    asyncio.run(main())
@@ -0,0 +1,39 @@
+import asyncio
+import time
+
+from aiogram.types import Message
+
+from bot.handlers.extraction_executor import extraction_executor
+from bot.middlewares import AlbumMiddleware
+
+
+def photo_message(message_id: int, chat_id: int) -> Message:
+    return Message.model_validate({
+        'message_id': message_id,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private'},
+        'media_group_id': 'album',
+        'photo': [{'file_id': f'photo{message_id}', 'file_unique_id': f'photo{message_id}', 'width': 1, 'height': 1}],
+    })
+
+
+def test_done_waits_for_album_being_collected():
+    async def main():
+        middleware = AlbumMiddleware(latency=0.05)
+        handled = []
+
+        async def handler(event, data):
+            handled.append([message.message_id for message in data['album']])
+
+        chat_id = 7
+        first = asyncio.create_task(middleware(handler, photo_message(1, chat_id), {}))
+        await asyncio.sleep(0)
+        await middleware(handler, photo_message(2, chat_id), {})
+
+        # What /done does before it reads the form
+        assert extraction_executor.chat_jobs(chat_id) == 1
+        assert await extraction_executor.wait_chat(chat_id, timeout=1)
+        assert handled == [[1, 2]]
+        await first
+
+    asyncio.run(main())
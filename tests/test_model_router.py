@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+from openai import APIStatusError
+
+from benchmarks.fake_openai import FakeOpenAI
+from bot.handlers.model_router import ModelRouter
+from bot.handlers.openai_backend import OpenAIBackend
+
+REQUEST = {'messages': [{'role': 'user', 'content': [{'type': 'text', 'text': 'Extract the passport fields'}]}]}
+
+
+def backend(name: str, base_url: str, deadline: float = 30, failover_after=None) -> OpenAIBackend:
+    return OpenAIBackend(name, 'fake', base_url, 'test', max_concurrency=4, requests_per_minute=6000, burst=10,
+                         max_retries=0, deadline=deadline, failover_after=failover_after)
+
+
+def run_route(names, **settings):
+    """Ask a route of the given backends once: each one is 'broken' (503), 'slow' or 'good'."""
+    servers = {
+        'broken': FakeOpenAI(latency=0.01, jitter=0, error_rate=1.0),
+        # Stopping a server waits for the replies it is still sleeping on
+        'slow': FakeOpenAI(latency=1.5, jitter=0),
+        'good': FakeOpenAI(latency=0.01, jitter=0),
+    }
+
+    async def main():
+        urls = {name: await server.start() for name, server in servers.items()}
+        backends = {name: backend(name, urls[name], **settings.get(name, {})) for name in names}
+        router = ModelRouter(backends, {'default': list(names)})
+        try:
+            await router.chat_completion('default', **REQUEST)
+            return router.counters, router.wins
+        finally:
+            await router.close()
+            for server in servers.values():
+                await server.stop()
+
+    return asyncio.run(main())
+
+
+def test_server_error_fails_over_to_the_next_backend():
+    counters, wins = run_route(['broken', 'good'])
+    assert counters == {'slow_failovers': 0, 'error_failovers': 1}
+    assert wins == {'broken': 0, 'good': 1}
+
+
+def test_request_deadline_fails_over_to_the_next_backend():
+    counters, wins = run_route(['slow', 'good'], slow={'deadline': 0.3})
+    assert counters == {'slow_failovers': 0, 'error_failovers': 1}
+    assert wins == {'slow': 0, 'good': 1}
+
+
+def test_slow_backend_is_raced_by_the_next_one():
+    counters, wins = run_route(['slow', 'good'], slow={'failover_after': 0.2})
+    assert counters == {'slow_failovers': 1, 'error_failovers': 0}
+    assert wins == {'slow': 0, 'good': 1}
+
+
+def test_error_of_the_last_backend_when_all_fail():
+    with pytest.raises(APIStatusError) as error:
+        run_route(['slow', 'broken'], slow={'deadline': 0.3})
+    assert error.value.status_code == 503
+
+
+def test_unknown_backend_in_a_route():
+    with pytest.raises(ValueError):
+        ModelRouter({}, {'default': ['missing']})
@@ -0,0 +1,39 @@
+from bot.handlers.local_extraction import find_mrz, mrz_check_digit, parse_td3
+
+# ICAO 9303 part 4 specimen passport
+LINE1 = 'P<UTOERIKSSON<<ANNA<MARIA<<<<<<<<<<<<<<<<<<<'
+LINE2 = 'L898902C36UTO7408122F1204159ZE184226B<<<<<10'
+
+ERIKSSON = {
+    'driver_name': 'ERIKSSON ANNA MARIA',
+    'passport_number': 'L898902C3',
+    'date_of_birth': '12/08/1974',
+    'date_of_expiry': '15/04/2012',
+}
+
+
+def test_check_digits_of_the_specimen():
+    assert mrz_check_digit('L898902C3') == 6
+    assert mrz_check_digit('740812') == 2
+    assert mrz_check_digit('120415') == 9
+    assert mrz_check_digit('ZE184226B<<<<<') == 1
+
+
+def test_specimen_is_parsed():
+    assert parse_td3(LINE1, LINE2) == ERIKSSON
+
+
+def test_letter_o_read_for_zero_in_the_dates():
+    # 74O8122 and 12O4159: only positions that must be digits are fixed
+    line2 = LINE2[:15] + 'O' + LINE2[16:23] + 'O' + LINE2[24:]
+    assert parse_td3(LINE1, line2) == ERIKSSON
+
+
+def test_wrong_check_digit_is_rejected():
+    assert parse_td3(LINE1, LINE2[:19] + '3' + LINE2[20:]) is None
+    assert parse_td3(LINE1, LINE2[:43] + '1') is None
+
+
+def test_mrz_found_in_page_text_with_lost_fillers():
+    text = f"PASSPORT\n{LINE1[:-2]}\n{LINE2[:20]} {LINE2[20:]}\n"
+    assert find_mrz(text) == ERIKSSON
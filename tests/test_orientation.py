@@ -0,0 +1,42 @@
+import pytesseract
+from PIL import Image
+
+from bot.handlers.data_extraction import prepare_image
+
+LICENCE_TEXT = 'DAVLAT RAQAM BELGISI\n01 123 ABC'
+
+
+def count_ocr(monkeypatch, osd_confidence: float, text=lambda image: LICENCE_TEXT):
+    calls = []
+
+    def image_to_osd(image, output_type=None):
+        calls.append('osd')
+        return {'rotate': 0, 'orientation_conf': osd_confidence}
+
+    def image_to_string(image, **kwargs):
+        calls.append('ocr')
+        return text(image)
+
+    monkeypatch.setattr(pytesseract, 'image_to_osd', image_to_osd)
+    monkeypatch.setattr(pytesseract, 'image_to_string', image_to_string)
+    return calls
+
+
+def test_confident_osd_reads_the_page_once(monkeypatch):
+    calls = count_ocr(monkeypatch, osd_confidence=10.0, text=lambda image: '')
+    prepare_image(Image.new('RGB', (400, 300), 'white'), 1000)
+    assert calls == ['osd', 'ocr']
+
+
+def test_unsure_osd_stops_at_the_first_clear_rotation(monkeypatch):
+    calls = count_ocr(monkeypatch, osd_confidence=0.5)
+    prepared = prepare_image(Image.new('RGB', (400, 300), 'white'), 1000)
+    assert calls == ['osd', 'ocr']
+    assert prepared.doc_type == 'vehicle_licence'
+
+
+def test_no_keywords_skip_the_full_resolution_scan(monkeypatch):
+    calls = count_ocr(monkeypatch, osd_confidence=0.5, text=lambda image: '')
+    prepare_image(Image.new('RGB', (400, 300), 'white'), 1000)
+    # Four probes, and the page text of the upright probe is reused for the fields
+    assert calls == ['osd'] + ['ocr'] * 4
@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(script: str, tmp_path) -> str:
+    """Run a script against the bot's dispatcher, in a fresh interpreter with the benchmark settings."""
+    path = tmp_path / 'probe.py'
+    path.write_text(textwrap.dedent(script))
+    result = subprocess.run([sys.executable, str(path)], cwd=tmp_path, env={**os.environ, 'PYTHONPATH': ROOT},
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    return result.stdout.strip().splitlines()[-1]
+
+
+def test_batch_starts_from_an_open_form(tmp_path):
+    assert run("""
+        import asyncio
+        from benchmarks.pipeline import configure_environment
+        configure_environment('.')
+
+        from aiogram.fsm.storage.base import StorageKey
+        from benchmarks.fake_telegram import TelegramDriver
+        from bot.app import create_dispatcher
+
+        async def main():
+            dp = create_dispatcher()
+            driver = TelegramDriver(dp)
+            for step in ('/new_form', '/batch'):
+                await driver.send_text(1, step)
+            await driver.close()
+            print(await dp.storage.get_state(StorageKey(driver.bot.id, 1, 1)))
+
+        asyncio.run(main())
+    """, tmp_path) == 'BatchFlow:collecting'
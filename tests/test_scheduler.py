@@ -0,0 +1,66 @@
+import asyncio
+
+from bot.handlers import extraction_executor
+from bot.handlers.scheduler import FairScheduler
+
+
+class NoCache:
+    async def get(self, digest, phash):
+        return None
+
+
+def test_cancelled_waiters_leave_the_queue():
+    async def main():
+        scheduler = FairScheduler(max_running=1, chat_quota=1, max_queue=10, weights={})
+        running, queued = scheduler.admit(1, 2)
+
+        async def job(ticket):
+            try:
+                await ticket.wait()
+                await asyncio.sleep(1)
+            finally:
+                scheduler.finish(ticket)
+
+        tasks = [asyncio.create_task(job(ticket)) for ticket in (running, queued)]
+        await asyncio.sleep(0)
+        for task in tasks:
+            task.cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        assert all(isinstance(result, asyncio.CancelledError) for result in results)
+        assert scheduler.metrics()['scheduler_queued'] == 0
+        assert scheduler.metrics()['scheduler_running'] == 0
+
+    asyncio.run(main())
+
+
+def test_duplicate_uploads_over_quota_finish(monkeypatch):
+    calls = []
+
+    async def extract_new(file_data, file_name, digest, phash, chat_id=None):
+        calls.append(file_name)
+        await asyncio.sleep(0.05)
+        yield {'driver_name': 'IVANOV IVAN'}
+
+    async def main():
+        scheduler = FairScheduler(max_running=4, chat_quota=2, max_queue=10, weights={})
+        monkeypatch.setattr(extraction_executor, 'extraction_scheduler', scheduler)
+        tickets = scheduler.admit(1, 3)
+        assert tickets[2].state == 'queued'
+
+        async def upload(ticket):
+            return [result async for result in extraction_executor.extract_file_documents(
+                b'same file', 'passport.jpg', 1, ticket)]
+
+        # The queued upload hashes first
+        third = asyncio.create_task(upload(tickets[2]))
+        await asyncio.sleep(0.02)
+        results = await asyncio.wait_for(
+            asyncio.gather(upload(tickets[0]), upload(tickets[1]), third), timeout=5)
+        assert results == [[{'driver_name': 'IVANOV IVAN'}]] * 3
+        assert scheduler.metrics()['scheduler_running'] == 0
+
+    monkeypatch.setattr(extraction_executor, 'extraction_cache', NoCache())
+    monkeypatch.setattr(extraction_executor, 'extract_new_file_documents', extract_new)
+    asyncio.run(main())
+    assert len(calls) == 1
+    extraction_executor.extraction_executor.shutdown()
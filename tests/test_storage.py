@@ -0,0 +1,54 @@
+import asyncio
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+
+from bot.storage import SQLiteStorage, pending_upload, state_lock, upload_cancelled, uploads_pending
+
+KEY = StorageKey(bot_id=1, chat_id=1, user_id=1)
+
+
+def test_state_lock_is_shared_by_the_workers_of_one_file(tmp_path):
+    path = str(tmp_path / 'fsm.sqlite3')
+
+    async def main():
+        # Two workers, each with its own storage on the same file
+        first, second = SQLiteStorage(path), SQLiteStorage(path)
+        events = []
+
+        async def merge(storage, name):
+            async with state_lock(FSMContext(storage, KEY)):
+                events.append(f'{name} in')
+                await asyncio.sleep(0.2)
+                events.append(f'{name} out')
+
+        await asyncio.gather(merge(first, 'a'), merge(second, 'b'))
+        assert events in (['a in', 'a out', 'b in', 'b out'], ['b in', 'b out', 'a in', 'a out'])
+        await first.close()
+        await second.close()
+
+    asyncio.run(main())
+
+
+def test_upload_marks_are_seen_and_cancelled_from_another_worker(tmp_path):
+    path = str(tmp_path / 'fsm.sqlite3')
+
+    async def main():
+        first, second = SQLiteStorage(path), SQLiteStorage(path)
+        uploading, other = FSMContext(first, KEY), FSMContext(second, KEY)
+
+        async with pending_upload(uploading) as upload:
+            assert await uploads_pending(other) == 1
+            # /end on the other worker
+            await other.clear()
+            assert upload_cancelled(await uploading.get_data(), upload)
+        # The finished upload doesn't write into the new form
+        assert await other.get_data() == {}
+
+        async with pending_upload(uploading) as upload:
+            assert not upload_cancelled(await other.get_data(), upload)
+        assert await uploads_pending(other) == 0
+        await first.close()
+        await second.close()
+
+    asyncio.run(main())
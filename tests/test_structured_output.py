@@ -0,0 +1,78 @@
+from bot.handlers.structured_output import (
+    ExtractedDocument,
+    ExtractionResponse,
+    fields_model,
+    fields_to_reask,
+    parse_model,
+    strict_json_schema,
+)
+
+
+def walk(node):
+    yield node
+    children = node.values() if isinstance(node, dict) else node if isinstance(node, list) else []
+    for child in children:
+        yield from walk(child)
+
+
+def objects(schema):
+    return [node for node in walk(schema) if isinstance(node, dict) and node.get('type') == 'object']
+
+
+def test_strict_schema_requires_every_property():
+    schema = strict_json_schema(ExtractionResponse)
+    document = schema['$defs']['ExtractedDocument']
+
+    assert len(objects(schema)) == 2
+    for node in objects(schema):
+        assert node['required'] == list(node['properties'])
+        assert node['additionalProperties'] is False
+    # Optional fields stay nullable instead of being left out
+    assert document['properties']['driver_name'] == {'anyOf': [{'type': 'string'}, {'type': 'null'}]}
+    assert not any('title' in node or 'default' in node for node in walk(schema) if isinstance(node, dict))
+
+
+def test_strict_schema_leaves_the_model_alone():
+    strict_json_schema(ExtractionResponse)
+    assert 'title' in ExtractionResponse.model_json_schema()
+
+
+def test_reask_schema_has_only_the_asked_fields():
+    schema = strict_json_schema(fields_model(['passport_number', 'number_plates']))
+    assert schema['required'] == ['passport_number', 'number_plates']
+    assert schema['additionalProperties'] is False
+
+
+def passport(**fields):
+    return ExtractedDocument(document_type='passport', **fields)
+
+
+def test_fields_to_reask():
+    complete = {
+        'driver_name': 'Ivanov Ivan Ivanovich',
+        'passport_number': 'AA 1234567',
+        'passport_authority': 'MIA 12345',
+        'passport_date_issued': '01/02/2015',
+    }
+    assert fields_to_reask(passport(**complete)) == []
+
+    # Missing and malformed fields of a document that was read
+    assert fields_to_reask(passport(**{**complete, 'passport_authority': None})) == ['passport_authority']
+    assert fields_to_reask(passport(**{**complete, 'driver_name': 'Ivanov', 'passport_date_issued': '2015-02-01'})) == [
+        'driver_name', 'passport_date_issued']
+    assert fields_to_reask(passport(**{**complete, 'passport_date_issued': '01/02/1900'})) == ['passport_date_issued']
+
+    licence = ExtractedDocument(document_type='vehicle_licence', number_plates='01 123 ABC / 10 7777 XY')
+    assert fields_to_reask(licence) == []
+    assert fields_to_reask(licence.model_copy(update={'number_plates': '01 123 AB'})) == ['number_plates']
+
+    # Nothing read: e.g. the back side of a licence, not worth another call
+    assert fields_to_reask(ExtractedDocument(document_type='vehicle_licence')) == []
+    assert fields_to_reask(ExtractedDocument(document_type='other', driver_name='x')) == []
+
+
+def test_malformed_reply_is_none():
+    assert parse_model('{"documents": [{"document_type": "passport"}]}', ExtractionResponse).documents[0].driver_name is None
+    assert parse_model('{"documents": [{"document_type": "selfie"}]}', ExtractionResponse) is None
+    assert parse_model('not json', ExtractionResponse) is None
+    assert parse_model(None, ExtractionResponse) is None
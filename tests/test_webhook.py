@@ -0,0 +1,52 @@
+import asyncio
+import os
+import signal
+import socket
+
+import aiohttp
+from aiohttp import web
+
+from bot.webhook import Health, serve
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_readiness_turns_off_before_the_listener_closes():
+    async def main():
+        health = Health()
+        health.ready = True
+        drained = []
+        app = web.Application()
+        app.router.add_get('/readyz', health.readiness)
+
+        async def on_shutdown(app):
+            drained.append(health.ready)
+
+        app.on_shutdown.append(on_shutdown)
+
+        port = free_port()
+        server = asyncio.create_task(serve(app, health, '127.0.0.1', port, stop_delay=0.5))
+        url = f'http://127.0.0.1:{port}/readyz'
+        async with aiohttp.ClientSession() as session:
+            for _ in range(50):
+                try:
+                    async with session.get(url) as response:
+                        assert response.status == 200
+                        break
+                except aiohttp.ClientConnectionError:
+                    await asyncio.sleep(0.05)
+
+            os.kill(os.getpid(), signal.SIGTERM)
+            await asyncio.sleep(0.1)
+            # Still listening, but out of the load balancer
+            async with session.get(url) as response:
+                assert response.status == 503
+
+        await asyncio.wait_for(server, timeout=5)
+        assert drained == [False]
+
+    asyncio.run(main())
@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROBE = "sorted(name for name in ('aiogram', 'aiohttp', 'openai') if name in __import__('sys').modules)"
+
+
+def run(script: str, tmp_path) -> str:
+    path = tmp_path / 'probe.py'
+    path.write_text(textwrap.dedent(script))
+    env = {**os.environ, 'PYTHONPATH': ROOT, 'EXTRACTION_PROCESS_WORKERS': '2'}
+    result = subprocess.run([sys.executable, str(path)], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    return result.stdout.strip()
+
+
+def test_main_imports_nothing_in_workers(tmp_path):
+    # Workers run main.py as __mp_main__
+    assert run(f"""
+        import runpy, sys
+        runpy.run_path({os.path.join(ROOT, 'main.py')!r}, run_name='__mp_main__')
+        print('aiogram' in sys.modules)
+    """, tmp_path) == 'False'
+
+
+def test_workers_do_not_import_the_bot(tmp_path):
+    assert run(f"""
+        import asyncio
+        from bot.handlers.extraction_executor import extraction_executor
+
+        async def main():
+            return await extraction_executor.warm_up(eval, {PROBE!r})
+
+        if __name__ == '__main__':
+            print(asyncio.run(main()))
+            extraction_executor.shutdown()
+    """, tmp_path) == '[[], []]'
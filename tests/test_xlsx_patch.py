@@ -0,0 +1,105 @@
+import io
+import re
+import zipfile
+
+import openpyxl
+import pytest
+from openpyxl.styles import Font
+
+from bot.handlers.form_templates import DEFAULT_CELLS, FORM_LAYOUTS, form_templates
+from bot.handlers.xlsx_patch import load_template, patch_template
+
+
+def read_sheet(data: bytes):
+    return openpyxl.load_workbook(io.BytesIO(data)).active
+
+
+# openpyxl drops the logo shapes of a template when reading it back
+@pytest.mark.filterwarnings('ignore:DrawingML support is incomplete')
+@pytest.mark.parametrize('organisation', sorted(FORM_LAYOUTS))
+def test_every_field_lands_in_its_cell(organisation):
+    template = form_templates.get(organisation)
+    values = {key: f'{key} значение & <{i}>' for i, key in enumerate(template.cells)}
+    before = read_sheet(template.render({}))
+
+    sheet = read_sheet(template.render(values))
+    for key, cell in template.cells.items():
+        assert sheet[cell].value == values[key], (key, cell)
+        # The template's formatting of the cell is kept
+        assert sheet[cell].style_id == before[cell].style_id
+
+    untouched = {cell for row in before.iter_rows() for cell in (c.coordinate for c in row)} - set(template.cells.values())
+    assert all(sheet[cell].value == before[cell].value for cell in untouched)
+
+
+def test_layouts_override_the_default_cells():
+    assert form_templates.get('palisandr').cells == {**DEFAULT_CELLS, 'vendor_name': 'E27'}
+
+
+def sheet_template(shared: bool):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet['A1'] = 'old'
+    sheet['A1'].font = Font(bold=True)
+    sheet['C3'] = 'middle'
+    sheet.row_dimensions[5].height = 30
+    sheet['A7'] = 'last'
+    output = io.BytesIO()
+    workbook.save(output)
+    if not shared:
+        return output.getvalue()
+
+    # Same workbook with a shared strings table, as Excel saves it
+    with zipfile.ZipFile(output) as archive:
+        parts = {name: archive.read(name) for name in archive.namelist()}
+    parts['xl/sharedStrings.xml'] = (
+        b'<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" count="1" uniqueCount="1">'
+        b'<si><t>kept</t></si></sst>'
+    )
+    parts['xl/worksheets/sheet1.xml'] = parts['xl/worksheets/sheet1.xml'].replace(
+        b'<row r="7">', b'<row r="6"><c r="B6" t="s"><v>0</v></c></row><row r="7">')
+    parts['xl/_rels/workbook.xml.rels'] = parts['xl/_rels/workbook.xml.rels'].replace(
+        b'</Relationships>',
+        b'<Relationship Id="rIdS" Target="sharedStrings.xml" '
+        b'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings"/></Relationships>')
+    parts['[Content_Types].xml'] = parts['[Content_Types].xml'].replace(
+        b'</Types>',
+        b'<Override PartName="/xl/sharedStrings.xml" '
+        b'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/></Types>')
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w') as archive:
+        for name, data in parts.items():
+            archive.writestr(name, data)
+    return output.getvalue()
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_cells_of_every_sheet_layout(shared):
+    template = load_template(sheet_template(shared))
+    assert (template.shared_strings_path is not None) == shared
+
+    values = {
+        'A1': 'replaced',   # existing cell
+        'B3': 'before',     # existing row, before its cell
+        'D3': 'after',      # existing row, after its cell
+        'B5': 'empty row',  # row without cells
+        'C2': 'new row',    # row that doesn't exist, between two others
+        'A9': 'new last',   # row past the last one
+    }
+    data = patch_template(template, values)
+    sheet = read_sheet(data)
+
+    for cell, value in values.items():
+        assert sheet[cell].value == value, cell
+    assert sheet['A1'].font.bold
+    assert sheet['C3'].value == 'middle'
+    assert sheet['A7'].value == 'last'
+    assert sheet.row_dimensions[5].height == 30
+    if shared:
+        assert sheet['B6'].value == 'kept'
+
+    # Cells and rows stay in order, as Excel requires
+    xml = zipfile.ZipFile(io.BytesIO(data)).read('xl/worksheets/sheet1.xml').decode()
+    assert re.findall(r'<c r="([A-Z]+3)"', xml) == ['B3', 'C3', 'D3']
+    rows = [int(row) for row in re.findall(r'<row r="(\d+)"', xml)]
+    assert rows == sorted(rows)